@@ -0,0 +1,259 @@
+"""
+Scaling Benchmark for Transit Network Analysis
+Times and memory-profiles each analyzer stage and chart generation on synthetic networks
+"""
+
+import io
+import os
+import sys
+import json
+import math
+import time
+import platform
+import argparse
+import contextlib
+import subprocess
+import multiprocessing
+from datetime import datetime, timezone
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List
+import numpy as np
+
+from instrumentation import StageProfiler, find_regressions, REGRESSION_THRESHOLD, MIN_COMPARE_SECONDS
+from synthetic_network import SyntheticNetworkGenerator, parse_size, DEFAULT_OVERLAP, DEFAULT_SEED
+
+
+DEFAULT_SIZES = ('small', 'medium')
+DEFAULT_DATA_DIR = 'data/benchmarks/datasets'
+DEFAULT_OUTPUT = 'data/benchmarks/benchmark_results.json'
+
+# Growth exponent (time ∝ routes^k) between consecutive sizes flagged as a scaling cliff
+SCALING_CLIFF_EXPONENT = 1.5
+
+
+# ==================== DATASETS ====================
+
+def prepare_dataset(size: str, overlap: float, seed: int, data_dir: str = DEFAULT_DATA_DIR) -> Dict:
+    """Generate (or reuse) the synthetic dataset for one size"""
+    routes, stops = parse_size(size)
+    dataset_dir = os.path.join(data_dir, f"{routes}x{stops}_overlap{overlap:g}_seed{seed}")
+    bus_details_path = os.path.join(dataset_dir, 'busDetails.ndjson')
+    stops_path = os.path.join(dataset_dir, 'stops.json')
+
+    dataset = {'size': size, 'routes': routes, 'stops': stops, 'overlap': overlap, 'seed': seed,
+               'bus_details': bus_details_path, 'stops_path': stops_path, 'generate_s': None}
+    if not (os.path.exists(bus_details_path) and os.path.exists(stops_path)):
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            SyntheticNetworkGenerator(routes, stops, overlap=overlap, seed=seed).write(bus_details_path, stops_path)
+        dataset['generate_s'] = time.perf_counter() - start
+
+    dataset['bus_details_mb'] = os.path.getsize(bus_details_path) / 1e6
+    return dataset
+
+
+# ==================== BENCHMARK RUN ====================
+
+def run_stages(dataset: Dict, work_dir: str, charts: bool = True, trace_memory: bool = False,
+               centrality: bool = False) -> Dict:
+    """Run every stage on one dataset in this process and return its metrics"""
+    from network_analysis import TransitNetworkAnalyzer
+    from results_io import save_results
+
+    profiler = StageProfiler(trace_memory=trace_memory)
+    results_dir = os.path.join(work_dir, 'analysis_results')
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        with profiler.stage('load'):
+            analyzer = TransitNetworkAnalyzer(dataset['bus_details'], dataset['stops_path'])
+        with profiler.stage('indexes'):
+            analyzer.warm_caches()
+        results = analyzer.run_full_analysis(profiler=profiler, centrality=centrality)
+        with profiler.stage('save'):
+            save_results(results, results_dir)
+
+        if charts:
+            from generate_charts import ChartGenerator
+            with profiler.stage('charts'):
+                ChartGenerator(results_dir, os.path.join(work_dir, 'charts')).generate_all_charts(force=True)
+
+    return {
+        'stages': profiler.stages,
+        'edges': len(analyzer.get_edge_index()['edges']),
+        'network_efficiency_score': results['summary']['network_efficiency_score']
+    }
+
+
+def _run_isolated(dataset: Dict, work_dir: str, charts: bool, trace_memory: bool, centrality: bool) -> Dict:
+    """Run the stages in a fresh process, so peak RSS belongs to this dataset alone"""
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context('fork' if 'fork' in methods else None)
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+        return pool.submit(run_stages, dataset, work_dir, charts, trace_memory, centrality).result()
+
+
+def benchmark(sizes=DEFAULT_SIZES, overlap: float = DEFAULT_OVERLAP, seed: int = DEFAULT_SEED,
+              repeat: int = 1, charts: bool = True, trace_memory: bool = False, centrality: bool = False,
+              data_dir: str = DEFAULT_DATA_DIR) -> Dict:
+    """
+    Benchmark every stage at each size
+    Each repetition runs in its own process; a stage reports its fastest
+    wall time across repetitions and the largest memory figures.
+    """
+    runs = []
+    for size in sizes:
+        dataset = prepare_dataset(size, overlap, seed, data_dir)
+        if dataset['generate_s'] is not None:
+            print(f"Generated {size} dataset ({dataset['routes']} routes, {dataset['stops']} stops) "
+                  f"in {dataset['generate_s']:.1f}s")
+
+        samples = [_run_isolated(dataset, os.path.join(data_dir, 'work'), charts, trace_memory, centrality)
+                   for _ in range(repeat)]
+        stages = {}
+        for stage in samples[0]['stages']:
+            values = [sample['stages'][stage] for sample in samples]
+            stages[stage] = {**values[0], **{
+                key: (min if key in ('wall_s', 'cpu_s', 'children_cpu_s') else max)(
+                    v[key] for v in values if v.get(key) is not None)
+                for key, value in values[0].items() if isinstance(value, (int, float))
+            }}
+
+        run = {
+            'size': size,
+            'routes': dataset['routes'],
+            'stops': dataset['stops'],
+            'edges': samples[0]['edges'],
+            'bus_details_mb': dataset['bus_details_mb'],
+            'network_efficiency_score': samples[0]['network_efficiency_score'],
+            'stages': stages,
+            'total_wall_s': sum(s['wall_s'] for s in stages.values())
+        }
+        runs.append(run)
+        print(f"✓ {size}: {run['total_wall_s']:.2f}s total")
+
+    return {
+        'generated_at': datetime.now(timezone.utc).isoformat(),
+        'environment': _environment(),
+        'config': {'sizes': list(sizes), 'overlap': overlap, 'seed': seed, 'repeat': repeat,
+                   'charts': charts, 'trace_memory': trace_memory, 'centrality': centrality},
+        'runs': runs,
+        'scaling': scaling_exponents(runs)
+    }
+
+
+def _environment() -> Dict:
+    import scipy
+    import matplotlib
+
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                                text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+
+    return {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'scipy': scipy.__version__,
+        'matplotlib': matplotlib.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'git_commit': commit
+    }
+
+
+# ==================== ANALYSIS OF RESULTS ====================
+
+def scaling_exponents(runs: List[Dict]) -> List[Dict]:
+    """
+    Per-stage growth exponent k (time ∝ routes^k) between consecutive sizes
+    k near 1 is linear; k above SCALING_CLIFF_EXPONENT is flagged as a cliff.
+    """
+    ordered = sorted(runs, key=lambda run: run['routes'])
+    scaling = []
+    for small, large in zip(ordered, ordered[1:]):
+        if large['routes'] == small['routes']:
+            continue
+        ratio = math.log(large['routes'] / small['routes'])
+        for stage, metrics in large['stages'].items():
+            before = small['stages'].get(stage, {}).get('wall_s')
+            if not before or before < MIN_COMPARE_SECONDS or metrics['wall_s'] <= 0:
+                continue
+            exponent = math.log(metrics['wall_s'] / before) / ratio
+            scaling.append({'stage': stage, 'from': small['size'], 'to': large['size'],
+                            'exponent': exponent, 'cliff': exponent > SCALING_CLIFF_EXPONENT})
+    return scaling
+
+
+def compare_to_baseline(report: Dict, baseline: Dict, threshold: float = REGRESSION_THRESHOLD) -> List[Dict]:
+    """Stages at least `threshold` times slower than in the baseline report, matched by network size"""
+    baseline_runs = {(run['routes'], run['stops']): run for run in baseline.get('runs', [])}
+    regressions = []
+    for run in report['runs']:
+        previous = baseline_runs.get((run['routes'], run['stops']))
+        if previous is not None:
+            regressions.extend({'size': run['size'], **regression}
+                               for regression in find_regressions(run['stages'], previous['stages'], threshold))
+    return regressions
+
+
+def print_report(report: Dict):
+    """Stage table per size, then scaling cliffs and regressions"""
+    for run in report['runs']:
+        print(f"\n{run['size']}: {run['routes']} routes, {run['stops']} stops, {run['edges']} edges, "
+              f"{run['bus_details_mb']:.1f} MB bus details")
+        print(f"  {'stage':<10} {'wall s':>9} {'cpu s':>9} {'RSS MB':>8} {'peak RSS MB':>12} {'traced MB':>10}")
+        for stage, m in run['stages'].items():
+            mb = {key: f"{m[key]:.1f}" if m.get(key) is not None else '-'
+                  for key in ('rss_mb', 'peak_rss_mb', 'traced_peak_mb')}
+            print(f"  {stage:<10} {m['wall_s']:>9.3f} {m['cpu_s']:>9.3f} {mb['rss_mb']:>8} "
+                  f"{mb['peak_rss_mb']:>12} {mb['traced_peak_mb']:>10}")
+
+    cliffs = [s for s in report['scaling'] if s['cliff']]
+    for s in cliffs:
+        print(f"✗ Scaling cliff: {s['stage']} grows as routes^{s['exponent']:.2f} from {s['from']} to {s['to']}")
+    for r in report.get('regressions', []):
+        print(f"✗ Regression: {r['size']} {r['stage']} {r['wall_s']:.3f}s vs {r['baseline_s']:.3f}s "
+              f"({r['ratio']:.2f}x)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark analysis stages on synthetic networks")
+    parser.add_argument('--sizes', default=','.join(DEFAULT_SIZES),
+                        help="Comma-separated named sizes or ROUTESxSTOPS (e.g. small,medium,2000x20000)")
+    parser.add_argument('--overlap', type=float, default=DEFAULT_OVERLAP)
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED)
+    parser.add_argument('--repeat', type=int, default=1, help="Runs per size (fastest time is kept)")
+    parser.add_argument('--no-charts', action='store_true', help="Skip the chart generation stage")
+    parser.add_argument('--centrality', action='store_true', help="Include the centrality stage")
+    parser.add_argument('--tracemalloc', action='store_true',
+                        help="Also trace peak Python allocations per stage (slows pure-Python stages)")
+    parser.add_argument('--data-dir', default=DEFAULT_DATA_DIR, help="Where generated datasets are kept")
+    parser.add_argument('--output', default=DEFAULT_OUTPUT, help="Benchmark report JSON")
+    parser.add_argument('--baseline', default=None, help="Earlier report to check for regressions")
+    parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD,
+                        help="Slowdown ratio reported as a regression")
+    args = parser.parse_args()
+
+    report = benchmark([size.strip() for size in args.sizes.split(',') if size.strip()],
+                       overlap=args.overlap, seed=args.seed, repeat=args.repeat,
+                       charts=not args.no_charts, trace_memory=args.tracemalloc, centrality=args.centrality,
+                       data_dir=args.data_dir)
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        if any(baseline.get('config', {}).get(key, False) != report['config'][key]
+               for key in ('trace_memory', 'centrality')):
+            print("Baseline used different allocation tracing or stages; timings not compared")
+        else:
+            report['regressions'] = compare_to_baseline(report, baseline, args.threshold)
+
+    os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+
+    print_report(report)
+    print(f"\nBenchmark report saved to {args.output}")
+    if report.get('regressions'):
+        sys.exit(1)
@@ -2,12 +2,43 @@ import requests
 import json
 import os
 import time
+import random
+import asyncio
+import argparse
+import hashlib
+from datetime import datetime, timezone
 
-def fetch_bus_list():
+from polyline_codec import encode_route_geometry, decode_route_geometry, DEFAULT_PRECISION
+
+try:
+    import aiohttp
+except ImportError:  # Only required for the concurrent fetch mode
+    aiohttp = None
+
+# Base URL of the Ayna API (override to point the fetcher at a local stand-in server)
+API_BASE_URL = os.environ.get('AYNA_API_BASE_URL', 'https://map-api.ayna.gov.az/api')
+
+# Concurrent fetch defaults
+DEFAULT_CONCURRENCY = 8
+DEFAULT_TIMEOUT = 30  # seconds per request
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF = 0.5  # seconds, base of the exponential backoff
+MAX_RETRY_AFTER = 60  # seconds; longer Retry-After hints are capped
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+# Incremental refresh defaults
+CACHE_DIR = 'data/cache/busDetails'
+DEFAULT_MAX_AGE_HOURS = 168  # re-fetch cached routes older than a week
+
+# Route geometry storage: 'polyline' encodes routes[].flowCoordinates (see polyline_codec.py)
+GEOMETRY_FORMATS = ('polyline', 'raw')
+DEFAULT_GEOMETRY = 'polyline'
+
+def fetch_bus_list(base_url=API_BASE_URL):
     """
     Fetch the list of all bus IDs from the Ayna API.
     """
-    url = "https://map-api.ayna.gov.az/api/bus/getBusList"
+    url = f"{base_url}/bus/getBusList"
 
     try:
         print("Fetching bus list from API...")
@@ -25,11 +56,11 @@ def fetch_bus_list():
         print(f"Error decoding JSON response: {e}")
         return None
 
-def fetch_bus_details(bus_id):
+def fetch_bus_details(bus_id, base_url=API_BASE_URL):
     """
     Fetch detailed information for a specific bus ID.
     """
-    url = f"https://map-api.ayna.gov.az/api/bus/getBusById?id={bus_id}"
+    url = f"{base_url}/bus/getBusById?id={bus_id}"
 
     try:
         response = requests.get(url)
@@ -43,51 +74,438 @@ def fetch_bus_details(bus_id):
         print(f"Error decoding JSON response for bus ID {bus_id}: {e}")
         return None
 
-def fetch_all_bus_details():
-    """
-    Fetch details for all buses and save to JSON file.
+def fetch_details_sequential(bus_list, base_url=API_BASE_URL, on_result=None):
     """
-    # First, get the list of all bus IDs
-    bus_list = fetch_bus_list()
-    if not bus_list:
-        print("Failed to fetch bus list. Exiting.")
-        return
+    Fetch details for each bus one at a time.
+    Returns a list aligned with bus_list (None for failed buses).
 
-    # Fetch details for each bus
-    all_bus_details = []
+    If on_result is given, it is called with (bus, details) as each bus
+    arrives and only a success flag is kept in the returned list.
+    """
+    results = []
     total_buses = len(bus_list)
 
-    print(f"\nFetching details for {total_buses} buses...")
-
     for idx, bus in enumerate(bus_list, 1):
         bus_id = bus['id']
         bus_number = bus['number']
 
         print(f"[{idx}/{total_buses}] Fetching bus #{bus_number} (ID: {bus_id})...", end=' ')
 
-        details = fetch_bus_details(bus_id)
-
-        if details:
-            all_bus_details.append(details)
-            print("✓")
+        details = fetch_bus_details(bus_id, base_url)
+        if on_result is not None:
+            on_result(bus, details)
+            results.append(bool(details))
         else:
-            print("✗")
+            results.append(details)
+        print("✓" if details else "✗")
 
         # Add a small delay to avoid overwhelming the server
         time.sleep(0.1)
 
-    print(f"\nSuccessfully fetched details for {len(all_bus_details)}/{total_buses} buses")
+    return results
+
+async def _fetch_bus_details_async(session, semaphore, bus_id, base_url, retries, backoff):
+    """
+    Fetch details for one bus, retrying transient failures with jittered exponential backoff.
+    """
+    url = f"{base_url}/bus/getBusById?id={bus_id}"
+
+    for attempt in range(retries + 1):
+        retry_after = None
+        async with semaphore:
+            try:
+                async with session.get(url) as response:
+                    if response.status in RETRYABLE_STATUSES and attempt < retries:
+                        retry_after = response.headers.get('Retry-After')
+                        raise aiohttp.ClientResponseError(
+                            response.request_info, response.history,
+                            status=response.status, message=response.reason
+                        )
+                    response.raise_for_status()
+                    return await response.json(content_type=None)
+
+            except aiohttp.ClientResponseError as e:
+                if e.status not in RETRYABLE_STATUSES or attempt == retries:
+                    print(f"Error fetching details for bus ID {bus_id}: {e.status} {e.message}")
+                    return None
+            except (aiohttp.ClientError, asyncio.TimeoutError, json.JSONDecodeError) as e:
+                if attempt == retries:
+                    print(f"Error fetching details for bus ID {bus_id}: {e!r}")
+                    return None
+
+        # Honour the server's Retry-After hint (capped), otherwise back off exponentially with full jitter
+        if retry_after is not None and retry_after.isdigit():
+            delay = min(float(retry_after), MAX_RETRY_AFTER)
+        else:
+            delay = random.uniform(0, backoff * (2 ** attempt))
+        await asyncio.sleep(delay)
+
+    return None
+
+async def _fetch_details_concurrent(bus_list, concurrency, timeout, retries, backoff, base_url, on_result):
+    """Fetch details for all buses on a pooled session with bounded concurrency"""
+    results = [None] * len(bus_list)
+    total_buses = len(bus_list)
+    completed = 0
+
+    semaphore = asyncio.Semaphore(concurrency)
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    client_timeout = aiohttp.ClientTimeout(total=timeout)
+
+    async with aiohttp.ClientSession(connector=connector, timeout=client_timeout) as session:
 
+        async def fetch_one(idx, bus):
+            nonlocal completed
+            details = await _fetch_bus_details_async(
+                session, semaphore, bus['id'], base_url, retries, backoff
+            )
+            if on_result is not None:
+                on_result(bus, details)
+                results[idx] = bool(details)
+            else:
+                results[idx] = details
+            completed += 1
+            status = "✓" if details else "✗"
+            print(f"[{completed}/{total_buses}] Fetched bus #{bus['number']} (ID: {bus['id']})... {status}")
+
+        await asyncio.gather(*(fetch_one(idx, bus) for idx, bus in enumerate(bus_list)))
+
+    return results
+
+def fetch_details_concurrent(bus_list, concurrency=DEFAULT_CONCURRENCY, timeout=DEFAULT_TIMEOUT,
+                             retries=DEFAULT_RETRIES, backoff=DEFAULT_BACKOFF, base_url=API_BASE_URL,
+                             on_result=None):
+    """
+    Fetch details for all buses concurrently using asyncio and a pooled HTTP session.
+    Returns a list aligned with bus_list (None for failed buses).
+
+    If on_result is given, it is called with (bus, details) in completion
+    order and only a success flag is kept in the returned list.
+    """
+    if aiohttp is None:
+        raise ImportError("Concurrent fetch mode requires aiohttp (pip install aiohttp)")
+
+    return asyncio.run(
+        _fetch_details_concurrent(bus_list, concurrency, timeout, retries, backoff, base_url, on_result)
+    )
+
+def is_ndjson(path):
+    """Whether a bus details path uses the NDJSON (one route per line) format"""
+    return path.endswith('.ndjson')
+
+def _write_ndjson_line(f, details):
+    """Append one route as a single NDJSON line and flush it to disk"""
+    f.write(json.dumps(details, ensure_ascii=False, separators=(',', ':')))
+    f.write('\n')
+    f.flush()
+
+def _recover_ndjson(path):
+    """
+    Return the bus IDs already written to a partial NDJSON file.
+    A line truncated by a crash is cut off so appending can resume cleanly;
+    that includes a complete record whose newline was never written.
+    """
+    if not os.path.exists(path):
+        return set()
+
+    done_ids = set()
+    good_offset = 0
+    with open(path, 'rb') as f:
+        for line in f:
+            if not line.endswith(b'\n'):
+                break
+            try:
+                done_ids.add(json.loads(line)['id'])
+            except (json.JSONDecodeError, UnicodeDecodeError, KeyError, TypeError):
+                break
+            good_offset += len(line)
+
+    with open(path, 'rb+') as f:
+        f.truncate(good_offset)
+
+    return done_ids
+
+def prepare_details(details, geometry=DEFAULT_GEOMETRY, precision=DEFAULT_PRECISION):
+    """Apply the geometry storage format to a fetched bus details record"""
+    if details and geometry == 'polyline':
+        return encode_route_geometry(details, precision)
+    return details
+
+def save_bus_details(all_bus_details, output_path='data/busDetails.json'):
+    """
+    Save bus details to a JSON file, or an NDJSON file if the path ends in .ndjson.
+    `all_bus_details` may be any iterable; NDJSON output is written as it is consumed.
+    """
     # Ensure data directory exists
-    os.makedirs('data', exist_ok=True)
+    os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
 
-    # Save to JSON file
-    output_path = 'data/busDetails.json'
     with open(output_path, 'w', encoding='utf-8') as f:
-        json.dump(all_bus_details, f, ensure_ascii=False, indent=2)
+        if is_ndjson(output_path):
+            for details in all_bus_details:
+                _write_ndjson_line(f, details)
+        else:
+            json.dump(list(all_bus_details), f, ensure_ascii=False, indent=2)
 
     print(f"Bus details saved to {output_path}")
+
+def _fetch_all_bus_details_ndjson(bus_list, fetch, output_path):
+    """
+    Stream bus details to NDJSON as each bus arrives.
+
+    Routes are appended to `<output_path>.partial` and flushed line by line,
+    so a crash mid-fetch keeps every completed route; the next run resumes
+    from the partial file and only fetches the remaining buses.
+    """
+    os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+    partial_path = f"{output_path}.partial"
+
+    done_ids = _recover_ndjson(partial_path)
+    if done_ids:
+        print(f"Resuming: {len(done_ids)} routes already saved in {partial_path}")
+    remaining = [bus for bus in bus_list if bus['id'] not in done_ids]
+
+    with open(partial_path, 'a', encoding='utf-8') as f:
+        def on_result(bus, details):
+            if details:
+                _write_ndjson_line(f, details)
+
+        results = fetch(remaining, on_result)
+
+    os.replace(partial_path, output_path)
+    return len(done_ids) + sum(results)
+
+def fetch_all_bus_details(concurrency=None, timeout=DEFAULT_TIMEOUT, retries=DEFAULT_RETRIES,
+                          base_url=API_BASE_URL, output_path='data/busDetails.json',
+                          geometry=DEFAULT_GEOMETRY):
+    """
+    Fetch details for all buses and save to JSON file.
+
+    With concurrency=None buses are fetched sequentially; otherwise up to
+    `concurrency` requests are kept in flight on a shared connection pool.
+    If output_path ends in .ndjson, routes are streamed to disk as they
+    arrive instead of being held in memory, and the number of saved routes
+    is returned instead of the details list.
+    Route geometry is stored as encoded polylines unless geometry='raw'.
+    """
+    # First, get the list of all bus IDs
+    bus_list = fetch_bus_list(base_url)
+    if not bus_list:
+        print("Failed to fetch bus list. Exiting.")
+        return
+
+    total_buses = len(bus_list)
+
+    def fetch(buses, on_result=None):
+        if on_result is not None:
+            store = on_result
+            on_result = lambda bus, details: store(bus, prepare_details(details, geometry))
+        if concurrency:
+            results = fetch_details_concurrent(
+                buses, concurrency=concurrency, timeout=timeout, retries=retries,
+                base_url=base_url, on_result=on_result
+            )
+        else:
+            results = fetch_details_sequential(buses, base_url, on_result=on_result)
+        return results if on_result is not None else [prepare_details(d, geometry) for d in results]
+
+    if concurrency:
+        print(f"\nFetching details for {total_buses} buses (concurrency: {concurrency})...")
+    else:
+        print(f"\nFetching details for {total_buses} buses...")
+
+    if is_ndjson(output_path):
+        saved_count = _fetch_all_bus_details_ndjson(bus_list, fetch, output_path)
+        print(f"\nSuccessfully fetched details for {saved_count}/{total_buses} buses")
+        print(f"Bus details saved to {output_path}")
+        return saved_count
+
+    results = fetch(bus_list)
+
+    # Keep bus list order so both modes produce the same file
+    all_bus_details = [details for details in results if details]
+
+    print(f"\nSuccessfully fetched details for {len(all_bus_details)}/{total_buses} buses")
+
+    save_bus_details(all_bus_details, output_path)
     return all_bus_details
 
+def _details_hash(details):
+    """Content hash of a bus details record (independent of key order)"""
+    canonical = json.dumps(details, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+def _write_json_atomic(path, data, **dump_kwargs):
+    """Write JSON to a temporary file and move it into place"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, **dump_kwargs)
+    os.replace(tmp_path, path)
+
+def load_cache_index(cache_dir=CACHE_DIR):
+    """
+    Load the per-route cache index: {bus_id: {number, hash, fetched_at, geometry}}.
+    """
+    index_path = os.path.join(cache_dir, 'index.json')
+    if not os.path.exists(index_path):
+        return {}
+
+    with open(index_path, 'r', encoding='utf-8') as f:
+        return {int(bus_id): entry for bus_id, entry in json.load(f).items()}
+
+def fetch_all_bus_details_incremental(max_age_hours=DEFAULT_MAX_AGE_HOURS, concurrency=None,
+                                      timeout=DEFAULT_TIMEOUT, retries=DEFAULT_RETRIES,
+                                      base_url=API_BASE_URL, cache_dir=CACHE_DIR,
+                                      output_path='data/busDetails.json', geometry=DEFAULT_GEOMETRY):
+    """
+    Refresh bus details using a per-route on-disk cache.
+
+    Only routes that are new, missing from the cache or older than
+    `max_age_hours` are fetched. The combined output file is rebuilt from
+    the cache when anything changed. Cached routes stored in another
+    geometry format than `geometry` are converted in place (no re-fetch),
+    which also rebuilds the combined file. Returns a changed-route report.
+    """
+    bus_list = fetch_bus_list(base_url)
+    if not bus_list:
+        print("Failed to fetch bus list. Exiting.")
+        return
+
+    os.makedirs(cache_dir, exist_ok=True)
+    index = load_cache_index(cache_dir)
+    now = datetime.now(timezone.utc)
+
+    def cache_path(bus_id):
+        return os.path.join(cache_dir, f"{bus_id}.json")
+
+    def is_stale(bus_id):
+        entry = index.get(bus_id)
+        if entry is None or not os.path.exists(cache_path(bus_id)):
+            return True
+        age = now - datetime.fromisoformat(entry['fetched_at'])
+        return age.total_seconds() > max_age_hours * 3600
+
+    to_fetch = [bus for bus in bus_list if is_stale(bus['id'])]
+    print(f"\n{len(bus_list) - len(to_fetch)}/{len(bus_list)} routes fresh in cache, "
+          f"fetching {len(to_fetch)}...")
+
+    if concurrency:
+        results = fetch_details_concurrent(
+            to_fetch, concurrency=concurrency, timeout=timeout, retries=retries, base_url=base_url
+        )
+    else:
+        results = fetch_details_sequential(to_fetch, base_url)
+
+    report = {'added': [], 'updated': [], 'unchanged': [], 'removed': [], 'failed': [], 'reformatted': []}
+
+    for bus, details in zip(to_fetch, results):
+        bus_id = bus['id']
+        if not details:
+            report['failed'].append(bus['number'])
+            continue
+
+        content_hash = _details_hash(details)
+        previous = index.get(bus_id)
+        if previous is None:
+            report['added'].append(bus['number'])
+        elif previous['hash'] != content_hash or not os.path.exists(cache_path(bus_id)):
+            report['updated'].append(bus['number'])
+        else:
+            report['unchanged'].append(bus['number'])
+
+        _write_json_atomic(cache_path(bus_id), prepare_details(details, geometry), separators=(',', ':'))
+        index[bus_id] = {
+            'number': bus['number'],
+            'hash': content_hash,
+            'fetched_at': now.isoformat(),
+            'geometry': geometry
+        }
+
+    # Convert routes cached by a run with another --geometry (entries without one predate the field)
+    for bus in bus_list:
+        entry = index.get(bus['id'])
+        if entry is None or entry.get('geometry') == geometry or not os.path.exists(cache_path(bus['id'])):
+            continue
+        with open(cache_path(bus['id']), 'r', encoding='utf-8') as f:
+            details = decode_route_geometry(json.load(f))
+        _write_json_atomic(cache_path(bus['id']), prepare_details(details, geometry), separators=(',', ':'))
+        entry['geometry'] = geometry
+        report['reformatted'].append(bus['number'])
+
+    # Drop routes that are no longer in the bus list
+    current_ids = {bus['id'] for bus in bus_list}
+    for bus_id in sorted(set(index) - current_ids):
+        report['removed'].append(index.pop(bus_id)['number'])
+        if os.path.exists(cache_path(bus_id)):
+            os.remove(cache_path(bus_id))
+
+    _write_json_atomic(os.path.join(cache_dir, 'index.json'),
+                       {str(bus_id): entry for bus_id, entry in sorted(index.items())}, indent=2)
+
+    changed = report['added'] or report['updated'] or report['removed'] or report['reformatted']
+    if changed or not os.path.exists(output_path):
+        # Rebuild the combined file from the cache, in bus list order
+        def iter_cached_details():
+            for bus in bus_list:
+                if bus['id'] in index:
+                    with open(cache_path(bus['id']), 'r', encoding='utf-8') as f:
+                        yield json.load(f)
+
+        save_bus_details(iter_cached_details(), output_path)
+    else:
+        print(f"No route changes, {output_path} is up to date")
+
+    report['refreshed_at'] = now.isoformat()
+    _write_json_atomic(os.path.join(cache_dir, 'last_refresh.json'), report, indent=2)
+
+    print("\n=== Changed-Route Report ===")
+    for key in ['added', 'updated', 'removed', 'failed', 'reformatted']:
+        routes = report[key]
+        listed = ', '.join(map(str, routes[:20])) + (', ...' if len(routes) > 20 else '')
+        print(f"{key.capitalize()}: {len(routes)}" + (f" ({listed})" if routes else ""))
+    print(f"Unchanged: {len(report['unchanged'])}")
+
+    return report
+
 if __name__ == "__main__":
-    fetch_all_bus_details()
+    parser = argparse.ArgumentParser(description="Fetch bus route details from the Ayna API")
+    parser.add_argument('--concurrency', type=int, default=None,
+                        help=f"Fetch concurrently with this many requests in flight (e.g. {DEFAULT_CONCURRENCY})")
+    parser.add_argument('--timeout', type=float, default=DEFAULT_TIMEOUT,
+                        help="Per-request timeout in seconds (concurrent mode)")
+    parser.add_argument('--retries', type=int, default=DEFAULT_RETRIES,
+                        help="Retries per bus on transient errors (concurrent mode)")
+    parser.add_argument('--base-url', default=API_BASE_URL, help="API base URL")
+    parser.add_argument('--format', choices=['json', 'ndjson'], default='json',
+                        help="Output format; ndjson streams one route per line as it arrives")
+    parser.add_argument('--geometry', choices=GEOMETRY_FORMATS, default=DEFAULT_GEOMETRY,
+                        help="Route geometry storage; polyline encodes flowCoordinates (exact, decoded on demand)")
+    parser.add_argument('--output', default=None,
+                        help="Output file path (default: data/busDetails.<format>)")
+    parser.add_argument('--incremental', action='store_true',
+                        help="Only fetch new or stale routes using the per-route cache")
+    parser.add_argument('--max-age-hours', type=float, default=DEFAULT_MAX_AGE_HOURS,
+                        help="Re-fetch cached routes older than this (incremental mode)")
+    parser.add_argument('--cache-dir', default=CACHE_DIR, help="Per-route cache directory")
+    args = parser.parse_args()
+    output_path = args.output or f"data/busDetails.{args.format}"
+
+    if args.incremental:
+        fetch_all_bus_details_incremental(
+            max_age_hours=args.max_age_hours,
+            concurrency=args.concurrency,
+            timeout=args.timeout,
+            retries=args.retries,
+            base_url=args.base_url,
+            cache_dir=args.cache_dir,
+            output_path=output_path,
+            geometry=args.geometry
+        )
+    else:
+        fetch_all_bus_details(
+            concurrency=args.concurrency,
+            timeout=args.timeout,
+            retries=args.retries,
+            base_url=args.base_url,
+            output_path=output_path,
+            geometry=args.geometry
+        )
@@ -0,0 +1,244 @@
+"""
+Centrality Analysis for Transit Network Analysis
+Betweenness and closeness centrality of stops and edges (exact or sampled)
+"""
+
+import os
+import math
+import heapq
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional
+import numpy as np
+
+from transit_graph import TransitGraph
+
+
+# Graphs up to this many stops use every stop as a source by default
+EXACT_MAX_NODES = 2000
+
+# Sources sampled for larger graphs when neither samples nor epsilon is given
+DEFAULT_SAMPLES = 500
+
+# Confidence level of the reported sampling error bound
+DEFAULT_CONFIDENCE = 0.95
+
+# Sources handed to a worker process at a time
+SOURCES_PER_TASK = 64
+
+
+# Graph arrays of the current worker process (set by _init_worker)
+_worker_graph = None
+
+
+def _init_worker(indptr, indices, edge_ids, n_edges, weights):
+    global _worker_graph
+    _worker_graph = (indptr, indices, edge_ids, n_edges, weights)
+
+
+def _accumulate_sources(sources: List[int]) -> Dict[str, np.ndarray]:
+    """
+    Brandes dependency accumulation from each source in `sources`
+
+    Runs BFS (unweighted) or Dijkstra (weighted) from every source and
+    returns raw sums: node and edge dependencies, distances to every node
+    and how many sources reached it.
+    """
+    indptr, indices, edge_ids, n_edges, weights = _worker_graph
+    n_nodes = len(indptr) - 1
+
+    # Plain lists: element access is much cheaper than on NumPy arrays here
+    node_dependency = [0.0] * n_nodes
+    edge_dependency = [0.0] * n_edges
+    distance_sum = [0.0] * n_nodes
+    reach_count = [0] * n_nodes
+
+    for s in sources:
+        sigma = [0] * n_nodes
+        dist = [-1] * n_nodes
+        delta = [0.0] * n_nodes
+        sigma[s] = 1
+        order = []
+
+        if weights is None:
+            # BFS; predecessors are neighbours one hop closer, found again on the way back
+            dist[s] = 0
+            queue = deque([s])
+            while queue:
+                v = queue.popleft()
+                order.append(v)
+                dv = dist[v] + 1
+                sv = sigma[v]
+                for w in indices[indptr[v]:indptr[v + 1]]:
+                    if dist[w] < 0:
+                        dist[w] = dv
+                        queue.append(w)
+                    if dist[w] == dv:
+                        sigma[w] += sv
+
+            for w in reversed(order):
+                dw = dist[w] - 1
+                coefficient = (1.0 + delta[w]) / sigma[w]
+                for pos in range(indptr[w], indptr[w + 1]):
+                    v = indices[pos]
+                    if dist[v] == dw:
+                        contribution = sigma[v] * coefficient
+                        delta[v] += contribution
+                        edge_dependency[edge_ids[pos]] += contribution
+        else:
+            # Dijkstra; predecessors recorded as they are relaxed
+            preds = {s: []}
+            seen = {s: 0.0}
+            heap = [(0.0, s)]
+            while heap:
+                dv, v = heapq.heappop(heap)
+                if dist[v] >= 0:
+                    continue
+                dist[v] = dv
+                order.append(v)
+                for pos in range(indptr[v], indptr[v + 1]):
+                    w = indices[pos]
+                    if dist[w] >= 0:
+                        continue
+                    dw = dv + weights[edge_ids[pos]]
+                    if w not in seen or dw < seen[w]:
+                        seen[w] = dw
+                        sigma[w] = sigma[v]
+                        preds[w] = [(v, edge_ids[pos])]
+                        heapq.heappush(heap, (dw, w))
+                    elif dw == seen[w]:
+                        sigma[w] += sigma[v]
+                        preds[w].append((v, edge_ids[pos]))
+
+            for w in reversed(order):
+                coefficient = (1.0 + delta[w]) / sigma[w]
+                for v, e in preds[w]:
+                    contribution = sigma[v] * coefficient
+                    delta[v] += contribution
+                    edge_dependency[e] += contribution
+
+        for w in order:
+            if w != s:
+                node_dependency[w] += delta[w]
+                distance_sum[w] += dist[w]
+                reach_count[w] += 1
+
+    return {
+        'node_dependency': np.array(node_dependency),
+        'edge_dependency': np.array(edge_dependency),
+        'distance_sum': np.array(distance_sum),
+        'reach_count': np.array(reach_count, dtype=np.int64)
+    }
+
+
+def hoeffding_error_bound(samples: int, n_nodes: int, confidence: float = DEFAULT_CONFIDENCE) -> float:
+    """
+    Additive error on normalized betweenness from source sampling
+
+    With probability >= confidence, every stop's estimate is within this
+    bound of its exact value (Hoeffding's inequality, union bound over stops).
+    """
+    if n_nodes <= 2 or samples <= 0:
+        return 0.0
+    value_range = n_nodes / (n_nodes - 1)
+    return value_range * math.sqrt(math.log(2 * n_nodes / (1 - confidence)) / (2 * samples))
+
+
+def samples_for_error(epsilon: float, n_nodes: int, confidence: float = DEFAULT_CONFIDENCE) -> int:
+    """Sources needed to reach a Hoeffding error bound of epsilon"""
+    value_range = n_nodes / (n_nodes - 1) if n_nodes > 1 else 1.0
+    return math.ceil(value_range ** 2 * math.log(2 * n_nodes / (1 - confidence)) / (2 * epsilon ** 2))
+
+
+def compute_centrality(graph: TransitGraph, weights: Optional[np.ndarray] = None,
+                       samples: Optional[int] = None, epsilon: Optional[float] = None,
+                       confidence: float = DEFAULT_CONFIDENCE, seed: int = 42,
+                       workers: Optional[int] = None) -> Dict:
+    """
+    Betweenness and closeness centrality on the undirected stop graph
+
+    weights: optional length of each undirected edge (by edge id); shortest
+    paths count hops when omitted. All stops are sources up to
+    EXACT_MAX_NODES stops; larger graphs sample `samples` sources (or enough
+    for an error bound of `epsilon`) and scale the estimates up.
+    Per-source passes are split across `workers` processes (all CPUs by
+    default; 1 runs in-process).
+
+    Returns node arrays aligned with graph.stop_ids ('betweenness',
+    'closeness'), 'edge_betweenness' by edge id, and the sampling details.
+    """
+    n_nodes = graph.n_nodes
+    if epsilon is not None:
+        samples = samples_for_error(epsilon, n_nodes, confidence)
+    elif samples is None and n_nodes > EXACT_MAX_NODES:
+        samples = DEFAULT_SAMPLES
+
+    exact = samples is None or samples >= n_nodes
+    if exact:
+        sources = np.arange(n_nodes)
+    else:
+        sources = np.sort(np.random.default_rng(seed).choice(n_nodes, size=samples, replace=False))
+
+    graph_arrays = (
+        graph.indptr.tolist(), graph.indices.tolist(), graph.edge_ids.tolist(), graph.n_edges,
+        None if weights is None else np.asarray(weights, dtype=np.float64).tolist()
+    )
+    chunks = [sources[i:i + SOURCES_PER_TASK].tolist() for i in range(0, len(sources), SOURCES_PER_TASK)]
+
+    workers = workers or os.cpu_count() or 1
+    if workers > 1 and len(chunks) > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(chunks)), initializer=_init_worker,
+                                 initargs=graph_arrays) as pool:
+            partials = list(pool.map(_accumulate_sources, chunks))
+    else:
+        _init_worker(*graph_arrays)
+        partials = [_accumulate_sources(chunk) for chunk in chunks]
+
+    totals = {key: sum(p[key] for p in partials) for key in partials[0]} if partials else {
+        'node_dependency': np.zeros(n_nodes), 'edge_dependency': np.zeros(graph.n_edges),
+        'distance_sum': np.zeros(n_nodes), 'reach_count': np.zeros(n_nodes, dtype=np.int64)
+    }
+
+    # Each unordered pair is counted from both ends; scale sampled sums to all sources
+    scale = n_nodes / len(sources) if len(sources) else 0.0
+    betweenness = totals['node_dependency'] * scale / ((n_nodes - 1) * (n_nodes - 2)) if n_nodes > 2 \
+        else np.zeros(n_nodes)
+    edge_betweenness = totals['edge_dependency'] * scale / (n_nodes * (n_nodes - 1)) if n_nodes > 1 \
+        else np.zeros(graph.n_edges)
+
+    # Closeness from distances to the sources (paths are symmetric), scaled by the
+    # share of sources reached so disconnected parts are not over-rated
+    source_count = np.full(n_nodes, len(sources), dtype=np.float64)
+    source_count[sources] -= 1
+    reached = totals['reach_count'].astype(np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        closeness = np.where(
+            totals['distance_sum'] > 0,
+            (reached / np.maximum(source_count, 1)) * reached / totals['distance_sum'],
+            0.0
+        )
+
+    return {
+        'stop_ids': graph.stop_ids,
+        'betweenness': betweenness,
+        'closeness': closeness,
+        'edge_betweenness': edge_betweenness,
+        'mode': 'exact' if exact else 'sampled',
+        'weighted': weights is not None,
+        'samples': len(sources),
+        'error_bound': 0.0 if exact else hoeffding_error_bound(len(sources), n_nodes, confidence),
+        'confidence': confidence
+    }
+
+
+def rank_hubs(centrality: Dict, limit: int = 50) -> List[Dict]:
+    """Stops ranked by betweenness (ties by closeness), highest first"""
+    order = np.lexsort((-centrality['closeness'], -centrality['betweenness']))[:limit]
+    return [
+        {
+            'stop_id': int(centrality['stop_ids'][i]),
+            'betweenness': float(centrality['betweenness'][i]),
+            'closeness': float(centrality['closeness'][i])
+        }
+        for i in order.tolist()
+    ]
@@ -0,0 +1,392 @@
+"""
+Stop Consolidation What-If Simulator for Transit Network Analysis
+Applies stop merges and removals and updates network metrics incrementally
+"""
+
+import json
+import argparse
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Set
+import numpy as np
+
+from network_analysis import TransitNetworkAnalyzer
+
+
+# Same thresholds as TransitNetworkAnalyzer.analyze_stop_spacing
+DENSE_THRESHOLD_KM = 0.2
+SPARSE_THRESHOLD_KM = 2.0
+
+
+def _kth_smallest(base_sorted: np.ndarray, removed_sorted: np.ndarray, added_sorted: np.ndarray, k: int) -> float:
+    """
+    k-th smallest value (0-based) of base - removed + added without materializing it
+    `removed` must be a sub-multiset of `base`; all arrays sorted.
+    """
+    def count_le(value):
+        return (np.searchsorted(base_sorted, value, 'right') - np.searchsorted(removed_sorted, value, 'right')
+                + np.searchsorted(added_sorted, value, 'right'))
+
+    # Smallest base value with more than k values at or below it
+    lo, hi = 0, len(base_sorted)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if count_le(base_sorted[mid]) > k:
+            hi = mid
+        else:
+            lo = mid + 1
+    best = base_sorted[lo] if lo < len(base_sorted) else np.inf
+
+    # An added value may come first
+    if len(added_sorted):
+        qualifying = added_sorted[count_le(added_sorted) > k]
+        if len(qualifying):
+            best = min(best, qualifying[0])
+    return float(best)
+
+
+class ConsolidationSimulator:
+    """
+    What-if evaluation of stop consolidation plans
+
+    A plan merges stops into other stops ({'merge': {stop: into_stop}})
+    and/or removes stops ({'remove': [stop, ...]}). Only the route
+    sequences that serve an affected stop are rebuilt; overlap, spacing,
+    waste and the efficiency score are updated from the baseline by deltas
+    on the edges and segments those sequences change.
+    """
+
+    def __init__(self, analyzer: TransitNetworkAnalyzer):
+        self.analyzer = analyzer
+        edge_index = analyzer.get_edge_index()
+        incidence = analyzer.get_route_edge_incidence()
+        edge_lengths = analyzer.get_edge_lengths()
+
+        self.sequence_stops = edge_index['sequence_stops']
+        self.sequence_edges = edge_index['sequence_edges']
+        self.edge_ids = edge_index['edge_ids']
+        self.edge_length = edge_lengths['length_km']
+        self.edge_indexed = edge_lengths['indexed']
+
+        # Route rows of the incidence matrix and the sequences of each route
+        self.routes = incidence['routes']
+        self.route_rows = {route: row for row, route in enumerate(self.routes)}
+        self.matrix = incidence['matrix']
+        self.matrix_csc = self.matrix.tocsc()
+        self.bus_numbers = [bus['number'] for bus in analyzer.buses]
+        self.route_sequences = defaultdict(list)
+        for k in range(len(self.sequence_stops)):
+            self.route_sequences[self.bus_numbers[k // 2]].append(k)
+
+        # Sequences serving each stop
+        lengths = [len(stops) for stops in self.sequence_stops]
+        all_stops = np.concatenate(self.sequence_stops) if lengths else np.empty(0, dtype=np.int64)
+        all_sequences = np.repeat(np.arange(len(lengths)), lengths)
+        order = np.argsort(all_stops, kind='stable')
+        self._stop_keys = all_stops[order]
+        self._stop_sequences = all_sequences[order]
+
+        # Baseline aggregates
+        self.edge_counts = analyzer.get_edge_route_counts()
+        self.route_edge_counts = np.diff(self.matrix.indptr)
+        self.route_duplicated = self.matrix @ (self.edge_counts > 1).astype(np.int64)
+
+        bus_spacings = [
+            self.edge_length[np.concatenate(self.sequence_edges[2 * b:2 * b + 2])]
+            for b in range(len(analyzer.buses))
+        ]
+        self.spacings_sorted = np.sort(np.concatenate(bus_spacings)) if bus_spacings else np.empty(0)
+        self.total_vehicle_km = sum(bus.get('routLength', 0) for bus in analyzer.buses)
+
+        self.baseline = self._metrics(
+            total_edges=int(np.count_nonzero(self.edge_counts)),
+            overlapping_edges=int(np.count_nonzero(self.edge_counts > 1)),
+            duplicated=self.route_duplicated, edge_totals=self.route_edge_counts,
+            spacing_count=len(self.spacings_sorted), spacing_sum=float(self.spacings_sorted.sum()),
+            dense=int(np.count_nonzero(self.spacings_sorted < DENSE_THRESHOLD_KM)),
+            sparse=int(np.count_nonzero(self.spacings_sorted > SPARSE_THRESHOLD_KM)),
+            median=float(np.median(self.spacings_sorted)) if len(self.spacings_sorted) else 0,
+            wasted_km=float(np.where(self.edge_indexed, np.maximum(self.edge_counts - 1, 0), 0)
+                            @ self.edge_length) if len(self.edge_counts) else 0.0
+        )
+
+    # ==================== PLAN APPLICATION ====================
+
+    def _touched_sequences(self, stops: Iterable[int]) -> np.ndarray:
+        stops = np.asarray(sorted(set(stops)), dtype=np.int64)
+        if not len(stops):
+            return np.empty(0, dtype=np.int64)
+        start = np.searchsorted(self._stop_keys, stops, 'left')
+        end = np.searchsorted(self._stop_keys, stops, 'right')
+        return np.unique(np.concatenate([self._stop_sequences[s:e] for s, e in zip(start, end)]))
+
+    def _apply(self, stops: np.ndarray, merge: Dict[int, int], remove: Set[int]) -> np.ndarray:
+        """New stop sequence after merges and removals"""
+        stops = stops.tolist()
+        new_stops, mapped = [], []
+        for stop in stops:
+            if stop in remove:
+                continue
+            target = merge.get(stop, stop)
+            changed = target != stop
+            # A merged stop next to its target collapses into one stop
+            if new_stops and new_stops[-1] == target and (changed or mapped[-1]):
+                mapped[-1] = True
+                continue
+            new_stops.append(target)
+            mapped.append(changed)
+        return np.array(new_stops, dtype=np.int64)
+
+    def _edges_of(self, stops: np.ndarray, new_edges: Dict) -> np.ndarray:
+        """Edge ids of a stop sequence's segments, assigning ids past the index to unseen edges"""
+        ids = []
+        for a, b in zip(stops[:-1].tolist(), stops[1:].tolist()):
+            edge = (a, b) if a <= b else (b, a)
+            edge_id = self.edge_ids.get(edge)
+            if edge_id is None:
+                edge_id = new_edges.setdefault(edge, len(self.edge_length) + len(new_edges))
+            ids.append(edge_id)
+        return np.array(ids, dtype=np.int64)
+
+    # ==================== SIMULATION ====================
+
+    def simulate(self, plan: Dict) -> Dict:
+        """
+        Metrics of the network after applying a consolidation plan
+
+        plan: {'merge': {stop_id: into_stop_id}, 'remove': [stop_id, ...]}
+        Returns the updated overlap, spacing and waste summaries, the
+        efficiency score, its change from the baseline, and the touched routes.
+        """
+        merge = {int(k): int(v) for k, v in plan.get('merge', {}).items() if int(k) != int(v)}
+        for stop in list(merge):
+            # Follow chains (a -> b, b -> c) to their final stop
+            target, seen = merge[stop], {stop}
+            while target in merge and target not in seen:
+                seen.add(target)
+                target = merge[target]
+            merge[stop] = target
+        remove = set(int(s) for s in plan.get('remove', []))
+        touched = self._touched_sequences(list(merge) + list(remove))
+
+        # Rebuild touched sequences
+        new_edges = {}
+        new_sequence_edges = {}
+        for k in touched.tolist():
+            stops = self._apply(self.sequence_stops[k], merge, remove)
+            new_sequence_edges[k] = self._edges_of(stops, new_edges)
+
+        new_lengths = np.empty(0)
+        new_indexed = np.empty(0, dtype=bool)
+        if new_edges:
+            pairs = np.array(list(new_edges), dtype=np.int64)
+            table = self.analyzer.get_stop_coordinates()
+            new_lengths = self.analyzer.pairwise_distances(pairs[:, 0], pairs[:, 1])
+            new_indexed = (table['in_index'][self.analyzer.stop_positions(pairs[:, 0])] &
+                           table['in_index'][self.analyzer.stop_positions(pairs[:, 1])])
+        lengths = np.concatenate([self.edge_length, new_lengths])
+        indexed = np.concatenate([self.edge_indexed, new_indexed])
+        base_counts = np.concatenate([self.edge_counts, np.zeros(len(new_edges), dtype=self.edge_counts.dtype)])
+
+        # Overlap: edge count deltas from the touched routes' old and new edge sets
+        touched_routes = sorted({self.bus_numbers[k // 2] for k in touched.tolist()})
+        count_delta = defaultdict(int)
+        route_new_edges = {}
+        for route in touched_routes:
+            old_set = set()
+            row = self.route_rows.get(route)
+            if row is not None:
+                old_set = set(self.matrix.indices[self.matrix.indptr[row]:self.matrix.indptr[row + 1]].tolist())
+            new_set = set()
+            for k in self.route_sequences[route]:
+                new_set.update(new_sequence_edges.get(k, self.sequence_edges[k]).tolist())
+            route_new_edges[route] = new_set
+            for e in old_set - new_set:
+                count_delta[e] -= 1
+            for e in new_set - old_set:
+                count_delta[e] += 1
+
+        changed = np.array(sorted(e for e, d in count_delta.items() if d), dtype=np.int64)
+        old_counts = base_counts[changed]
+        new_counts = old_counts + np.array([count_delta[e] for e in changed.tolist()], dtype=np.int64)
+        counts = base_counts.copy()
+        counts[changed] = new_counts
+
+        total_edges = self.baseline['overlap']['total_edges'] + int(
+            np.count_nonzero(new_counts > 0) - np.count_nonzero(old_counts > 0))
+        flips = (new_counts > 1).astype(np.int64) - (old_counts > 1).astype(np.int64)
+        overlapping_edges = self.baseline['overlap']['overlapping_edges'] + int(flips.sum())
+
+        # Duplicated edges per route: flips update untouched routes, touched routes are recounted
+        duplicated = self.route_duplicated.copy()
+        edge_totals = self.route_edge_counts.copy()
+        for e, flip in zip(changed.tolist(), flips.tolist()):
+            if flip and e < self.matrix_csc.shape[1]:
+                rows = self.matrix_csc.indices[self.matrix_csc.indptr[e]:self.matrix_csc.indptr[e + 1]]
+                duplicated[rows] += flip
+        for route, edges in route_new_edges.items():
+            row = self.route_rows.get(route)
+            if row is not None:
+                edge_list = np.fromiter(edges, dtype=np.int64, count=len(edges))
+                duplicated[row] = int(np.count_nonzero(counts[edge_list] > 1))
+                edge_totals[row] = len(edge_list)
+
+        # Spacing: swap the touched sequences' segment lengths
+        removed = np.concatenate([self.edge_length[self.sequence_edges[k]] for k in touched.tolist()]) \
+            if len(touched) else np.empty(0)
+        added = np.concatenate([lengths[new_sequence_edges[k]] for k in touched.tolist()]) \
+            if len(touched) else np.empty(0)
+        base = self.baseline['spacing']
+        spacing_count = base['segments'] - len(removed) + len(added)
+        spacing_sum = base['total_km'] - removed.sum() + added.sum()
+        dense = base['overly_dense_segments'] - int(np.count_nonzero(removed < DENSE_THRESHOLD_KM)) + \
+            int(np.count_nonzero(added < DENSE_THRESHOLD_KM))
+        sparse_count = base['overly_sparse_segments'] - int(np.count_nonzero(removed > SPARSE_THRESHOLD_KM)) + \
+            int(np.count_nonzero(added > SPARSE_THRESHOLD_KM))
+        median = self._median(np.sort(removed), np.sort(added), spacing_count)
+
+        # Waste: excess routes over the changed edges
+        old_excess = np.maximum(old_counts - 1, 0)
+        new_excess = np.maximum(new_counts - 1, 0)
+        wasted_km = self.baseline['waste']['wasted_vehicle_km']
+        if len(changed):
+            wasted_km += float(((new_excess - old_excess) * indexed[changed]) @ lengths[changed])
+
+        result = self._metrics(total_edges, overlapping_edges, duplicated, edge_totals,
+                               spacing_count, spacing_sum, dense, sparse_count, median, wasted_km)
+        result['score_delta'] = result['network_efficiency_score'] - self.baseline['network_efficiency_score']
+        result['touched_routes'] = touched_routes
+        result['route_spacings'] = self._route_spacings(touched, new_sequence_edges, lengths)
+        return result
+
+    def _median(self, removed_sorted: np.ndarray, added_sorted: np.ndarray, count: int) -> float:
+        if count <= 0:
+            return 0
+        upper = _kth_smallest(self.spacings_sorted, removed_sorted, added_sorted, count // 2)
+        if count % 2:
+            return upper
+        return (_kth_smallest(self.spacings_sorted, removed_sorted, added_sorted, count // 2 - 1) + upper) / 2
+
+    def _route_spacings(self, touched: np.ndarray, new_sequence_edges: Dict, lengths: np.ndarray) -> Dict:
+        """Spacing statistics of the touched buses after the plan"""
+        route_spacings = {}
+        for bus_idx in sorted({k // 2 for k in touched.tolist()}):
+            spacings = np.concatenate([
+                lengths[new_sequence_edges.get(k, self.sequence_edges[k])] for k in (2 * bus_idx, 2 * bus_idx + 1)
+            ])
+            if len(spacings):
+                route_spacings[self.bus_numbers[bus_idx]] = {
+                    'mean_spacing': float(np.mean(spacings)),
+                    'min_spacing': float(np.min(spacings)),
+                    'max_spacing': float(np.max(spacings)),
+                    'std_spacing': float(np.std(spacings))
+                }
+        return route_spacings
+
+    def _metrics(self, total_edges, overlapping_edges, duplicated, edge_totals,
+                 spacing_count, spacing_sum, dense, sparse, median, wasted_km) -> Dict:
+        """Summary metrics in the shape of run_full_analysis(), plus the efficiency score"""
+        has_edges = edge_totals > 0
+        duplication_index = duplicated[has_edges] / edge_totals[has_edges] * 100
+        avg_duplication_index = float(np.mean(duplication_index)) if len(duplication_index) else 0
+
+        overlap = {
+            'total_edges': total_edges,
+            'overlapping_edges': overlapping_edges,
+            'overlap_percentage': (overlapping_edges / total_edges * 100) if total_edges > 0 else 0,
+            'avg_duplication_index': avg_duplication_index
+        }
+        spacing = {
+            'segments': spacing_count,
+            'total_km': spacing_sum,
+            'network_mean_spacing': spacing_sum / spacing_count if spacing_count else 0,
+            'network_median_spacing': median,
+            'overly_dense_segments': dense,
+            'overly_sparse_segments': sparse,
+            'dense_percentage': (dense / spacing_count * 100) if spacing_count else 0
+        }
+        waste = {
+            'total_vehicle_km': self.total_vehicle_km,
+            'wasted_vehicle_km': wasted_km,
+            'waste_percentage': (wasted_km / self.total_vehicle_km * 100) if self.total_vehicle_km > 0 else 0,
+            'network_redundancy_coefficient': avg_duplication_index / 100
+        }
+        score = TransitNetworkAnalyzer._compute_efficiency_score(None, overlap, spacing, waste)
+
+        return {'overlap': overlap, 'spacing': spacing, 'waste': waste, 'network_efficiency_score': score}
+
+    # ==================== BATCH EVALUATION ====================
+
+    def evaluate_batch(self, plans: List[Dict], top: Optional[int] = None) -> List[Dict]:
+        """
+        Simulate many plans; returns compact results ranked by score gain
+        Each result holds the plan index, score, score delta and headline metrics.
+        """
+        results = []
+        for i, plan in enumerate(plans):
+            outcome = self.simulate(plan)
+            results.append({
+                'plan': i,
+                'network_efficiency_score': outcome['network_efficiency_score'],
+                'score_delta': outcome['score_delta'],
+                'overlap_percentage': outcome['overlap']['overlap_percentage'],
+                'waste_percentage': outcome['waste']['waste_percentage'],
+                'dense_percentage': outcome['spacing']['dense_percentage'],
+                'touched_routes': len(outcome['touched_routes'])
+            })
+
+        results.sort(key=lambda r: -r['score_delta'])
+        return results[:top]
+
+
+def plans_from_clusters(clusters: List[Dict], stop_routes: Dict[int, Set[str]]) -> List[Dict]:
+    """One merge plan per consolidation cluster: every stop merges into the one serving most routes"""
+    plans = []
+    for cluster in clusters:
+        stops = cluster['stops']
+        target = max(stops, key=lambda s: (len(stop_routes.get(s, ())), -s))
+        plans.append({'merge': {s: target for s in stops if s != target}})
+    return plans
+
+
+if __name__ == "__main__":
+    import time
+
+    parser = argparse.ArgumentParser(description="Evaluate stop consolidation plans")
+    parser.add_argument('--bus-details', default='data/busDetails.json',
+                        help="Bus details file (.json or .ndjson)")
+    parser.add_argument('--stops', default='data/stops.json', help="Stops file")
+    parser.add_argument('--radius', type=float, default=200,
+                        help="Cluster radius in metres for generated merge plans")
+    parser.add_argument('--plans', default=None,
+                        help="JSON file with a list of plans ({'merge': {...}, 'remove': [...]}) to evaluate")
+    parser.add_argument('--top', type=int, default=20)
+    parser.add_argument('--output', default='data/consolidation_plans.json')
+    args = parser.parse_args()
+
+    analyzer = TransitNetworkAnalyzer(args.bus_details, args.stops)
+    simulator = ConsolidationSimulator(analyzer)
+
+    if args.plans:
+        with open(args.plans, 'r', encoding='utf-8') as f:
+            plans = json.load(f)
+    else:
+        stop_routes = defaultdict(set)
+        for bus_number, _, stops_in_direction in analyzer.get_route_sequences():
+            for stop_seq in stops_in_direction:
+                stop_routes[stop_seq['stopId']].add(bus_number)
+        plans = plans_from_clusters(analyzer.find_consolidation_clusters(args.radius), stop_routes)
+
+    started = time.perf_counter()
+    ranked = simulator.evaluate_batch(plans, top=args.top)
+    elapsed = time.perf_counter() - started
+
+    print(f"\nEvaluated {len(plans)} plans in {elapsed:.2f} s "
+          f"(baseline score {simulator.baseline['network_efficiency_score']:.2f})")
+    for result in ranked[:10]:
+        print(f"  Plan {result['plan']}: score {result['network_efficiency_score']:.2f} "
+              f"({result['score_delta']:+.3f}), {result['touched_routes']} routes touched")
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump([dict(result, **{'changes': plans[result['plan']]}) for result in ranked],
+                  f, indent=2, ensure_ascii=False)
+    print(f"\nRanked plans saved to {args.output}")
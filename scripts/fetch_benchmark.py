@@ -0,0 +1,128 @@
+"""
+Fetch Benchmark against the Local Ayna API Stand-in
+Compares sequential and concurrent bus detail fetching under reproducible latency and faults
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import contextlib
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+from busDetails import (fetch_bus_list, fetch_details_sequential, fetch_details_concurrent,
+                        DEFAULT_TIMEOUT, DEFAULT_RETRIES, DEFAULT_BACKOFF)
+from mock_ayna_server import (MockAynaServer, add_fault_arguments, add_snapshot_arguments,
+                              fault_profile_from_args, snapshot_from_args)
+
+
+DEFAULT_CONCURRENCY_LEVELS = (4, 8, 16)
+DEFAULT_OUTPUT = 'data/benchmarks/fetch_benchmark.json'
+
+
+def run_mode(server: MockAynaServer, bus_list: List[Dict], concurrency: Optional[int] = None,
+             timeout: float = DEFAULT_TIMEOUT, retries: int = DEFAULT_RETRIES,
+             backoff: float = DEFAULT_BACKOFF) -> Dict:
+    """
+    Fetch every bus once, sequentially (concurrency=None) or concurrently
+    The server is reset first, so every mode meets the same latencies and faults.
+    Fetched records are checked against the snapshot.
+    """
+    server.reset()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        if concurrency is None:
+            results = fetch_details_sequential(bus_list, server.base_url)
+        else:
+            results = fetch_details_concurrent(bus_list, concurrency=concurrency, timeout=timeout,
+                                               retries=retries, backoff=backoff, base_url=server.base_url)
+    wall = time.perf_counter() - start
+
+    fetched = [details for details in results if details]
+    mismatched = sum(1 for details in fetched
+                     if json.loads(server.snapshot.buses[details['id']]) != details)
+    return {
+        'mode': 'sequential' if concurrency is None else 'concurrent',
+        'concurrency': concurrency or 1,
+        'wall_s': wall,
+        'buses': len(bus_list),
+        'fetched': len(fetched),
+        'failed': len(bus_list) - len(fetched),
+        'mismatched': mismatched,
+        'buses_per_s': len(fetched) / wall if wall > 0 else None,
+        'server': dict(server.stats)
+    }
+
+
+def benchmark_fetch(server: MockAynaServer, concurrency_levels=DEFAULT_CONCURRENCY_LEVELS,
+                    sequential: bool = True, limit: Optional[int] = None, **fetch_kwargs) -> Dict:
+    """Run the sequential mode and each concurrency level against a started server"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        bus_list = fetch_bus_list(server.base_url)
+    if not bus_list:
+        raise RuntimeError(f"Could not fetch the bus list from {server.base_url}")
+    bus_list = bus_list[:limit] if limit else bus_list
+
+    modes = ([None] if sequential else []) + list(concurrency_levels)
+    runs = []
+    for concurrency in modes:
+        run = run_mode(server, bus_list, concurrency, **fetch_kwargs)
+        runs.append(run)
+        print(f"✓ {run['mode']} x{run['concurrency']}: {run['wall_s']:.2f}s, "
+              f"{run['fetched']}/{run['buses']} fetched, {run['server']['requests']} requests")
+
+    return {
+        'generated_at': datetime.now(timezone.utc).isoformat(),
+        'server': {'seed': server.seed, 'faults': server.faults.describe(),
+                   'snapshot_buses': len(server.snapshot.bus_list)},
+        'buses': len(bus_list),
+        'runs': runs
+    }
+
+
+def print_report(report: Dict):
+    print(f"\n{report['buses']} buses, faults: {report['server']['faults']}")
+    print(f"  {'mode':<12} {'conc':>5} {'wall s':>8} {'buses/s':>8} {'fetched':>8} {'failed':>7} "
+          f"{'requests':>9} {'429s':>5} {'5xx':>5} {'cut':>5}")
+    for run in report['runs']:
+        server = run['server']
+        rate = f"{run['buses_per_s']:.1f}" if run['buses_per_s'] is not None else '-'
+        print(f"  {run['mode']:<12} {run['concurrency']:>5} {run['wall_s']:>8.2f} {rate:>8} "
+              f"{run['fetched']:>8} {run['failed']:>7} {server['requests']:>9} {server['throttled']:>5} "
+              f"{server['errors']:>5} {server['truncated']:>5}")
+    for run in report['runs']:
+        if run['mismatched']:
+            print(f"✗ {run['mode']} x{run['concurrency']}: {run['mismatched']} records differ from the snapshot")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark sequential and concurrent fetching on a local API")
+    add_snapshot_arguments(parser)
+    add_fault_arguments(parser)
+    parser.add_argument('--concurrency', default=','.join(map(str, DEFAULT_CONCURRENCY_LEVELS)),
+                        help="Comma-separated concurrency levels to run")
+    parser.add_argument('--no-sequential', action='store_true', help="Skip the sequential mode")
+    parser.add_argument('--limit', type=int, default=None, help="Fetch only the first N buses")
+    parser.add_argument('--timeout', type=float, default=DEFAULT_TIMEOUT)
+    parser.add_argument('--retries', type=int, default=DEFAULT_RETRIES)
+    parser.add_argument('--backoff', type=float, default=DEFAULT_BACKOFF)
+    parser.add_argument('--output', default=DEFAULT_OUTPUT, help="Benchmark report JSON")
+    args = parser.parse_args()
+
+    levels = [int(level) for level in args.concurrency.split(',') if level.strip()]
+    with MockAynaServer(snapshot_from_args(args), fault_profile_from_args(args), port=0, seed=args.seed) as server:
+        print(f"Serving {len(server.snapshot.bus_list)} buses at {server.base_url}")
+        report = benchmark_fetch(server, levels, sequential=not args.no_sequential, limit=args.limit,
+                                 timeout=args.timeout, retries=args.retries, backoff=args.backoff)
+
+    os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+
+    print_report(report)
+    print(f"\nFetch benchmark report saved to {args.output}")
+    if any(run['mismatched'] for run in report['runs']):
+        sys.exit(1)
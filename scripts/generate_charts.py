@@ -3,13 +3,21 @@ Chart Generation Script for Transit Network Analysis
 Generates comprehensive visualizations for strategic optimization report
 """
 
-import json
 import os
+import sys
+import hashlib
+import inspect
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Optional, Tuple
 import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib
 from collections import Counter
 
+from results_io import open_results, resolve_results_path, section_fingerprint, DEFAULT_RESULTS_DIR
+
 # Use non-interactive backend
 matplotlib.use('Agg')
 
@@ -30,10 +38,14 @@ class ChartGenerator:
     Generate comprehensive transit network visualizations
     """
 
-    def __init__(self, analysis_results_path: str, output_dir: str = 'charts'):
-        """Load analysis results"""
-        with open(analysis_results_path, 'r', encoding='utf-8') as f:
-            self.results = json.load(f)
+    def __init__(self, analysis_results_path: str = DEFAULT_RESULTS_DIR, output_dir: str = 'charts'):
+        """
+        Open analysis results (artifact directory or legacy single JSON file)
+        Sections and their bulky fields are read from disk only when a chart uses them
+        """
+        analysis_results_path = resolve_results_path(analysis_results_path)
+        self.results = open_results(analysis_results_path)
+        self._section_fingerprints = {}
 
         self.output_dir = output_dir
         os.makedirs(output_dir, exist_ok=True)
@@ -41,22 +53,94 @@ class ChartGenerator:
         print(f"Loaded analysis results from {analysis_results_path}")
         print(f"Charts will be saved to {output_dir}/\n")
 
-    def generate_all_charts(self):
-        """Generate all visualization charts"""
+    # Chart methods in generation order -> (output file, result sections the chart reads)
+    CHARTS = {
+        'plot_network_degree_distribution': ('network_degree_distribution.png', ('topology',)),
+        'plot_route_overlap_analysis': ('route_overlap_analysis.png', ('overlap',)),
+        'plot_stop_spacing_distribution': ('stop_spacing_distribution.png', ('spacing',)),
+        'plot_resource_waste_metrics': ('resource_waste_metrics.png', ('waste',)),
+        'plot_route_efficiency_comparison': ('route_efficiency_comparison.png', ('waste',)),
+        'plot_ecological_impact': ('ecological_impact.png', ('ecology',)),
+        'plot_high_duplication_corridors': ('high_duplication_corridors.png', ('overlap',)),
+        'plot_hub_stops_analysis': ('hub_stops_analysis.png', ('topology',)),
+        'plot_network_efficiency_breakdown': ('network_efficiency_breakdown.png',
+                                              ('overlap', 'waste', 'spacing', 'summary')),
+        'plot_optimization_potential': ('optimization_potential.png', ('waste', 'ecology', 'summary'))
+    }
+    CHART_METHODS = list(CHARTS)
+
+    def chart_fingerprint(self, method: str) -> str:
+        """Hash of a chart's input sections, the matplotlib style settings and the chart's code"""
+        digest = hashlib.sha256()
+        for section in self.CHARTS[method][1]:
+            if section not in self._section_fingerprints:
+                self._section_fingerprints[section] = section_fingerprint(self.results, section)
+            digest.update(f"{section}:{self._section_fingerprints[section]}\n".encode('utf-8'))
+        digest.update(matplotlib.__version__.encode('utf-8'))
+        digest.update(repr(sorted(matplotlib.rcParams.items())).encode('utf-8'))
+        digest.update(inspect.getsource(getattr(ChartGenerator, method)).encode('utf-8'))
+        return digest.hexdigest()
+
+    def _fingerprint_path(self, method: str) -> str:
+        return os.path.join(self.output_dir, f"{self.CHARTS[method][0]}.fingerprint")
+
+    def _is_current(self, method: str, fingerprint: str) -> bool:
+        """True if the chart's PNG exists and was rendered from the same fingerprint"""
+        if not os.path.exists(os.path.join(self.output_dir, self.CHARTS[method][0])):
+            return False
+        try:
+            with open(self._fingerprint_path(method), 'r', encoding='utf-8') as f:
+                return f.read().strip() == fingerprint
+        except OSError:
+            return False
+
+    def generate_all_charts(self, parallel: bool = False, workers: Optional[int] = None,
+                            force: bool = False) -> Dict[str, Optional[str]]:
+        """
+        Generate all visualization charts
+        Charts whose fingerprint (input sections, style, code) matches the
+        `<chart>.png.fingerprint` sidecar are skipped unless force=True.
+        With parallel=True each chart renders in a worker process with its own
+        figure state (all CPUs by default). A failing chart is reported and the
+        rest still render. Returns chart method -> error message (None if generated or unchanged).
+        """
         print("=== Generating Charts ===\n")
 
-        self.plot_network_degree_distribution()
-        self.plot_route_overlap_analysis()
-        self.plot_stop_spacing_distribution()
-        self.plot_resource_waste_metrics()
-        self.plot_route_efficiency_comparison()
-        self.plot_ecological_impact()
-        self.plot_high_duplication_corridors()
-        self.plot_hub_stops_analysis()
-        self.plot_network_efficiency_breakdown()
-        self.plot_optimization_potential()
-
-        print("\n=== All Charts Generated Successfully ===")
+        fingerprints = {}
+        for method in self.CHART_METHODS:
+            try:
+                fingerprints[method] = self.chart_fingerprint(method)
+            except (KeyError, OSError, ValueError):
+                fingerprints[method] = None  # inputs unreadable; rendering reports the error
+
+        stale = []
+        for method in self.CHART_METHODS:
+            if force or not fingerprints[method] or not self._is_current(method, fingerprints[method]):
+                stale.append(method)
+            else:
+                print(f"✓ Unchanged: {self.CHARTS[method][0]} (skipped)")
+
+        outcomes = {method: None for method in self.CHART_METHODS}
+        if parallel and stale:
+            with _chart_pool(self, workers) as pool:
+                outcomes.update(pool.map(_render_chart, stale))
+        else:
+            outcomes.update(_render(self, method) for method in stale)
+
+        for method in stale:
+            path = self._fingerprint_path(method)
+            if outcomes[method] is None and fingerprints[method]:
+                with open(path, 'w', encoding='utf-8') as f:
+                    f.write(fingerprints[method] + '\n')
+            elif os.path.exists(path):
+                os.remove(path)
+
+        failed = [method for method, error in outcomes.items() if error]
+        if failed:
+            print(f"\n=== {len(failed)} of {len(outcomes)} Charts Failed: {', '.join(failed)} ===")
+        else:
+            print(f"\n=== All Charts Generated Successfully ({len(outcomes) - len(stale)} unchanged) ===")
+        return outcomes
 
     def plot_network_degree_distribution(self):
         """Plot stop connectivity degree distribution"""
@@ -373,8 +457,12 @@ class ChartGenerator:
     def plot_hub_stops_analysis(self):
         """Plot hub stops analysis"""
         hubs = self.results['topology']['hubs'][:15]
+        centrality_hubs = self.results['topology'].get('centrality_hubs', [])[:15]
 
-        fig, ax = plt.subplots(figsize=(12, 7))
+        if centrality_hubs:
+            fig, (ax, ax2) = plt.subplots(1, 2, figsize=(18, 7))
+        else:
+            fig, ax = plt.subplots(figsize=(12, 7))
 
         hub_labels = [f"Stop {h['stop_id']}" for h in hubs]
         route_counts = [h['routes_count'] for h in hubs]
@@ -398,6 +486,28 @@ class ChartGenerator:
         for i, v in enumerate(route_counts):
             ax.text(v + 0.5, i, str(v), va='center', fontweight='bold')
 
+        if centrality_hubs:
+            # Stops most shortest paths pass through
+            central_labels = [f"Stop {h['stop_id']}" for h in centrality_hubs]
+            betweenness = [h['betweenness'] for h in centrality_hubs]
+
+            ax2.barh(range(len(central_labels)), betweenness,
+                     color=plt.cm.plasma(np.linspace(0.2, 0.8, len(central_labels))),
+                     alpha=0.8, edgecolor='black')
+            ax2.set_yticks(range(len(central_labels)))
+            ax2.set_yticklabels(central_labels)
+            ax2.set_xlabel('Betweenness Centrality (share of shortest paths)')
+
+            centrality = self.results['topology'].get('centrality', {})
+            subtitle = 'exact' if centrality.get('mode') == 'exact' else \
+                f"sampled, ±{centrality.get('error_bound', 0):.3f}"
+            ax2.set_title(f'Top 15 Hub Stops by Betweenness\n({subtitle})')
+            ax2.grid(axis='x', alpha=0.3)
+            ax2.invert_yaxis()
+
+            for i, (v, h) in enumerate(zip(betweenness, centrality_hubs)):
+                ax2.text(v, i, f" {v:.3f} ({h['routes_count']} routes)", va='center', fontsize=9)
+
         plt.tight_layout()
         plt.savefig(f'{self.output_dir}/hub_stops_analysis.png', bbox_inches='tight')
         plt.close()
@@ -549,9 +659,55 @@ class ChartGenerator:
         print("✓ Generated: optimization_potential.png")
 
 
+# ==================== PARALLEL RENDERING ====================
+
+# Generator shared with chart worker processes (set by _init_chart_worker)
+_chart_generator = None
+
+
+def _render(generator: ChartGenerator, method: str) -> Tuple[str, Optional[str]]:
+    """Render one chart, turning a failure into an error message"""
+    try:
+        getattr(generator, method)()
+        return method, None
+    except Exception as e:
+        plt.close('all')
+        print(f"✗ Failed: {method}: {type(e).__name__}: {e}")
+        return method, f"{type(e).__name__}: {e}"
+
+
+def _init_chart_worker(generator: ChartGenerator):
+    global _chart_generator
+    _chart_generator = generator
+
+
+def _render_chart(method: str) -> Tuple[str, Optional[str]]:
+    return _render(_chart_generator, method)
+
+
+def _chart_pool(generator: ChartGenerator, workers: Optional[int] = None) -> ProcessPoolExecutor:
+    """Process pool whose workers share the generator (inherited on fork)"""
+    workers = workers or multiprocessing.cpu_count()
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context('fork' if 'fork' in methods else None)
+    return ProcessPoolExecutor(max_workers=min(workers, len(generator.CHART_METHODS)), mp_context=context,
+                               initializer=_init_chart_worker, initargs=(generator,))
+
+
 if __name__ == "__main__":
-    generator = ChartGenerator('data/analysis_results.json')
-    generator.generate_all_charts()
+    parser = argparse.ArgumentParser(description="Generate charts from the analysis results")
+    parser.add_argument('--results', default=DEFAULT_RESULTS_DIR,
+                        help="Results directory (or legacy analysis_results.json, used when the default directory is missing)")
+    parser.add_argument('--output-dir', default='charts')
+    parser.add_argument('--parallel', action='store_true', help="Render each chart in a worker process")
+    parser.add_argument('--workers', type=int, default=None, help="Worker processes (default: all CPUs)")
+    parser.add_argument('--force', action='store_true', help="Re-render charts even if their inputs are unchanged")
+    args = parser.parse_args()
+
+    generator = ChartGenerator(args.results, args.output_dir)
+    outcomes = generator.generate_all_charts(parallel=args.parallel, workers=args.workers, force=args.force)
 
     print(f"\nAll charts saved to '{generator.output_dir}/' directory")
     print("Charts are ready for inclusion in strategic documentation.")
+    if any(outcomes.values()):
+        sys.exit(1)
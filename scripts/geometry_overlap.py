@@ -0,0 +1,339 @@
+"""
+Geometric Route Overlap for Transit Network Analysis
+Shared physical kilometres between routes, measured on their flowCoordinates polylines
+"""
+
+import json
+import argparse
+from typing import Dict, Iterator, List, Optional, Tuple
+import numpy as np
+from scipy import sparse
+
+from network_analysis import TransitNetworkAnalyzer, iter_bus_details, EARTH_RADIUS_KM
+from polyline_codec import route_coordinates
+
+
+EARTH_RADIUS_M = EARTH_RADIUS_KM * 1000
+
+# Bus detail fields skipped when streaming route geometry
+GEOMETRY_DROP_FIELDS = ('paymentType', 'region', 'workingZoneType', 'stops')
+
+# Douglas-Peucker tolerance; GPS traces carry far more points than the road shape needs
+DEFAULT_TOLERANCE_M = 10
+
+# Spatial hash cell size; routes on the same road fall into the same cells
+DEFAULT_CELL_M = 30
+
+# Road directions told apart within a cell, so crossing roads do not count as shared
+HEADING_BUCKETS = 8
+
+# Cell coordinate offset keeping hash keys non-negative (cells up to ~30,000 km from the centre)
+CELL_OFFSET = 2 ** 20
+
+# Route pairs sharing less road than this are not reported
+DEFAULT_MIN_SHARED_KM = 1.0
+
+
+def iter_route_geometries(path: str) -> Iterator[Tuple[str, int, np.ndarray]]:
+    """
+    Yield (bus_number, direction, (n, 2) lat/lon array) for every route polyline
+    Streams the bus details file like iter_bus_details, skipping the stop lists;
+    encoded polylines (see polyline_codec.py) are decoded one at a time
+    """
+    for bus in iter_bus_details(path, GEOMETRY_DROP_FIELDS):
+        for route in bus.get('routes') or []:
+            yield bus['number'], route.get('directionTypeId'), route_coordinates(route)
+
+
+def douglas_peucker(xy: np.ndarray, tolerance: float) -> np.ndarray:
+    """
+    Simplify a projected polyline, keeping every point further than tolerance from the kept shape
+    Distances are measured to segments (not infinite lines), so polylines that double back are kept intact
+    """
+    n = len(xy)
+    if n < 3:
+        return xy
+
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+    while stack:
+        i, j = stack.pop()
+        if j - i < 2:
+            continue
+        segment = xy[j] - xy[i]
+        points = xy[i + 1:j] - xy[i]
+        length_sq = segment @ segment
+        t = np.clip(points @ segment / length_sq, 0.0, 1.0) if length_sq > 0 else np.zeros(len(points))
+        distances = np.hypot(*(points - t[:, None] * segment).T)
+        k = int(np.argmax(distances))
+        if distances[k] > tolerance:
+            m = i + 1 + k
+            keep[m] = True
+            stack.append((i, m))
+            stack.append((m, j))
+
+    return xy[keep]
+
+
+class GeometryOverlapEngine:
+    """
+    Shared road kilometres between routes from their polylines
+
+    Each polyline is projected to metres, simplified with Douglas-Peucker,
+    cut into pieces no longer than half a cell and snapped into a spatial
+    hash keyed by grid cell and road heading. Each piece is also marked
+    "near" in the 2 x 2 cells and 2 heading buckets around it, so two
+    traces of one road match even when they fall on opposite sides of a
+    cell or bucket boundary. Shared kilometres of a route pair are the
+    km of one route lying near the other, from one sparse product of the
+    route x cell km matrix with the route x cell near matrix.
+    """
+
+    def __init__(self, cell_m: float = DEFAULT_CELL_M, tolerance_m: float = DEFAULT_TOLERANCE_M,
+                 lat0: Optional[float] = None, lon0: Optional[float] = None):
+        self.cell_m = cell_m
+        self.tolerance_m = tolerance_m
+        self.lat0 = lat0
+        self.lon0 = lon0
+
+        self.routes = []
+        self.route_rows = {}
+        self._parts = []  # (row, cell keys, km per key, near keys) per polyline
+        self.n_polylines = 0
+        self.n_points = 0
+        self.n_points_kept = 0
+
+        self.matrix = None
+        self.near = None
+        self.cell_keys = None
+        self.near_counts = None
+
+    @classmethod
+    def from_file(cls, bus_details_path: str, **kwargs) -> 'GeometryOverlapEngine':
+        """Stream every polyline of a bus details file (.json or .ndjson) into a built engine"""
+        engine = cls(**kwargs)
+        for bus_number, _, coords in iter_route_geometries(bus_details_path):
+            engine.add_polyline(bus_number, coords)
+        engine.build()
+        print(f"Read {engine.n_polylines} polylines ({engine.n_points} points, "
+              f"{engine.n_points_kept} after simplification) for {len(engine.routes)} routes")
+        return engine
+
+    @classmethod
+    def from_analyzer(cls, analyzer: TransitNetworkAnalyzer, **kwargs) -> 'GeometryOverlapEngine':
+        """Geometry of the analyzer's bus details file, read in a separate streaming pass"""
+        return cls.from_file(analyzer.bus_details_path, **kwargs)
+
+    def project(self, lat, lon) -> np.ndarray:
+        """(n, 2) metre coordinates of lat/lon arrays (equirectangular around lat0/lon0)"""
+        lat = np.radians(np.asarray(lat, dtype=np.float64))
+        lon = np.radians(np.asarray(lon, dtype=np.float64))
+        x = EARTH_RADIUS_M * (lon - np.radians(self.lon0)) * np.cos(np.radians(self.lat0))
+        y = EARTH_RADIUS_M * (lat - np.radians(self.lat0))
+        return np.column_stack([x, y])
+
+    # ==================== SPATIAL HASH ====================
+
+    @staticmethod
+    def _keys(cell_x, cell_y, bucket) -> np.ndarray:
+        return ((cell_x + CELL_OFFSET) * (2 * CELL_OFFSET) + cell_y + CELL_OFFSET) * HEADING_BUCKETS + \
+            np.mod(bucket, HEADING_BUCKETS)
+
+    def add_polyline(self, route: str, coords: np.ndarray):
+        """Simplify one lat/lon polyline of a route and add its pieces to the spatial hash"""
+        coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+        valid = np.isfinite(coords).all(axis=1) & (np.abs(coords[:, 0]) <= 90) & (np.abs(coords[:, 1]) <= 180)
+        coords = coords[valid]
+        self.n_polylines += 1
+        self.n_points += len(coords)
+        if len(coords) < 2:
+            return
+
+        if self.lat0 is None:
+            self.lat0, self.lon0 = float(coords[0, 0]), float(coords[0, 1])
+
+        xy = douglas_peucker(self.project(coords[:, 0], coords[:, 1]), self.tolerance_m)
+        self.n_points_kept += len(xy)
+
+        delta = np.diff(xy, axis=0)
+        lengths = np.hypot(delta[:, 0], delta[:, 1])
+        moving = lengths > 0
+        start, delta, lengths = xy[:-1][moving], delta[moving], lengths[moving]
+        if not len(lengths):
+            return
+
+        # Densify: pieces of at most half a cell, each snapped by its midpoint
+        pieces = np.ceil(lengths / (self.cell_m / 2)).astype(np.int64)
+        segment = np.repeat(np.arange(len(lengths)), pieces)
+        position = np.arange(len(segment)) - np.repeat(np.cumsum(pieces) - pieces, pieces)
+        t = (position + 0.5) / pieces[segment]
+        midpoints = (start[segment] + t[:, None] * delta[segment]) / self.cell_m
+        piece_km = lengths[segment] / pieces[segment] / 1000
+
+        # Headings modulo 180 degrees: both directions along a road share buckets
+        heading = (np.mod(np.arctan2(delta[:, 1], delta[:, 0]), np.pi) / np.pi * HEADING_BUCKETS)[segment]
+        cells = np.floor(midpoints).astype(np.int64)
+        keys, inverse = np.unique(self._keys(cells[:, 0], cells[:, 1], heading.astype(np.int64)),
+                                  return_inverse=True)
+
+        # Near keys: the cells within half a cell and the buckets within half a bucket
+        low = np.floor(midpoints - 0.5).astype(np.int64)
+        low_bucket = np.floor(heading - 0.5).astype(np.int64)
+        near = np.unique(np.concatenate([
+            self._keys(low[:, 0] + dx, low[:, 1] + dy, low_bucket + db)
+            for dx in (0, 1) for dy in (0, 1) for db in (0, 1)
+        ]))
+
+        row = self.route_rows.setdefault(route, len(self.route_rows))
+        if row == len(self.routes):
+            self.routes.append(route)
+        self._parts.append((row, keys, np.bincount(inverse, weights=piece_km), near))
+        self.matrix = None
+
+    def build(self):
+        """Route x cell km and near matrices from the hashed pieces"""
+        n_routes = len(self.routes)
+        rows = np.concatenate([np.full(len(p[1]), p[0]) for p in self._parts] or [np.empty(0, np.int64)])
+        keys = np.concatenate([p[1] for p in self._parts] or [np.empty(0, np.int64)])
+        km = np.concatenate([p[2] for p in self._parts] or [np.empty(0)])
+        near_rows = np.concatenate([np.full(len(p[3]), p[0]) for p in self._parts] or [np.empty(0, np.int64)])
+        near_keys = np.concatenate([p[3] for p in self._parts] or [np.empty(0, np.int64)])
+
+        self.cell_keys, columns = np.unique(np.concatenate([keys, near_keys]), return_inverse=True)
+        n_cells = len(self.cell_keys)
+        columns, near_columns = columns[:len(keys)], columns[len(keys):]
+
+        # How many of a route's own polylines pass near each cell; a piece counts
+        # 1/n of its length there, so both directions along one road count once
+        own_near, own_counts = np.unique(near_rows * n_cells + near_columns, return_counts=True)
+        sharing = own_counts[np.searchsorted(own_near, rows * n_cells + columns)] if len(rows) else km
+
+        self.matrix = sparse.csr_matrix((km / sharing, (rows, columns)), shape=(n_routes, n_cells))
+        self.matrix.sum_duplicates()
+        self.near = sparse.csr_matrix(
+            (np.ones(len(own_near)), (own_near // n_cells, own_near % n_cells)) if n_cells else
+            (np.empty(0), (np.empty(0, np.int64), np.empty(0, np.int64))),
+            shape=(n_routes, n_cells)
+        )
+        self.near_counts = np.asarray(self.near.sum(axis=0)).ravel()
+
+    def _built(self):
+        if self.matrix is None:
+            self.build()
+
+    # ==================== OVERLAP ====================
+
+    def route_road_km(self) -> Dict[str, float]:
+        """Road kilometres covered by each route (both directions on one road count once)"""
+        self._built()
+        return dict(zip(self.routes, np.asarray(self.matrix.sum(axis=1)).ravel().tolist()))
+
+    def shared_km_matrix(self) -> sparse.csr_matrix:
+        """
+        Route x route shared road kilometres (diagonal: each route's own road km)
+        Symmetric: the smaller of "km of a near b" and "km of b near a"
+        """
+        self._built()
+        near_km = (self.matrix @ self.near.T).tocsr()
+        return near_km.minimum(near_km.T).tocsr()
+
+    def overlapping_pairs(self, min_shared_km: float = DEFAULT_MIN_SHARED_KM) -> List[Dict]:
+        """Route pairs sharing at least min_shared_km of road, most shared first"""
+        matrix = self.shared_km_matrix()
+        shared = sparse.triu(matrix, k=1).tocoo()
+        own = matrix.diagonal()
+        keep = np.flatnonzero(shared.data >= min_shared_km)
+        keep = keep[np.argsort(-shared.data[keep], kind='stable')]
+        return [
+            {
+                'routes': [self.routes[shared.row[p]], self.routes[shared.col[p]]],
+                'shared_km': float(shared.data[p]),
+                'share_of_first': float(shared.data[p] / own[shared.row[p]]) if own[shared.row[p]] else 0.0,
+                'share_of_second': float(shared.data[p] / own[shared.col[p]]) if own[shared.col[p]] else 0.0
+            }
+            for p in keep.tolist()
+        ]
+
+    def hidden_overlaps(self, analyzer: TransitNetworkAnalyzer,
+                        min_shared_km: float = DEFAULT_MIN_SHARED_KM) -> List[Dict]:
+        """Overlapping pairs that share road but no stop-to-stop edge, so edge overlap misses them"""
+        incidence = analyzer.get_route_edge_incidence()
+        edge_rows = {route: row for row, route in enumerate(incidence['routes'])}
+        shared_edges = (incidence['matrix'] @ incidence['matrix'].T).tocsr()
+        return [
+            pair for pair in self.overlapping_pairs(min_shared_km)
+            if not (pair['routes'][0] in edge_rows and pair['routes'][1] in edge_rows and
+                    shared_edges[edge_rows[pair['routes'][0]], edge_rows[pair['routes'][1]]])
+        ]
+
+    def summary(self) -> Dict:
+        """
+        Network-wide geometric overlap, in the shape of analyze_route_overlap
+        A route's km in a cell near n routes counts 1/n towards the road network length
+        """
+        self._built()
+        matrix = self.matrix.tocoo()
+        counts = self.near_counts[matrix.col]
+        road_km = matrix.data / counts
+        total_km = float(road_km.sum())
+        shared_km = float(road_km[counts > 1].sum())
+        route_km = float(matrix.data.sum())
+
+        own_km = np.bincount(matrix.row, weights=matrix.data, minlength=len(self.routes))
+        duplicated_km = np.bincount(matrix.row, weights=np.where(counts > 1, matrix.data, 0.0),
+                                    minlength=len(self.routes))
+        duplication_index = np.where(own_km > 0, duplicated_km / np.maximum(own_km, 1e-12) * 100, 0.0)
+
+        km_by_count = np.bincount(counts.astype(np.int64), weights=road_km) if len(counts) else np.zeros(1)
+        return {
+            'total_road_km': total_km,
+            'shared_road_km': shared_km,
+            'overlap_percentage': shared_km / total_km * 100 if total_km > 0 else 0,
+            'route_km': route_km,
+            'excess_route_km': route_km - total_km,
+            'road_km_by_route_count': {k: v for k, v in enumerate(km_by_count.tolist()) if v > 0},
+            'route_duplication_index': dict(zip(self.routes, duplication_index.tolist())),
+            'avg_duplication_index': float(duplication_index.mean()) if len(duplication_index) else 0,
+            'polylines': self.n_polylines,
+            'points': self.n_points,
+            'points_after_simplification': self.n_points_kept,
+            'cell_m': self.cell_m,
+            'tolerance_m': self.tolerance_m
+        }
+
+
+if __name__ == "__main__":
+    import time
+
+    parser = argparse.ArgumentParser(description="Measure shared road kilometres between route polylines")
+    parser.add_argument('--bus-details', default='data/busDetails.json',
+                        help="Bus details file (.json or .ndjson)")
+    parser.add_argument('--stops', default='data/stops.json', help="Stops file")
+    parser.add_argument('--cell', type=float, default=DEFAULT_CELL_M, help="Spatial hash cell size in metres")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE_M,
+                        help="Douglas-Peucker tolerance in metres")
+    parser.add_argument('--min-shared-km', type=float, default=DEFAULT_MIN_SHARED_KM)
+    parser.add_argument('--output', default='data/geometry_overlap.json')
+    args = parser.parse_args()
+
+    analyzer = TransitNetworkAnalyzer(args.bus_details, args.stops)
+
+    started = time.perf_counter()
+    engine = GeometryOverlapEngine.from_analyzer(analyzer, cell_m=args.cell, tolerance_m=args.tolerance)
+    summary = engine.summary()
+    pairs = engine.overlapping_pairs(args.min_shared_km)
+    hidden = engine.hidden_overlaps(analyzer, args.min_shared_km)
+    print(f"Geometry overlap computed in {time.perf_counter() - started:.1f} s")
+
+    print(f"\nRoad network: {summary['total_road_km']:.1f} km, "
+          f"{summary['shared_road_km']:.1f} km served by several routes ({summary['overlap_percentage']:.2f}%)")
+    print(f"{len(pairs)} route pairs share at least {args.min_shared_km} km; "
+          f"{len(hidden)} of them share no stop-to-stop edge")
+    for pair in pairs[:10]:
+        print(f"  {' / '.join(pair['routes'])}: {pair['shared_km']:.1f} km "
+              f"({pair['share_of_first']:.0%} / {pair['share_of_second']:.0%})")
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump({'summary': summary, 'pairs': pairs, 'hidden_pairs': hidden}, f, indent=2, ensure_ascii=False)
+    print(f"\nGeometry overlap saved to {args.output}")
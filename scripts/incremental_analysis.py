@@ -0,0 +1,394 @@
+"""
+Incremental Analysis Engine for Transit Network Analysis
+Keeps overlap, waste and spacing metrics as state updated route by route
+"""
+
+import json
+import os
+import hashlib
+import argparse
+from collections import defaultdict
+from typing import Dict, List, Optional
+import numpy as np
+
+from network_analysis import TransitNetworkAnalyzer, iter_bus_details, haversine_km
+
+
+STATE_FORMAT_VERSION = 2
+DEFAULT_STATE_PATH = 'data/analysis_state.json'
+
+# Same thresholds as TransitNetworkAnalyzer
+DENSE_THRESHOLD_KM = 0.2
+SPARSE_THRESHOLD_KM = 2.0
+HIGH_DUPLICATION_THRESHOLD = 5
+
+
+def _clean_coordinate(coord) -> float:
+    """Same cleaning as TransitNetworkAnalyzer._clean_coordinate"""
+    if isinstance(coord, (int, float)):
+        return float(coord)
+    return float(str(coord).replace(',', ''))
+
+
+def _bus_hash(bus: Dict) -> str:
+    """Content hash of a bus record (independent of key order)"""
+    canonical = json.dumps(bus, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def _edge_key(a: int, b: int) -> str:
+    return f"{a}-{b}" if a <= b else f"{b}-{a}"
+
+
+class IncrementalNetworkState:
+    """
+    Network metrics maintained as route-level deltas
+
+    State per bus (edges, segment lengths, stop count, length) and per edge
+    (buses per route number using it, length) is enough to update edge
+    route sets, per-route duplication, wasted vehicle-km and spacing
+    aggregates when one bus is added, removed or updated. The state is
+    saved as JSON between runs; the median spacing is computed on demand.
+    Edge lengths depend on the stop coordinates, so a saved state only
+    loads against the stops it was built with (see stops_fingerprint).
+    """
+
+    def __init__(self, stops_path: str):
+        self.stops_path = stops_path
+        with open(stops_path, 'r', encoding='utf-8') as f:
+            self.stop_coords = {
+                stop['id']: (_clean_coordinate(stop['latitude']), _clean_coordinate(stop['longitude']))
+                for stop in json.load(f)
+            }
+        self.stops_fingerprint = self._coordinates_hash(self.stop_coords)
+
+        self.buses = {}   # bus id -> {number, hash, length, stop_count, edges, spacings}
+        self.edges = {}   # edge key -> {routes: {number: buses}, length_km, indexed}
+        self.route_edges = defaultdict(dict)       # number -> {edge key: buses}
+        self.route_duplicated = defaultdict(int)   # number -> edges shared with another route
+        self.totals = {
+            'vehicle_km': 0.0, 'wasted_km': 0.0, 'overlapping_edges': 0,
+            'segments': 0, 'spacing_km': 0.0, 'dense_segments': 0, 'sparse_segments': 0
+        }
+
+    @classmethod
+    def build(cls, bus_details_path: str, stops_path: str) -> 'IncrementalNetworkState':
+        """Build the state from scratch (one add_route per bus)"""
+        state = cls(stops_path)
+        for bus in iter_bus_details(bus_details_path):
+            state.add_route(bus)
+        return state
+
+    @staticmethod
+    def _coordinates_hash(stop_coords: Dict) -> str:
+        """Hash of the stop coordinate table (ids and cleaned coordinates)"""
+        canonical = json.dumps(sorted(stop_coords.items()), separators=(',', ':'))
+        return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+    # ==================== ROUTE OPERATIONS ====================
+
+    def add_route(self, bus: Dict):
+        """Add a bus (bus details record) and apply its deltas"""
+        if bus['id'] in self.buses:
+            raise ValueError(f"Bus {bus['id']} is already in the state; use update_route")
+
+        number = bus['number']
+        edges, spacings = [], []
+        embedded = {}
+        for direction in (1, 2):
+            stops_in_direction = sorted(
+                [s for s in bus['stops'] if s['directionTypeId'] == direction], key=lambda x: x['id']
+            )
+            for entry in stops_in_direction:
+                stop = entry['stop']
+                embedded.setdefault(entry['stopId'],
+                                    (_clean_coordinate(stop['latitude']), _clean_coordinate(stop['longitude'])))
+            stop_ids = [s['stopId'] for s in stops_in_direction]
+            for a, b in zip(stop_ids, stop_ids[1:]):
+                key = _edge_key(a, b)
+                if key not in self.edges:
+                    lat_a, lon_a = self.stop_coords.get(a, embedded[a])
+                    lat_b, lon_b = self.stop_coords.get(b, embedded[b])
+                    self.edges[key] = {
+                        'routes': {},
+                        'length_km': float(haversine_km(lat_a, lon_a, lat_b, lon_b)),
+                        'indexed': a in self.stop_coords and b in self.stop_coords
+                    }
+                edges.append(key)
+                spacings.append(self.edges[key]['length_km'])
+
+        unique_edges = list(dict.fromkeys(edges))
+        for key in unique_edges:
+            self._add_edge_use(key, number)
+
+        self.buses[bus['id']] = {
+            'number': number,
+            'hash': _bus_hash(bus),
+            'length': bus.get('routLength', 0),
+            'stop_count': len(set(s['stopId'] for s in bus['stops'])),
+            'edges': unique_edges,
+            'spacings': spacings
+        }
+        self._apply_spacings(spacings, +1)
+        self.totals['vehicle_km'] += bus.get('routLength', 0)
+
+    def remove_route(self, bus_id: int):
+        """Remove a bus and reverse its deltas"""
+        record = self.buses.pop(bus_id)
+        for key in record['edges']:
+            self._remove_edge_use(key, record['number'])
+        self._apply_spacings(record['spacings'], -1)
+        self.totals['vehicle_km'] -= record['length']
+
+    def update_route(self, bus: Dict) -> bool:
+        """Replace a bus with new details; returns False if its content is unchanged"""
+        record = self.buses.get(bus['id'])
+        if record is not None:
+            if record['hash'] == _bus_hash(bus):
+                return False
+            self.remove_route(bus['id'])
+        self.add_route(bus)
+        return True
+
+    def sync(self, bus_details_path: str) -> Dict:
+        """
+        Bring the state in line with a bus details file
+        Only added, changed and removed buses are applied. Returns their ids.
+        """
+        report = {'added': [], 'updated': [], 'removed': [], 'unchanged': 0}
+        seen = set()
+        for bus in iter_bus_details(bus_details_path):
+            seen.add(bus['id'])
+            is_new = bus['id'] not in self.buses
+            if self.update_route(bus):
+                report['added' if is_new else 'updated'].append(bus['id'])
+            else:
+                report['unchanged'] += 1
+
+        for bus_id in [b for b in self.buses if b not in seen]:
+            self.remove_route(bus_id)
+            report['removed'].append(bus_id)
+        return report
+
+    # ==================== DELTAS ====================
+
+    def _add_edge_use(self, key: str, number: str):
+        edge = self.edges[key]
+        routes = edge['routes']
+        if number in routes:
+            routes[number] += 1
+            self.route_edges[number][key] += 1
+            return
+
+        before = len(routes)
+        routes[number] = 1
+        self.route_edges[number][key] = 1
+        self._on_route_count_change(key, before, before + 1, number)
+
+    def _remove_edge_use(self, key: str, number: str):
+        edge = self.edges[key]
+        routes = edge['routes']
+        routes[number] -= 1
+        self.route_edges[number][key] -= 1
+        if routes[number]:
+            return
+
+        before = len(routes)
+        del routes[number]
+        del self.route_edges[number][key]
+        self._on_route_count_change(key, before, before - 1, number)
+        if not self.route_edges[number]:
+            del self.route_edges[number]
+            self.route_duplicated.pop(number, None)
+        if not routes:
+            del self.edges[key]
+
+    def _on_route_count_change(self, key: str, before: int, after: int, number: str):
+        """Update overlap and waste totals when an edge's distinct route count changes"""
+        edge = self.edges[key]
+        if edge['indexed']:
+            self.totals['wasted_km'] += (max(after - 1, 0) - max(before - 1, 0)) * edge['length_km']
+
+        was_overlapping, is_overlapping = before > 1, after > 1
+        if was_overlapping != is_overlapping:
+            flip = 1 if is_overlapping else -1
+            self.totals['overlapping_edges'] += flip
+            # Every route on the edge (other than the one being added or removed) flips too
+            for other in edge['routes']:
+                if other != number:
+                    self.route_duplicated[other] += flip
+        if is_overlapping and number in edge['routes']:
+            self.route_duplicated[number] += 1
+        elif was_overlapping and number not in edge['routes']:
+            self.route_duplicated[number] -= 1
+
+    def _apply_spacings(self, spacings: List[float], sign: int):
+        spacings = np.asarray(spacings, dtype=np.float64)
+        self.totals['segments'] += sign * len(spacings)
+        self.totals['spacing_km'] += sign * float(spacings.sum())
+        self.totals['dense_segments'] += sign * int(np.count_nonzero(spacings < DENSE_THRESHOLD_KM))
+        self.totals['sparse_segments'] += sign * int(np.count_nonzero(spacings > SPARSE_THRESHOLD_KM))
+
+    # ==================== RESULTS ====================
+
+    def overlap(self) -> Dict:
+        """Overlap section (same keys as analyze_route_overlap)"""
+        total_edges = len(self.edges)
+        overlapping = self.totals['overlapping_edges']
+
+        route_duplication = {
+            number: self.route_duplicated.get(number, 0) / max(len(edges), 1) * 100
+            for number, edges in self.route_edges.items()
+        }
+        corridors = [
+            (key, len(edge['routes'])) for key, edge in self.edges.items()
+            if len(edge['routes']) >= HIGH_DUPLICATION_THRESHOLD
+        ]
+        corridors.sort(key=lambda item: -item[1])
+
+        return {
+            'total_edges': total_edges,
+            'overlapping_edges': overlapping,
+            'overlap_percentage': (overlapping / total_edges * 100) if total_edges > 0 else 0,
+            'edge_routes': {
+                tuple(int(s) for s in key.split('-')): set(edge['routes']) for key, edge in self.edges.items()
+            },
+            'high_duplication_corridors': [
+                {
+                    'edge': tuple(int(s) for s in key.split('-')),
+                    'routes': list(self.edges[key]['routes']),
+                    'duplication_factor': count
+                }
+                for key, count in corridors[:20]
+            ],
+            'route_duplication_index': route_duplication,
+            'avg_duplication_index': np.mean(list(route_duplication.values())) if route_duplication else 0
+        }
+
+    def spacing(self) -> Dict:
+        """Spacing summary (network-level keys of analyze_stop_spacing); the median is computed here"""
+        count = self.totals['segments']
+        median = np.median(np.concatenate([record['spacings'] for record in self.buses.values()])) \
+            if count > 0 else 0
+        return {
+            'network_mean_spacing': self.totals['spacing_km'] / count if count > 0 else 0,
+            'network_median_spacing': median,
+            'overly_dense_segments': self.totals['dense_segments'],
+            'overly_sparse_segments': self.totals['sparse_segments'],
+            'dense_percentage': (self.totals['dense_segments'] / count * 100) if count > 0 else 0,
+            'optimal_spacing_range': (0.3, 0.8)
+        }
+
+    def waste(self, overlap: Optional[Dict] = None) -> Dict:
+        """Waste summary (same totals as compute_resource_waste_metrics)"""
+        overlap = overlap or self.overlap()
+        total_km = self.totals['vehicle_km']
+        wasted_km = self.totals['wasted_km']
+        return {
+            'total_vehicle_km': total_km,
+            'wasted_vehicle_km': wasted_km,
+            'waste_percentage': (wasted_km / total_km * 100) if total_km > 0 else 0,
+            'network_redundancy_coefficient': overlap['avg_duplication_index'] / 100
+        }
+
+    def results(self) -> Dict:
+        """Overlap, spacing and waste sections plus the efficiency score"""
+        overlap = self.overlap()
+        spacing = self.spacing()
+        waste = self.waste(overlap)
+        score = TransitNetworkAnalyzer._compute_efficiency_score(None, overlap, spacing, waste)
+        return {
+            'overlap': overlap,
+            'spacing': spacing,
+            'waste': waste,
+            'summary': {'total_routes': len(self.buses), 'network_efficiency_score': score}
+        }
+
+    # ==================== PERSISTENCE ====================
+
+    def save(self, path: str = DEFAULT_STATE_PATH):
+        """Write the state as JSON (atomically)"""
+        state = {
+            'format_version': STATE_FORMAT_VERSION,
+            'stops_path': self.stops_path,
+            'stops_fingerprint': self.stops_fingerprint,
+            'buses': [dict(record, id=bus_id) for bus_id, record in self.buses.items()],
+            'edges': self.edges,
+            'totals': self.totals
+        }
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str = DEFAULT_STATE_PATH, stops_path: Optional[str] = None) -> 'IncrementalNetworkState':
+        """
+        Load a state saved by save(); per-route indexes are rebuilt from the edge table
+        Raises ValueError if the stop coordinates differ from those the state was
+        built with, since its edge lengths, spacings and wasted vehicle-km would be stale.
+        """
+        with open(path, 'r', encoding='utf-8') as f:
+            saved = json.load(f)
+
+        if saved['format_version'] != STATE_FORMAT_VERSION:
+            raise ValueError(
+                f"Unsupported analysis state version {saved['format_version']} in {path} "
+                f"(expected {STATE_FORMAT_VERSION}); rebuild it with --rebuild"
+            )
+
+        state = cls(stops_path or saved['stops_path'])
+        if saved['stops_fingerprint'] != state.stops_fingerprint:
+            raise ValueError(
+                f"Stop coordinates in {state.stops_path} differ from those the analysis state in {path} "
+                f"was built with; rebuild it with --rebuild"
+            )
+        state.buses = {record.pop('id'): record for record in saved['buses']}
+        state.edges = saved['edges']
+        state.totals = saved['totals']
+        for key, edge in state.edges.items():
+            overlapping = len(edge['routes']) > 1
+            for number, buses in edge['routes'].items():
+                state.route_edges[number][key] = buses
+                if overlapping:
+                    state.route_duplicated[number] += 1
+        return state
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Update network metrics incrementally from changed bus details")
+    parser.add_argument('--bus-details', default='data/busDetails.json',
+                        help="Bus details file (.json or .ndjson)")
+    parser.add_argument('--stops', default='data/stops.json', help="Stops file")
+    parser.add_argument('--state', default=DEFAULT_STATE_PATH, help="State file")
+    parser.add_argument('--rebuild', action='store_true', help="Rebuild the state from scratch")
+    args = parser.parse_args()
+
+    state = None
+    if not args.rebuild and os.path.exists(args.state):
+        try:
+            state = IncrementalNetworkState.load(args.state, args.stops)
+        except ValueError as e:
+            print(f"✗ {e}")
+
+    if state is None:
+        print("Building analysis state from scratch...")
+        state = IncrementalNetworkState.build(args.bus_details, args.stops)
+        print(f"   ✓ {len(state.buses)} buses, {len(state.edges)} edges")
+    else:
+        report = state.sync(args.bus_details)
+        print(f"Synced with {args.bus_details}: {len(report['added'])} added, "
+              f"{len(report['updated'])} updated, {len(report['removed'])} removed, "
+              f"{report['unchanged']} unchanged")
+
+    state.save(args.state)
+    results = state.results()
+    print(f"   ✓ Overlap percentage: {results['overlap']['overlap_percentage']:.2f}%")
+    print(f"   ✓ Wasted vehicle-km: {results['waste']['wasted_vehicle_km']:.2f} "
+          f"({results['waste']['waste_percentage']:.2f}%)")
+    print(f"   ✓ Mean stop spacing: {results['spacing']['network_mean_spacing']:.3f} km")
+    print(f"Network Efficiency Score: {results['summary']['network_efficiency_score']:.2f}/100")
+    print(f"\nAnalysis state saved to {args.state}")
@@ -0,0 +1,207 @@
+"""
+Stage Instrumentation for Transit Network Analysis
+Per-stage wall/CPU time, memory, item counts and optional cProfile capture, with hooks and JSON metrics
+"""
+
+import os
+import sys
+import json
+import time
+import pstats
+import cProfile
+import tracemalloc
+import contextlib
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional
+
+try:
+    import resource
+except ImportError:  # Not available on Windows; peak RSS and worker CPU are then omitted
+    resource = None
+
+
+METRICS_FILENAME = 'metrics.json'
+METRICS_FORMAT_VERSION = 1
+
+# Functions listed per stage when cProfile capture is on
+PROFILE_TOP_FUNCTIONS = 15
+
+# A stage is a regression when it is this much slower than the baseline...
+REGRESSION_THRESHOLD = 1.25
+# ...and the baseline took long enough for the ratio to be meaningful
+MIN_COMPARE_SECONDS = 0.05
+
+
+def rss_mb() -> Optional[float]:
+    """Current resident set size of this process (Linux only)"""
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1e6
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def _max_rss_mb(who: int) -> float:
+    peak = resource.getrusage(who).ru_maxrss
+    return peak / 1e6 if sys.platform == 'darwin' else peak * 1024 / 1e6  # bytes on macOS, KiB on Linux
+
+
+def peak_rss_mb() -> Optional[float]:
+    """
+    High-water resident set size of this process
+    ru_maxrss is updated lazily by the kernel and can trail the current RSS, so it is never reported below it.
+    """
+    if resource is None:
+        return None
+    return max(_max_rss_mb(resource.RUSAGE_SELF), rss_mb() or 0.0)
+
+
+def children_peak_rss_mb() -> Optional[float]:
+    """High-water resident set size of the largest finished worker process so far"""
+    return _max_rss_mb(resource.RUSAGE_CHILDREN) if resource is not None else None
+
+
+def children_cpu_s() -> float:
+    """CPU time used by finished (and joined) worker processes so far"""
+    if resource is None:
+        return 0.0
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+class StageProfiler:
+    """
+    Records metrics for named stages of a run
+
+    Each stage gets wall and CPU time, resident memory (current and
+    high-water) and the item counts the stage reports. CPU time includes
+    worker processes (process pools of centrality, --parallel stages, chart
+    rendering) that finished within the stage, also given on their own as
+    children_cpu_s; children_peak_rss_mb is the largest such worker's peak,
+    recorded when workers finished within the stage. With trace_memory,
+    the change and peak of traced Python allocations are recorded too;
+    tracing slows pure-Python code many times over, so traced timings are
+    not comparable with untraced ones. With cprofile, each stage runs under
+    cProfile, its top functions are added to the metrics and, given
+    profile_dir, the stats are dumped to `<profile_dir>/<stage>.prof`.
+
+    Hooks are called as hook(stage, metrics) when each stage finishes.
+    """
+
+    def __init__(self, trace_memory: bool = False, cprofile: bool = False, profile_dir: Optional[str] = None,
+                 hooks: Optional[List[Callable[[str, Dict], None]]] = None):
+        self.trace_memory = trace_memory
+        self.cprofile = cprofile
+        self.profile_dir = profile_dir
+        self.hooks = list(hooks or [])
+        self.stages = {}
+        self.counts = {}
+        self.started_at = datetime.now(timezone.utc).isoformat()
+
+    def add_hook(self, hook: Callable[[str, Dict], None]):
+        """Call hook(stage, metrics) after every stage"""
+        self.hooks.append(hook)
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        """
+        Measure the enclosed block as one stage
+        Yields a dict the stage fills with its item counts.
+        """
+        counts = {}
+        tracing = self.trace_memory and not tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.start()
+        if self.trace_memory:
+            traced_before = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+        profile = cProfile.Profile() if self.cprofile else None
+
+        wall, cpu, children_cpu = time.perf_counter(), time.process_time(), children_cpu_s()
+        if profile:
+            profile.enable()
+        try:
+            yield counts
+        finally:
+            if profile:
+                profile.disable()
+            worker_cpu = children_cpu_s() - children_cpu
+            metrics = {
+                'wall_s': time.perf_counter() - wall,
+                'cpu_s': time.process_time() - cpu + worker_cpu,
+                'children_cpu_s': worker_cpu,
+                'rss_mb': rss_mb(),
+                'peak_rss_mb': peak_rss_mb(),
+                'children_peak_rss_mb': children_peak_rss_mb() if worker_cpu > 0 else None,
+                'counts': counts
+            }
+            if self.trace_memory:
+                current, peak = tracemalloc.get_traced_memory()
+                metrics['traced_delta_mb'] = (current - traced_before) / 1e6
+                metrics['traced_peak_mb'] = (peak - traced_before) / 1e6
+                if tracing:
+                    tracemalloc.stop()
+            if profile:
+                metrics['top_functions'] = self._top_functions(profile)
+                if self.profile_dir:
+                    os.makedirs(self.profile_dir, exist_ok=True)
+                    metrics['profile'] = os.path.join(self.profile_dir, f"{name}.prof")
+                    profile.dump_stats(metrics['profile'])
+
+            self.stages[name] = metrics
+            for hook in self.hooks:
+                hook(name, metrics)
+
+    @staticmethod
+    def _top_functions(profile: cProfile.Profile) -> List[Dict]:
+        """Functions with the most cumulative time"""
+        stats = pstats.Stats(profile).stats
+        ranked = sorted(stats.items(), key=lambda item: item[1][3], reverse=True)[:PROFILE_TOP_FUNCTIONS]
+        return [
+            {'function': f"{os.path.basename(filename)}:{line}({function})",
+             'calls': calls, 'total_s': total, 'cumulative_s': cumulative}
+            for (filename, line, function), (_, calls, total, cumulative, _) in ranked
+        ]
+
+    def metrics(self) -> Dict:
+        """All recorded stages, in run order, with run-level counts and totals"""
+        return {
+            'format_version': METRICS_FORMAT_VERSION,
+            'started_at': self.started_at,
+            'finished_at': datetime.now(timezone.utc).isoformat(),
+            'instrumentation': {'trace_memory': self.trace_memory, 'cprofile': self.cprofile},
+            'counts': self.counts,
+            'total_wall_s': sum(stage['wall_s'] for stage in self.stages.values()),
+            'total_cpu_s': sum(stage['cpu_s'] for stage in self.stages.values()),
+            'peak_rss_mb': peak_rss_mb(),
+            'children_peak_rss_mb': children_peak_rss_mb(),
+            'stages': self.stages
+        }
+
+    def write(self, path: str, extra: Optional[Dict] = None) -> Dict:
+        """Write metrics() (plus any extra keys) as JSON; returns what was written"""
+        metrics = {**self.metrics(), **(extra or {})}
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(metrics, f, indent=2)
+        return metrics
+
+
+def print_stage(stage: str, metrics: Dict):
+    """Hook printing a one-line summary of each finished stage"""
+    memory = f", RSS {metrics['rss_mb']:.0f} MB" if metrics.get('rss_mb') is not None else ''
+    workers = f" ({metrics['children_cpu_s']:.3f}s in workers)" if metrics.get('children_cpu_s') else ''
+    counts = ''.join(f", {key}={value}" for key, value in metrics['counts'].items())
+    print(f"   ⏱ {stage}: {metrics['wall_s']:.3f}s wall, {metrics['cpu_s']:.3f}s CPU{workers}{memory}{counts}")
+
+
+def find_regressions(stages: Dict[str, Dict], baseline_stages: Dict[str, Dict],
+                     threshold: float = REGRESSION_THRESHOLD) -> List[Dict]:
+    """Stages at least `threshold` times slower than in the baseline"""
+    regressions = []
+    for stage, metrics in stages.items():
+        before = baseline_stages.get(stage, {}).get('wall_s')
+        if before and before >= MIN_COMPARE_SECONDS and metrics['wall_s'] / before >= threshold:
+            regressions.append({'stage': stage, 'baseline_s': before, 'wall_s': metrics['wall_s'],
+                                'ratio': metrics['wall_s'] / before})
+    return regressions
@@ -0,0 +1,257 @@
+"""
+Round-Based Journey Planner (RAPTOR) for Transit Network Analysis
+Estimates stop-to-stop travel times and transfer counts over the route network
+"""
+
+import argparse
+import time
+from typing import Dict, List, Optional, Sequence
+import numpy as np
+
+from network_analysis import TransitNetworkAnalyzer
+
+
+DEFAULT_TRANSFER_PENALTY = 5.0  # minutes added per boarding after the first
+DEFAULT_MAX_TRANSFERS = 3
+DEFAULT_SPEED_KMH = 18.0        # used when a route has no duration or length
+BATCH_BYTES = 64 * 1024 * 1024  # working memory budget per batch of origins
+
+
+class JourneyPlanner:
+    """
+    Frequency-based RAPTOR over per-direction stop sequences
+
+    Each (bus, direction) stop sequence is a route pattern. Round k finds
+    the earliest arrival at every stop using at most k vehicles, so k - 1
+    transfers. There are no timetables: in-vehicle time comes from each
+    route's average speed (routLength / durationMinuts) applied to the
+    stop-to-stop distances. Every boarding, the first included, costs
+    `wait_minutes`; boardings after the first also cost `transfer_penalty`.
+
+    Rounds are vectorized across origins, so a batch of origins is scanned
+    in one pass over the patterns.
+    """
+
+    def __init__(self, stop_ids: np.ndarray, patterns: List[np.ndarray], segment_minutes: List[np.ndarray],
+                 pattern_routes: Optional[List[str]] = None,
+                 transfer_penalty: float = DEFAULT_TRANSFER_PENALTY,
+                 max_transfers: int = DEFAULT_MAX_TRANSFERS,
+                 wait_minutes: float = 0.0):
+        """
+        stop_ids: stop id of each node (sorted)
+        patterns: node ids of each pattern's stops, in driving order
+        segment_minutes: in-vehicle minutes of each pattern's consecutive segments
+        """
+        self.stop_ids = np.asarray(stop_ids, dtype=np.int64)
+        self.patterns = patterns
+        self.segment_minutes = segment_minutes
+        self.pattern_routes = pattern_routes
+        self.transfer_penalty = transfer_penalty
+        self.max_transfers = max_transfers
+        self.wait_minutes = wait_minutes
+
+        # Which patterns serve each stop, to scan only patterns touching improved stops
+        n_nodes = len(self.stop_ids)
+        serving = [[] for _ in range(n_nodes)]
+        for p, stops in enumerate(patterns):
+            for node in set(stops.tolist()):
+                serving[node].append(p)
+        self._serving = [np.array(ps, dtype=np.int64) for ps in serving]
+
+    @classmethod
+    def from_analyzer(cls, analyzer: TransitNetworkAnalyzer,
+                      default_speed_kmh: float = DEFAULT_SPEED_KMH, **kwargs) -> 'JourneyPlanner':
+        """
+        Build route patterns from the analyzer's route sequences
+
+        Segment distance is the arriving stop's `intermediateDistance`; segments
+        without one fall back to the straight-line edge length.
+        """
+        graph = analyzer.get_transit_graph()
+        edge_index = analyzer.get_edge_index()
+        edge_lengths = analyzer.get_edge_lengths()['length_km']
+
+        patterns, segment_minutes, pattern_routes = [], [], []
+        for k, (bus_number, _, stops_in_direction) in enumerate(analyzer.get_route_sequences()):
+            if len(stops_in_direction) < 2:
+                continue
+
+            bus = analyzer.buses[k // 2]
+            duration = bus.get('durationMinuts') or 0
+            length = bus.get('routLength') or 0
+            km_per_minute = length / duration if duration > 0 and length > 0 else default_speed_kmh / 60
+
+            distances = np.array(
+                [s.get('intermediateDistance') or 0 for s in stops_in_direction[1:]], dtype=np.float64
+            )
+            fallback = edge_lengths[edge_index['sequence_edges'][k]]
+            distances = np.where(distances > 0, distances, fallback)
+
+            patterns.append(graph.nodes(edge_index['sequence_stops'][k]))
+            segment_minutes.append(distances / km_per_minute)
+            pattern_routes.append(bus_number)
+
+        return cls(graph.stop_ids, patterns, segment_minutes, pattern_routes, **kwargs)
+
+    # ==================== CORE ====================
+
+    def _raptor(self, origins: np.ndarray, destinations: np.ndarray) -> np.ndarray:
+        """
+        Run RAPTOR rounds for a batch of origin nodes
+
+        Returns arrival minutes of shape (rounds + 1, len(origins), len(destinations)):
+        entry [k] is the best time using at most k vehicles (inf if unreachable).
+        """
+        n_origins, n_nodes = len(origins), len(self.stop_ids)
+
+        # Stored node-major so each stop's arrivals for the batch are contiguous
+        previous = np.full((n_nodes, n_origins), np.inf)
+        previous[origins, np.arange(n_origins)] = 0.0
+        best = previous.copy()
+        marked = np.zeros(n_nodes, dtype=bool)
+        marked[origins] = True
+
+        by_round = [previous[destinations].T.copy()]
+
+        for k in range(1, self.max_transfers + 2):
+            if not marked.any():
+                by_round.append(by_round[-1])
+                continue
+
+            board_cost = self.wait_minutes + (self.transfer_penalty if k > 1 else 0.0)
+            current = previous.copy()
+            improved_any = np.zeros(n_nodes, dtype=bool)
+
+            active = np.unique(np.concatenate([self._serving[node] for node in np.flatnonzero(marked)]))
+            for p in active.tolist():
+                stops = self.patterns[p]
+                segments = self.segment_minutes[p]
+                trip = np.full(n_origins, np.inf)
+
+                for i, node in enumerate(stops.tolist()):
+                    if i > 0:
+                        trip = trip + segments[i - 1]
+                        improve = trip < best[node]
+                        if improve.any():
+                            np.copyto(current[node], trip, where=improve)
+                            np.copyto(best[node], trip, where=improve)
+                            improved_any[node] = True
+                    # Board here if arriving from the previous round is earlier than staying on
+                    np.minimum(trip, previous[node] + board_cost, out=trip)
+
+            by_round.append(current[destinations].T.copy())
+            previous = current
+            marked = improved_any
+
+        return np.stack(by_round)
+
+    def _batch_size(self) -> int:
+        # ~5 working arrays of (batch x nodes) float64
+        return max(1, int(BATCH_BYTES / (5 * 8 * max(len(self.stop_ids), 1))))
+
+    # ==================== QUERIES ====================
+
+    def query(self, origin: int, destination: int) -> List[Dict]:
+        """
+        Pareto-optimal journeys between two stop ids
+
+        Returns [{'transfers', 'minutes'}] with fewer transfers first; each
+        option is strictly faster than the one before it.
+        """
+        origin_node = self._node(origin)
+        destination_node = self._node(destination)
+        times = self._raptor(np.array([origin_node]), np.array([destination_node]))[:, 0, 0]
+
+        options = []
+        best = np.inf
+        for k, minutes in enumerate(times.tolist()):
+            if minutes < best:
+                options.append({'transfers': max(k - 1, 0), 'minutes': minutes})
+                best = minutes
+        return options
+
+    def travel_time_matrix(self, origins: Optional[Sequence[int]] = None,
+                           destinations: Optional[Sequence[int]] = None,
+                           batch_size: Optional[int] = None) -> Dict:
+        """
+        Many-to-many travel times between stop ids (all stops by default)
+
+        Returns 'origins' and 'destinations' stop ids, 'minutes' (float32, inf
+        if unreachable within max_transfers) and 'transfers' (int8, transfers
+        on the fastest journey, -1 if unreachable).
+        """
+        origin_ids = self.stop_ids if origins is None else np.asarray(origins, dtype=np.int64)
+        destination_ids = self.stop_ids if destinations is None else np.asarray(destinations, dtype=np.int64)
+        origin_nodes = np.array([self._node(s) for s in origin_ids.tolist()], dtype=np.int64)
+        destination_nodes = np.array([self._node(s) for s in destination_ids.tolist()], dtype=np.int64)
+
+        minutes = np.empty((len(origin_nodes), len(destination_nodes)), dtype=np.float32)
+        transfers = np.empty((len(origin_nodes), len(destination_nodes)), dtype=np.int8)
+        batch_size = batch_size or self._batch_size()
+
+        for start in range(0, len(origin_nodes), batch_size):
+            batch = slice(start, start + batch_size)
+            by_round = self._raptor(origin_nodes[batch], destination_nodes)
+
+            best = by_round[-1]
+            # First round reaching the final time = fewest vehicles for the fastest journey
+            first_round = np.argmax(by_round <= best[None, :, :], axis=0)
+            minutes[batch] = best
+            transfers[batch] = np.where(np.isfinite(best), np.maximum(first_round - 1, 0), -1)
+
+        return {
+            'origins': origin_ids,
+            'destinations': destination_ids,
+            'minutes': minutes,
+            'transfers': transfers
+        }
+
+    def _node(self, stop_id: int) -> int:
+        idx = int(np.searchsorted(self.stop_ids, stop_id))
+        if idx >= len(self.stop_ids) or self.stop_ids[idx] != stop_id:
+            raise KeyError(f"Stop {stop_id} is not served by any route")
+        return idx
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Estimate stop-to-stop travel times over the route network")
+    parser.add_argument('--bus-details', default='data/busDetails.json',
+                        help="Bus details file (.json or .ndjson)")
+    parser.add_argument('--stops', default='data/stops.json', help="Stops file")
+    parser.add_argument('--origin', type=int, help="Origin stop id")
+    parser.add_argument('--destination', type=int, help="Destination stop id")
+    parser.add_argument('--transfer-penalty', type=float, default=DEFAULT_TRANSFER_PENALTY,
+                        help="Minutes added per transfer")
+    parser.add_argument('--max-transfers', type=int, default=DEFAULT_MAX_TRANSFERS)
+    parser.add_argument('--output', default='data/travel_time_matrix.npz',
+                        help="Where to save the full travel-time matrix")
+    args = parser.parse_args()
+
+    analyzer = TransitNetworkAnalyzer(args.bus_details, args.stops)
+    planner = JourneyPlanner.from_analyzer(
+        analyzer, transfer_penalty=args.transfer_penalty, max_transfers=args.max_transfers
+    )
+
+    if args.origin is not None and args.destination is not None:
+        options = planner.query(args.origin, args.destination)
+        if not options:
+            print(f"No journey from stop {args.origin} to stop {args.destination} "
+                  f"within {args.max_transfers} transfers")
+        for option in options:
+            print(f"  {option['transfers']} transfer(s): {option['minutes']:.1f} min")
+    else:
+        print(f"\nComputing travel-time matrix for {len(planner.stop_ids)} stops...")
+        started = time.perf_counter()
+        matrix = planner.travel_time_matrix()
+        elapsed = time.perf_counter() - started
+
+        reachable = np.isfinite(matrix['minutes'])
+        print(f"   ✓ Computed in {elapsed:.1f} s")
+        print(f"   ✓ Reachable pairs: {reachable.mean() * 100:.1f}%")
+        print(f"   ✓ Mean travel time: {matrix['minutes'][reachable].mean():.1f} min")
+        for k in range(args.max_transfers + 1):
+            share = (matrix['transfers'][reachable] == k).mean() * 100
+            print(f"   ✓ {k} transfer(s): {share:.1f}% of reachable pairs")
+
+        np.savez_compressed(args.output, **matrix)
+        print(f"\nTravel-time matrix saved to {args.output}")
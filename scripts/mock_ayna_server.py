@@ -0,0 +1,352 @@
+"""
+Local Ayna API Stand-in Server
+Serves getBusList, getBusById and stop/getAll from a snapshot, with latency and fault injection
+"""
+
+import json
+import math
+import time
+import random
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+from typing import Dict, Iterable, List, Optional
+
+from polyline_codec import decode_route_geometry
+
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+API_PREFIX = '/api'
+
+# Latency models: fixed, uniform (mean ± spread), normal (sd = spread), lognormal (median = mean, sigma = spread)
+LATENCY_KINDS = ('fixed', 'uniform', 'normal', 'lognormal')
+
+# Statuses drawn for injected server errors (all retried by busDetails.py)
+ERROR_STATUSES = (500, 502, 503)
+
+# Endpoints that faults (errors, 429s, truncation) apply to; the rest only get latency,
+# since the fetchers load the bus list and stops once without retries
+FAULT_ENDPOINTS = ('getBusById',)
+
+
+class LatencyModel:
+    """Response delay distribution, in milliseconds"""
+
+    def __init__(self, kind: str = 'fixed', mean_ms: float = 0.0, spread: float = 0.0):
+        if kind not in LATENCY_KINDS:
+            raise ValueError(f"Unknown latency kind {kind!r}: use one of {', '.join(LATENCY_KINDS)}")
+        self.kind = kind
+        self.mean_ms = mean_ms
+        self.spread = spread
+
+    @classmethod
+    def parse(cls, spec: str) -> 'LatencyModel':
+        """From `kind:mean_ms[,spread]`, e.g. `lognormal:40,0.6` or `uniform:50,30`"""
+        kind, _, params = spec.partition(':')
+        values = [float(v) for v in params.split(',') if v] if params else []
+        return cls(kind, *values)
+
+    def sample(self, rng: random.Random) -> float:
+        """Delay in seconds"""
+        if self.kind == 'fixed':
+            ms = self.mean_ms
+        elif self.kind == 'uniform':
+            ms = rng.uniform(self.mean_ms - self.spread, self.mean_ms + self.spread)
+        elif self.kind == 'normal':
+            ms = rng.gauss(self.mean_ms, self.spread)
+        else:
+            ms = self.mean_ms * math.exp(rng.gauss(0, self.spread))
+        return max(ms, 0.0) / 1000
+
+    def describe(self) -> str:
+        return f"{self.kind}:{self.mean_ms:g},{self.spread:g}"
+
+
+class FaultProfile:
+    """
+    What the server does wrong, and how often
+
+    error_rate: fraction of requests answered with a 5xx error
+    throttle_rate: fraction answered with 429 and `Retry-After: retry_after`
+    rate_limit: requests per second allowed before 429s (token bucket, burst of one second);
+        Retry-After then gives the seconds until a request would be admitted
+    truncate_rate: fraction whose body is cut off mid-response (full Content-Length, connection closed)
+    """
+
+    def __init__(self, latency: Optional[LatencyModel] = None, error_rate: float = 0.0,
+                 throttle_rate: float = 0.0, retry_after: int = 1, rate_limit: Optional[float] = None,
+                 truncate_rate: float = 0.0):
+        self.latency = latency or LatencyModel()
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.rate_limit = rate_limit
+        self.truncate_rate = truncate_rate
+
+    def describe(self) -> Dict:
+        return {'latency': self.latency.describe(), 'error_rate': self.error_rate,
+                'throttle_rate': self.throttle_rate, 'retry_after': self.retry_after,
+                'rate_limit': self.rate_limit, 'truncate_rate': self.truncate_rate}
+
+
+# ==================== SNAPSHOTS ====================
+
+class Snapshot:
+    """Pre-serialized API responses for a set of buses and stops"""
+
+    def __init__(self, bus_details: Iterable[Dict], stops: List[Dict]):
+        self.bus_list = []
+        self.buses = {}
+        for details in bus_details:
+            details = decode_route_geometry(details)  # the API serves raw flowCoordinates
+            self.bus_list.append({'id': details['id'], 'number': details['number']})
+            self.buses[details['id']] = json.dumps(details, ensure_ascii=False).encode('utf-8')
+        self.bus_list_body = json.dumps(self.bus_list, ensure_ascii=False).encode('utf-8')
+        self.stops_body = json.dumps(stops, ensure_ascii=False).encode('utf-8')
+
+    @classmethod
+    def from_files(cls, bus_details_path: str = 'data/busDetails.json',
+                   stops_path: str = 'data/stops.json') -> 'Snapshot':
+        """Recorded snapshot (bus details as .json or .ndjson, encoded or raw geometry)"""
+        from network_analysis import iter_bus_details
+
+        with open(stops_path, 'r', encoding='utf-8') as f:
+            stops = json.load(f)
+        return cls(iter_bus_details(bus_details_path, drop_fields=()), stops)
+
+    @classmethod
+    def synthetic(cls, size: str = 'small', overlap: Optional[float] = None, seed: Optional[int] = None) -> 'Snapshot':
+        """Snapshot of a generated network (see synthetic_network.py)"""
+        from synthetic_network import SyntheticNetworkGenerator, parse_size, DEFAULT_OVERLAP, DEFAULT_SEED
+
+        routes, stops = parse_size(size)
+        generator = SyntheticNetworkGenerator(routes, stops, DEFAULT_OVERLAP if overlap is None else overlap,
+                                              DEFAULT_SEED if seed is None else seed)
+        return cls(generator.bus_details(), generator.stops())
+
+
+# ==================== SERVER ====================
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256  # concurrent fetchers open many connections at once
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server_version = 'MockAyna/1.0'
+
+    def log_message(self, format, *args):
+        if self.server.app.verbose:
+            super().log_message(format, *args)
+
+    def do_GET(self):
+        self.server.app.handle(self)
+
+
+class MockAynaServer:
+    """
+    Threaded stand-in for the Ayna API
+
+    Random decisions for a request come from a generator seeded with
+    (seed, path, n), where n counts earlier requests for the same path. The
+    n-th request for a given bus therefore gets the same latency and fault
+    whatever the concurrency or arrival order, so runs are reproducible.
+    Only the rate limit depends on real time.
+    """
+
+    def __init__(self, snapshot: Snapshot, faults: Optional[FaultProfile] = None, host: str = DEFAULT_HOST,
+                 port: int = DEFAULT_PORT, seed: int = 0, verbose: bool = False):
+        self.snapshot = snapshot
+        self.faults = faults or FaultProfile()
+        self.seed = seed
+        self.verbose = verbose
+        self._lock = threading.Lock()
+        self._thread = None
+
+        self.httpd = _Server((host, port), _Handler)
+        self.httpd.app = self
+        self.reset()
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}{API_PREFIX}"
+
+    def reset(self):
+        """Restart request counters, statistics and the rate limiter (same fault sequence again)"""
+        with self._lock:
+            self._request_counts = {}
+            self._tokens = self.faults.rate_limit or 0.0
+            self._last_refill = time.monotonic()
+            self.stats = {'requests': 0, 'ok': 0, 'errors': 0, 'throttled': 0, 'truncated': 0,
+                          'not_found': 0, 'bytes_sent': 0}
+
+    def _next_rng(self, path: str) -> random.Random:
+        with self._lock:
+            n = self._request_counts.get(path, 0)
+            self._request_counts[path] = n + 1
+            self.stats['requests'] += 1
+        return random.Random(f"{self.seed}:{path}:{n}")
+
+    def _admit(self) -> Optional[int]:
+        """Take a rate-limit token; returns the Retry-After seconds when none is left"""
+        limit = self.faults.rate_limit
+        if not limit:
+            return None
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(limit, self._tokens + (now - self._last_refill) * limit)
+            self._last_refill = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return None
+            return max(1, math.ceil((1 - self._tokens) / limit))
+
+    def _count(self, key: str, sent: int = 0):
+        with self._lock:
+            self.stats[key] += 1
+            self.stats['bytes_sent'] += sent
+
+    def handle(self, request: BaseHTTPRequestHandler):
+        url = urlparse(request.path)
+        endpoint = url.path.rstrip('/').rsplit('/', 1)[-1]
+        rng = self._next_rng(request.path)
+        faults = self.faults
+
+        time.sleep(faults.latency.sample(rng))
+
+        if endpoint == 'getBusList' and url.path == f"{API_PREFIX}/bus/getBusList":
+            body = self.snapshot.bus_list_body
+        elif endpoint == 'getBusById' and url.path == f"{API_PREFIX}/bus/getBusById":
+            try:
+                body = self.snapshot.buses.get(int(parse_qs(url.query)['id'][0]))
+            except (KeyError, ValueError):
+                body = None
+        elif endpoint == 'getAll' and url.path == f"{API_PREFIX}/stop/getAll":
+            body = self.snapshot.stops_body
+        else:
+            body = None
+
+        if body is None:
+            self._count('not_found')
+            return self._send_status(request, 404)
+
+        retry_after = None
+        truncate = False
+        if endpoint in FAULT_ENDPOINTS:
+            retry_after = self._admit()
+            roll = rng.random()
+            if roll < faults.error_rate:
+                self._count('errors')
+                return self._send_status(request, rng.choice(ERROR_STATUSES))
+            if retry_after is None and roll < faults.error_rate + faults.throttle_rate:
+                retry_after = faults.retry_after
+            truncate = rng.random() < faults.truncate_rate
+
+        if retry_after is not None:
+            self._count('throttled')
+            return self._send_status(request, 429, {'Retry-After': str(retry_after)})
+
+        request.send_response(200)
+        request.send_header('Content-Type', 'application/json; charset=utf-8')
+        request.send_header('Content-Length', str(len(body)))
+        if truncate:
+            request.send_header('Connection', 'close')
+        request.end_headers()
+
+        if truncate:
+            cut = rng.randint(0, len(body) - 1)
+            request.wfile.write(body[:cut])
+            request.close_connection = True
+            self._count('truncated', cut)
+        else:
+            request.wfile.write(body)
+            self._count('ok', len(body))
+
+    @staticmethod
+    def _send_status(request: BaseHTTPRequestHandler, status: int, headers: Optional[Dict] = None):
+        body = json.dumps({'status': status}).encode('utf-8')
+        request.send_response(status)
+        request.send_header('Content-Type', 'application/json')
+        request.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            request.send_header(key, value)
+        request.end_headers()
+        request.wfile.write(body)
+
+    # ==================== LIFECYCLE ====================
+
+    def start(self) -> 'MockAynaServer':
+        """Serve on a background thread"""
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self) -> 'MockAynaServer':
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def add_fault_arguments(parser: argparse.ArgumentParser):
+    """Command line options for a FaultProfile (shared with fetch_benchmark.py)"""
+    parser.add_argument('--latency', default='fixed:0',
+                        help=f"kind:mean_ms[,spread] with kind in {', '.join(LATENCY_KINDS)} (e.g. lognormal:40,0.6)")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Fraction of bus requests answered 5xx")
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help="Fraction of bus requests answered 429")
+    parser.add_argument('--retry-after', type=int, default=1, help="Retry-After seconds sent with random 429s")
+    parser.add_argument('--rate-limit', type=float, default=None, help="Requests per second before 429s")
+    parser.add_argument('--truncate-rate', type=float, default=0.0, help="Fraction of bus responses cut off")
+    parser.add_argument('--seed', type=int, default=0, help="Seed of the latency and fault draws")
+
+
+def fault_profile_from_args(args: argparse.Namespace) -> FaultProfile:
+    return FaultProfile(latency=LatencyModel.parse(args.latency), error_rate=args.error_rate,
+                        throttle_rate=args.throttle_rate, retry_after=args.retry_after,
+                        rate_limit=args.rate_limit, truncate_rate=args.truncate_rate)
+
+
+def add_snapshot_arguments(parser: argparse.ArgumentParser):
+    """Command line options selecting the served snapshot (shared with fetch_benchmark.py)"""
+    parser.add_argument('--bus-details', default='data/busDetails.json', help="Recorded bus details (.json/.ndjson)")
+    parser.add_argument('--stops', default='data/stops.json', help="Recorded stops file")
+    parser.add_argument('--synthetic', default=None, metavar='SIZE',
+                        help="Serve a generated network instead (small, medium, ... or ROUTESxSTOPS)")
+
+
+def snapshot_from_args(args: argparse.Namespace) -> Snapshot:
+    if args.synthetic:
+        return Snapshot.synthetic(args.synthetic)
+    return Snapshot.from_files(args.bus_details, args.stops)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve a local stand-in for the Ayna API")
+    add_snapshot_arguments(parser)
+    add_fault_arguments(parser)
+    parser.add_argument('--host', default=DEFAULT_HOST)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--verbose', action='store_true', help="Log every request")
+    args = parser.parse_args()
+
+    server = MockAynaServer(snapshot_from_args(args), fault_profile_from_args(args),
+                            host=args.host, port=args.port, seed=args.seed, verbose=args.verbose)
+    print(f"Serving {len(server.snapshot.bus_list)} buses at {server.base_url}")
+    print(f"Faults: {server.faults.describe()}")
+    print(f"Point the fetchers at it with --base-url {server.base_url} or AYNA_API_BASE_URL={server.base_url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+        print(f"\nServed: {server.stats}")
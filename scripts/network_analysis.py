@@ -5,9 +5,73 @@ Computes topology, overlap, efficiency, and ecological impact metrics
 
 import json
 import math
+import os
+import contextlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from collections import defaultdict, Counter
-from typing import Dict, List, Tuple, Set
+from typing import Dict, List, Optional, Tuple, Set, Iterator, Iterable
 import numpy as np
+from scipy import sparse
+
+from transit_graph import TransitGraph
+from centrality import compute_centrality, rank_hubs
+from results_io import save_results, write_legacy_json, DEFAULT_RESULTS_DIR, LEGACY_RESULTS_PATH
+from instrumentation import StageProfiler, print_stage, find_regressions, METRICS_FILENAME
+
+
+# Bus detail fields the analysis never reads; dropped on ingest to save memory.
+# Route geometry (`routes[].flowCoordinates`) is the bulk of the file and is
+# loaded separately when a geometry stage needs it.
+UNUSED_BUS_FIELDS = ('paymentType', 'region', 'workingZoneType', 'routes')
+
+# Stops listed in the betweenness-ranked hub list of the topology results
+CENTRALITY_HUB_COUNT = 20
+
+EARTH_RADIUS_KM = 6371
+
+# Analysis stages that only read the network and can run concurrently;
+# waste and ecology depend on overlap and run after them
+INDEPENDENT_STAGES = ('topology', 'overlap', 'spacing')
+
+
+def haversine_km(lat1, lon1, lat2, lon2) -> np.ndarray:
+    """
+    Vectorized great circle distance in kilometers
+    Accepts scalars or equally shaped arrays of coordinates in degrees
+    """
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(x, dtype=np.float64)) for x in (lat1, lon1, lat2, lon2))
+
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return EARTH_RADIUS_KM * 2 * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def iter_bus_details(path: str, drop_fields: Iterable[str] = UNUSED_BUS_FIELDS) -> Iterator[Dict]:
+    """
+    Yield bus detail records one at a time from a JSON array or NDJSON file
+
+    NDJSON files (one route per line, see busDetails.py --format ndjson) are
+    streamed line by line, so only one raw route is held in memory at once.
+    Fields in `drop_fields` are removed from each record as it is read.
+    """
+    drop_fields = tuple(drop_fields)
+
+    def slim(bus: Dict) -> Dict:
+        for field in drop_fields:
+            bus.pop(field, None)
+        return bus
+
+    with open(path, 'r', encoding='utf-8') as f:
+        if path.endswith('.ndjson'):
+            for line in f:
+                if line.strip():
+                    yield slim(json.loads(line))
+        else:
+            buses = json.load(f)
+            # Pop from the end of the reversed list so the raw document shrinks as we go
+            buses.reverse()
+            while buses:
+                yield slim(buses.pop())
 
 
 class TransitNetworkAnalyzer:
@@ -16,16 +80,114 @@ class TransitNetworkAnalyzer:
     """
 
     def __init__(self, bus_details_path: str, stops_path: str):
-        """Load transit network data"""
-        with open(bus_details_path, 'r', encoding='utf-8') as f:
-            self.buses = json.load(f)
+        """Load transit network data (bus details as JSON or NDJSON)"""
+        self.bus_details_path = bus_details_path
+        self.buses = list(iter_bus_details(bus_details_path))
 
         with open(stops_path, 'r', encoding='utf-8') as f:
             self.stops = json.load(f)
 
         self.stop_index = {stop['id']: stop for stop in self.stops}
+        self.store = None
+        self._route_sequences = None
+        self._edge_index = None
+        self._stop_coordinates = None
+        self._edge_lengths = None
+        self._incidence = None
+        self._graph = None
+        self._centrality = {}
+        self._spatial_index = None
+        self._geometry_overlap = None
         print(f"Loaded {len(self.buses)} bus routes and {len(self.stops)} stops")
 
+    @classmethod
+    def from_store(cls, store_dir: str = 'data/network_store', bus_details_path: Optional[str] = None,
+                   stops_path: Optional[str] = None, rebuild_stale: bool = False) -> 'TransitNetworkAnalyzer':
+        """
+        Open the analyzer on a memory-mapped columnar store (see network_store.py)
+        instead of re-parsing the JSON sources
+
+        The store must be current with its source files (by default the ones it
+        was built from). A stale store is rebuilt with rebuild_stale, otherwise
+        a ValueError is raised rather than analysing outdated data.
+        """
+        from network_store import NetworkStore, build_network_store
+
+        store = NetworkStore(store_dir)
+        sources = store.meta['sources']
+        bus_details_path = bus_details_path or sources['bus_details']['path']
+        stops_path = stops_path or sources['stops']['path']
+        if not store.is_current(bus_details_path, stops_path):
+            if not (rebuild_stale and os.path.exists(bus_details_path) and os.path.exists(stops_path)):
+                raise ValueError(
+                    f"Network store {store_dir} is out of date with {bus_details_path} and {stops_path}; "
+                    f"rebuild it with scripts/network_store.py"
+                )
+            print(f"Network store {store_dir} is out of date, rebuilding...")
+            build_network_store(bus_details_path, stops_path, store_dir)
+            store = NetworkStore(store_dir)
+        analyzer = cls.__new__(cls)
+        analyzer.store = store
+        analyzer._route_sequences = None
+        analyzer._edge_index = None
+        analyzer._stop_coordinates = None
+        analyzer._edge_lengths = None
+        analyzer._incidence = None
+        analyzer._graph = None
+        analyzer._centrality = {}
+        analyzer._spatial_index = None
+        analyzer._geometry_overlap = None
+        analyzer.bus_details_path = store.meta['sources']['bus_details']['path']
+
+        stop_ids = store.stop_ids.tolist()
+        stop_lat = store.stop_lat.tolist()
+        stop_lon = store.stop_lon.tolist()
+        stop_is_hub = store.stop_is_hub.tolist()
+        analyzer.stops = [
+            {'id': stop_ids[i], 'latitude': stop_lat[i], 'longitude': stop_lon[i],
+             'isTransportHub': stop_is_hub[i]}
+            for i in np.flatnonzero(store.stop_in_index).tolist()
+        ]
+        analyzer.stop_index = {stop['id']: stop for stop in analyzer.stops}
+
+        # Rebuild lightweight bus records holding only the fields the analysis reads
+        offsets = store.seq_offsets.tolist()
+        seq_stops = store.seq_stops.tolist()
+        seq_lat = store.seq_lat.tolist()
+        seq_lon = store.seq_lon.tolist()
+        seq_inter = store.seq_intermediate_distance.tolist()
+        seq_total = store.seq_total_distance.tolist()
+        route_numbers = store.route_numbers.tolist()
+        bus_route = store.bus_route.tolist()
+        bus_length = store.bus_length.tolist()
+        bus_duration = store.bus_duration.tolist()
+
+        analyzer.buses = []
+        for i, bus_id in enumerate(store.bus_ids.tolist()):
+            stops = []
+            for k, direction in ((2 * i, 1), (2 * i + 1, 2)):
+                for j in range(offsets[k], offsets[k + 1]):
+                    stop_id = stop_ids[seq_stops[j]]
+                    stops.append({
+                        'id': j,  # global position preserves the sequence order
+                        'stopId': stop_id,
+                        'directionTypeId': direction,
+                        'intermediateDistance': seq_inter[j],
+                        'totalDistance': seq_total[j],
+                        'stop': {'id': stop_id, 'latitude': seq_lat[j], 'longitude': seq_lon[j]}
+                    })
+
+            analyzer.buses.append({
+                'id': bus_id,
+                'number': route_numbers[bus_route[i]],
+                'routLength': bus_length[i],
+                'durationMinuts': None if math.isnan(bus_duration[i]) else bus_duration[i],
+                'stops': stops
+            })
+
+        print(f"Loaded {len(analyzer.buses)} bus routes and {len(analyzer.stops)} stops from {store_dir}/")
+        return analyzer
+
     def _clean_coordinate(self, coord_str: str) -> float:
         """Clean coordinate string (remove commas used as thousand separators)"""
         if isinstance(coord_str, (int, float)):
@@ -47,17 +209,249 @@ class TransitNetworkAnalyzer:
 
         return R * c
 
+    # ==================== SHARED ROUTE INDEX ====================
+
+    def get_route_sequences(self) -> List[Tuple[str, int, List[Dict]]]:
+        """
+        Per-direction stop sequences of every bus, built once and cached
+        Returns (bus_number, direction, stops sorted by sequence id) for directions 1 and 2
+        """
+        if self._route_sequences is None:
+            sequences = []
+            for bus in self.buses:
+                by_direction = defaultdict(list)
+                for stop_seq in bus['stops']:
+                    by_direction[stop_seq['directionTypeId']].append(stop_seq)
+
+                for direction in [1, 2]:
+                    stops_in_direction = sorted(by_direction.get(direction, []), key=lambda x: x['id'])
+                    sequences.append((bus['number'], direction, stops_in_direction))
+
+            self._route_sequences = sequences
+
+        return self._route_sequences
+
+    def get_edge_index(self) -> Dict:
+        """
+        Edge index shared by all analysis stages, built once from the route sequences
+        Returns edge -> routes and route -> edges mappings (edges are
+        undirected (min_stop, max_stop) tuples), plus dense edge ids: `edges`
+        lists edges by id, and `sequence_stops` / `sequence_edges` hold the stop
+        ids and segment edge ids of each route sequence
+        """
+        if self._edge_index is None:
+            edge_routes = defaultdict(set)  # Which routes use each edge
+            route_edges = defaultdict(set)  # Which edges each route uses
+            edge_ids = {}
+            sequence_stops = []
+            sequence_edges = []
+
+            for bus_number, _, stops_in_direction in self.get_route_sequences():
+                stop_ids = [s['stopId'] for s in stops_in_direction]
+                segment_edges = []
+
+                for from_stop, to_stop in zip(stop_ids, stop_ids[1:]):
+                    edge = (from_stop, to_stop) if from_stop <= to_stop else (to_stop, from_stop)
+                    edge_routes[edge].add(bus_number)
+                    route_edges[bus_number].add(edge)
+                    segment_edges.append(edge_ids.setdefault(edge, len(edge_ids)))
+
+                sequence_stops.append(np.array(stop_ids, dtype=np.int64))
+                sequence_edges.append(np.array(segment_edges, dtype=np.int64))
+
+            self._edge_index = {
+                'edge_routes': dict(edge_routes),
+                'route_edges': dict(route_edges),
+                'edges': list(edge_ids),
+                'edge_ids': edge_ids,
+                'sequence_stops': sequence_stops,
+                'sequence_edges': sequence_edges
+            }
+
+        return self._edge_index
+
+    def get_route_edge_incidence(self) -> Dict:
+        """
+        Sparse route x edge incidence matrix, built once and cached
+        Returns `routes` (route number per row, in order of first use) and a
+        binary CSR `matrix` whose columns are edge ids from get_edge_index()
+        """
+        if self._incidence is None:
+            edge_index = self.get_edge_index()
+            route_rows = {}
+            rows, cols = [], []
+
+            for (bus_number, _, _), segment_edges in zip(self.get_route_sequences(), edge_index['sequence_edges']):
+                if len(segment_edges) == 0:
+                    continue
+                row = route_rows.setdefault(bus_number, len(route_rows))
+                rows.append(np.full(len(segment_edges), row, dtype=np.int64))
+                cols.append(segment_edges)
+
+            n_routes, n_edges = len(route_rows), len(edge_index['edges'])
+            rows = np.concatenate(rows) if rows else np.empty(0, dtype=np.int64)
+            cols = np.concatenate(cols) if cols else np.empty(0, dtype=np.int64)
+
+            matrix = sparse.csr_matrix(
+                (np.ones(len(rows), dtype=np.int32), (rows, cols)), shape=(n_routes, n_edges)
+            )
+            matrix.sum_duplicates()
+            matrix.data[:] = 1  # a route using an edge in both directions counts once
+
+            self._incidence = {'routes': list(route_rows), 'matrix': matrix}
+
+        return self._incidence
+
+    def get_transit_graph(self) -> TransitGraph:
+        """
+        Integer-indexed CSR stop graph, built once and cached
+        Undirected edge ids match get_edge_index(); edge route lists come from the incidence matrix
+        """
+        if self._graph is None:
+            edge_index = self.get_edge_index()
+            incidence = self.get_route_edge_incidence()
+            sequences = [stops for stops in edge_index['sequence_stops'] if len(stops) > 1]
+
+            self._graph = TransitGraph.from_segments(
+                np.concatenate([stops[:-1] for stops in sequences]) if sequences else [],
+                np.concatenate([stops[1:] for stops in sequences]) if sequences else [],
+                edges=np.array(edge_index['edges'], dtype=np.int64).reshape(-1, 2),
+                edge_routes=incidence['matrix'].T.tocsr(),
+                routes=incidence['routes']
+            )
+
+        return self._graph
+
+    def get_centrality(self, samples: Optional[int] = None, workers: Optional[int] = None) -> Dict:
+        """
+        Betweenness and closeness centrality of the stop graph, cached per `samples`
+        Exact on small networks, sampled with an error bound on large ones (see centrality.py);
+        `workers` only splits the work and does not change the result
+        """
+        if samples not in self._centrality:
+            self._centrality[samples] = compute_centrality(self.get_transit_graph(), samples=samples,
+                                                           workers=workers)
+        return self._centrality[samples]
+
+    def get_edge_route_counts(self) -> np.ndarray:
+        """Number of distinct routes using each edge (duplication factor), by edge id"""
+        matrix = self.get_route_edge_incidence()['matrix']
+        return np.bincount(matrix.indices, minlength=matrix.shape[1])
+
+    # ==================== DISTANCE ENGINE ====================
+
+    def get_stop_coordinates(self) -> Dict:
+        """
+        Stop coordinates parsed once into float64 arrays, cached
+        Coordinates from stops.json take precedence; stops referenced only by
+        routes use the coordinates embedded in their route stop objects.
+        Returns sorted `stop_ids` with aligned `lat`, `lon` and `in_index`
+        (stop is present in stops.json) arrays
+        """
+        if self._stop_coordinates is None:
+            if self.store is not None:
+                table = {
+                    'stop_ids': np.asarray(self.store.stop_ids),
+                    'lat': np.asarray(self.store.stop_lat),
+                    'lon': np.asarray(self.store.stop_lon),
+                    'in_index': np.asarray(self.store.stop_in_index)
+                }
+            else:
+                coords = {
+                    stop_id: (self._clean_coordinate(stop['latitude']), self._clean_coordinate(stop['longitude']))
+                    for stop_id, stop in self.stop_index.items()
+                }
+                for _, _, stops_in_direction in self.get_route_sequences():
+                    for stop_seq in stops_in_direction:
+                        if stop_seq['stopId'] not in coords:
+                            stop = stop_seq['stop']
+                            coords[stop_seq['stopId']] = (
+                                self._clean_coordinate(stop['latitude']),
+                                self._clean_coordinate(stop['longitude'])
+                            )
+
+                stop_ids = np.array(sorted(coords), dtype=np.int64)
+                lat_lon = np.array([coords[stop_id] for stop_id in stop_ids.tolist()], dtype=np.float64)
+                table = {
+                    'stop_ids': stop_ids,
+                    'lat': lat_lon[:, 0] if len(stop_ids) else np.empty(0),
+                    'lon': lat_lon[:, 1] if len(stop_ids) else np.empty(0),
+                    'in_index': np.array([stop_id in self.stop_index for stop_id in stop_ids.tolist()], dtype=bool)
+                }
+
+            self._stop_coordinates = table
+
+        return self._stop_coordinates
+
+    def stop_positions(self, stop_ids) -> np.ndarray:
+        """Positions of stop ids in the coordinate table"""
+        return np.searchsorted(self.get_stop_coordinates()['stop_ids'], np.asarray(stop_ids, dtype=np.int64))
+
+    def pairwise_distances(self, from_stops, to_stops) -> np.ndarray:
+        """Batched distances in km between aligned arrays of stop ids"""
+        table = self.get_stop_coordinates()
+        i = self.stop_positions(from_stops)
+        j = self.stop_positions(to_stops)
+        return haversine_km(table['lat'][i], table['lon'][i], table['lat'][j], table['lon'][j])
+
+    def get_edge_lengths(self) -> Dict:
+        """
+        Edge-length table shared by the spacing and waste stages, cached
+        Returns `length_km` aligned with edge ids from get_edge_index(), and an
+        `indexed` mask marking edges whose both stops are present in stops.json
+        """
+        if self._edge_lengths is None:
+            edges = np.array(self.get_edge_index()['edges'], dtype=np.int64).reshape(-1, 2)
+            table = self.get_stop_coordinates()
+
+            self._edge_lengths = {
+                'length_km': self.pairwise_distances(edges[:, 0], edges[:, 1]),
+                'indexed': table['in_index'][self.stop_positions(edges[:, 0])] &
+                           table['in_index'][self.stop_positions(edges[:, 1])]
+            }
+
+        return self._edge_lengths
+
+    def get_spatial_index(self):
+        """KD-tree over all stop coordinates (see spatial_index.py), built once and cached"""
+        if self._spatial_index is None:
+            from spatial_index import StopSpatialIndex
+            self._spatial_index = StopSpatialIndex.from_analyzer(self)
+        return self._spatial_index
+
+    def get_geometry_overlap(self):
+        """
+        Shared road kilometres from route polylines (see geometry_overlap.py), cached
+        The polylines are dropped on load, so they are streamed from the bus details file again
+        """
+        if self._geometry_overlap is None:
+            from geometry_overlap import GeometryOverlapEngine
+            self._geometry_overlap = GeometryOverlapEngine.from_analyzer(self)
+        return self._geometry_overlap
+
+    def find_consolidation_clusters(self, radius_m: float = 200) -> List[Dict]:
+        """Stops closer than radius_m that are served by different routes, grouped into clusters"""
+        stop_routes = defaultdict(set)
+        for bus_number, _, stops_in_direction in self.get_route_sequences():
+            for stop_seq in stops_in_direction:
+                stop_routes[stop_seq['stopId']].add(bus_number)
+
+        return self.get_spatial_index().consolidation_clusters(stop_routes, radius_m)
+
     # ==================== NETWORK TOPOLOGY ANALYSIS ====================
 
-    def build_stop_graph(self) -> Dict:
+    def build_stop_graph(self, centrality: bool = False, workers: Optional[int] = None) -> Dict:
         """
         Build network graph from bus routes
         Returns stop connectivity, degree distribution, and hub identification
+
+        centrality: also rank hubs by betweenness and closeness (see get_centrality).
+        This costs a shortest-path pass per source stop, far more than the rest
+        of the stage, so it is opt-in; `workers` is passed through to it.
         """
-        # Build adjacency list
-        adjacency = defaultdict(set)
+        graph = self.get_transit_graph()
+        edge_routes = self.get_edge_index()['edge_routes']
         stop_routes = defaultdict(set)  # Which routes serve each stop
-        edge_routes = defaultdict(set)  # Which routes use each edge
 
         for bus in self.buses:
             bus_number = bus['number']
@@ -66,27 +460,13 @@ class TransitNetworkAnalyzer:
                 stop_id = stop_seq['stopId']
                 stop_routes[stop_id].add(bus_number)
 
-            # Build edges from stop sequence
-            for direction in [1, 2]:
-                stops_in_direction = sorted(
-                    [s for s in bus['stops'] if s['directionTypeId'] == direction],
-                    key=lambda x: x['id']
-                )
-
-                for i in range(len(stops_in_direction) - 1):
-                    from_stop = stops_in_direction[i]['stopId']
-                    to_stop = stops_in_direction[i + 1]['stopId']
-
-                    adjacency[from_stop].add(to_stop)
-                    edge = tuple(sorted([from_stop, to_stop]))
-                    edge_routes[edge].add(bus_number)
-
         # Compute degree distribution
-        degrees = {stop_id: len(neighbors) for stop_id, neighbors in adjacency.items()}
+        degrees = graph.out_degree_dict()
 
         # Identify hubs (stops with high degree)
-        mean_degree = np.mean(list(degrees.values()))
-        std_degree = np.std(list(degrees.values()))
+        degree_values = graph.out_degrees[graph.out_order]
+        mean_degree = np.mean(degree_values)
+        std_degree = np.std(degree_values)
         hub_threshold = mean_degree + 1.5 * std_degree
 
         hubs = [
@@ -94,33 +474,44 @@ class TransitNetworkAnalyzer:
                 'stop_id': stop_id,
                 'degree': degree,
                 'routes_count': len(stop_routes[stop_id]),
-                'routes': list(stop_routes[stop_id])
+                'routes': sorted(stop_routes[stop_id])
             }
             for stop_id, degree in degrees.items()
             if degree >= hub_threshold
         ]
 
-        return {
-            'adjacency': dict(adjacency),
+        topology = {
+            'adjacency': graph.adjacency_dict(),
             'degrees': degrees,
             'stop_routes': dict(stop_routes),
             'edge_routes': dict(edge_routes),
             'hubs': sorted(hubs, key=lambda x: x['degree'], reverse=True),
             'mean_degree': mean_degree,
             'max_degree': max(degrees.values()) if degrees else 0,
-            'network_density': self._compute_network_density(adjacency)
+            'network_density': graph.density()
         }
 
-    def _compute_network_density(self, adjacency: Dict) -> float:
-        """Compute network density (actual edges / possible edges)"""
-        n_nodes = len(adjacency)
-        if n_nodes <= 1:
-            return 0.0
-
-        actual_edges = sum(len(neighbors) for neighbors in adjacency.values()) / 2
-        possible_edges = n_nodes * (n_nodes - 1) / 2
+        if centrality:
+            scores = self.get_centrality(workers=workers)
+            for hub in hubs:
+                hub['betweenness'] = float(scores['betweenness'][graph.node(hub['stop_id'])])
+                hub['closeness'] = float(scores['closeness'][graph.node(hub['stop_id'])])
+
+            # Stops most trips pass through, whatever their degree
+            centrality_hubs = rank_hubs(scores, CENTRALITY_HUB_COUNT)
+            for hub in centrality_hubs:
+                hub['degree'] = degrees.get(hub['stop_id'], 0)
+                hub['routes_count'] = len(stop_routes.get(hub['stop_id'], ()))
+
+            topology['centrality_hubs'] = centrality_hubs
+            topology['centrality'] = {
+                'mode': scores['mode'],
+                'samples': scores['samples'],
+                'error_bound': scores['error_bound'],
+                'confidence': scores['confidence']
+            }
 
-        return actual_edges / possible_edges if possible_edges > 0 else 0.0
+        return topology
 
     # ==================== ROUTE OVERLAP ANALYSIS ====================
 
@@ -128,61 +519,45 @@ class TransitNetworkAnalyzer:
         """
         Detect overlapping route segments and quantify duplication
         """
-        # Build edge-to-routes mapping
-        edge_routes = defaultdict(set)
-        route_edges = defaultdict(set)
-
-        for bus in self.buses:
-            bus_number = bus['number']
-
-            for direction in [1, 2]:
-                stops_in_direction = sorted(
-                    [s for s in bus['stops'] if s['directionTypeId'] == direction],
-                    key=lambda x: x['id']
-                )
-
-                for i in range(len(stops_in_direction) - 1):
-                    from_stop = stops_in_direction[i]['stopId']
-                    to_stop = stops_in_direction[i + 1]['stopId']
-
-                    edge = tuple(sorted([from_stop, to_stop]))
-                    edge_routes[edge].add(bus_number)
-                    route_edges[bus_number].add(edge)
-
-        # Compute overlap metrics
-        overlapping_edges = {edge: routes for edge, routes in edge_routes.items() if len(routes) > 1}
-
-        total_edges = len(edge_routes)
-        overlapping_edge_count = len(overlapping_edges)
+        # Metrics are reductions over the route x edge incidence matrix
+        edge_index = self.get_edge_index()
+        incidence = self.get_route_edge_incidence()
+        matrix = incidence['matrix']
+        edge_counts = self.get_edge_route_counts()
+        is_overlapping = edge_counts > 1
+
+        total_edges = len(edge_counts)
+        overlapping_edge_count = int(np.count_nonzero(is_overlapping))
         overlap_percentage = (overlapping_edge_count / total_edges * 100) if total_edges > 0 else 0
 
-        # Find highly duplicated corridors
+        # Find highly duplicated corridors (stable sort keeps first-seen order among ties)
         high_duplication_threshold = 5
+        corridor_ids = np.flatnonzero(edge_counts >= high_duplication_threshold)
+        corridor_ids = corridor_ids[np.argsort(-edge_counts[corridor_ids], kind='stable')][:20]
+        edge_matrix = matrix[:, corridor_ids].tocsc()
         high_duplication_corridors = [
-            {'edge': edge, 'routes': list(routes), 'duplication_factor': len(routes)}
-            for edge, routes in overlapping_edges.items()
-            if len(routes) >= high_duplication_threshold
+            {
+                'edge': edge_index['edges'][edge_id],
+                'routes': [incidence['routes'][row] for row in edge_matrix[:, k].indices],
+                'duplication_factor': int(edge_counts[edge_id])
+            }
+            for k, edge_id in enumerate(corridor_ids.tolist())
         ]
 
         # Compute per-route duplication index
-        route_duplication = {}
-        for bus_number, edges in route_edges.items():
-            duplicated_edges = sum(1 for edge in edges if len(edge_routes[edge]) > 1)
-            duplication_index = (duplicated_edges / len(edges) * 100) if edges else 0
-            route_duplication[bus_number] = duplication_index
+        edges_per_route = np.diff(matrix.indptr)
+        duplicated_per_route = matrix @ is_overlapping.astype(np.int32)
+        duplication_index = duplicated_per_route / np.maximum(edges_per_route, 1) * 100
+        route_duplication = dict(zip(incidence['routes'], duplication_index.tolist()))
 
         return {
             'total_edges': total_edges,
             'overlapping_edges': overlapping_edge_count,
             'overlap_percentage': overlap_percentage,
-            'edge_routes': dict(edge_routes),
-            'high_duplication_corridors': sorted(
-                high_duplication_corridors,
-                key=lambda x: x['duplication_factor'],
-                reverse=True
-            )[:20],
+            'edge_routes': dict(edge_index['edge_routes']),
+            'high_duplication_corridors': high_duplication_corridors,
             'route_duplication_index': route_duplication,
-            'avg_duplication_index': np.mean(list(route_duplication.values()))
+            'avg_duplication_index': np.mean(duplication_index) if len(duplication_index) else 0
         }
 
     # ==================== STOP SPACING ANALYSIS ====================
@@ -192,58 +567,46 @@ class TransitNetworkAnalyzer:
         Compute inter-stop distances and identify spacing issues
         """
         route_spacings = {}
-        all_spacings = []
-
-        for bus in self.buses:
-            bus_number = bus['number']
-            spacings = []
+        sequence_edges = self.get_edge_index()['sequence_edges']
+        edge_lengths = self.get_edge_lengths()['length_km']
 
-            for direction in [1, 2]:
-                stops_in_direction = sorted(
-                    [s for s in bus['stops'] if s['directionTypeId'] == direction],
-                    key=lambda x: x['id']
-                )
-
-                for i in range(len(stops_in_direction) - 1):
-                    stop1 = stops_in_direction[i]['stop']
-                    stop2 = stops_in_direction[i + 1]['stop']
-
-                    distance = self.haversine_distance(
-                        self._clean_coordinate(stop1['latitude']),
-                        self._clean_coordinate(stop1['longitude']),
-                        self._clean_coordinate(stop2['latitude']),
-                        self._clean_coordinate(stop2['longitude'])
-                    )
+        # Segment distances come straight from the shared edge-length table
+        bus_spacings = [
+            edge_lengths[np.concatenate(sequence_edges[2 * bus_idx:2 * bus_idx + 2])]
+            for bus_idx in range(len(self.buses))
+        ]
+        all_spacings = np.concatenate(bus_spacings) if bus_spacings else np.empty(0)
 
-                    spacings.append(distance)
-                    all_spacings.append(distance)
+        for bus, spacings in zip(self.buses, bus_spacings):
+            bus_number = bus['number']
 
-            if spacings:
+            if len(spacings):
                 route_spacings[bus_number] = {
                     'mean_spacing': np.mean(spacings),
                     'min_spacing': np.min(spacings),
                     'max_spacing': np.max(spacings),
                     'std_spacing': np.std(spacings),
-                    'spacings': spacings
+                    'spacings': spacings.tolist()
                 }
 
         # Identify overly dense stops (< 200m)
         dense_threshold = 0.2  # km
-        overly_dense_count = sum(1 for s in all_spacings if s < dense_threshold)
+        overly_dense_count = int(np.count_nonzero(all_spacings < dense_threshold))
 
         # Identify sparse stops (> 2km)
         sparse_threshold = 2.0  # km
-        overly_sparse_count = sum(1 for s in all_spacings if s > sparse_threshold)
+        overly_sparse_count = int(np.count_nonzero(all_spacings > sparse_threshold))
 
+        has_spacings = len(all_spacings) > 0
         return {
             'route_spacings': route_spacings,
-            'network_mean_spacing': np.mean(all_spacings) if all_spacings else 0,
-            'network_median_spacing': np.median(all_spacings) if all_spacings else 0,
+            'network_mean_spacing': np.mean(all_spacings) if has_spacings else 0,
+            'network_median_spacing': np.median(all_spacings) if has_spacings else 0,
             'overly_dense_segments': overly_dense_count,
             'overly_sparse_segments': overly_sparse_count,
-            'dense_percentage': (overly_dense_count / len(all_spacings) * 100) if all_spacings else 0,
+            'dense_percentage': (overly_dense_count / len(all_spacings) * 100) if has_spacings else 0,
             'optimal_spacing_range': (0.3, 0.8),  # Industry standard: 300-800m
-            'spacing_distribution': all_spacings
+            'spacing_distribution': all_spacings.tolist()
         }
 
     # ==================== RESOURCE WASTE INDICATORS ====================
@@ -256,27 +619,12 @@ class TransitNetworkAnalyzer:
         total_vehicle_km = sum(bus.get('routLength', 0) for bus in self.buses)
 
         # Compute wasted vehicle-km due to overlap
-        edge_routes = overlap_analysis['edge_routes']
-
-        # Estimate km per edge (simplified)
-        wasted_km = 0
-        for edge, routes in edge_routes.items():
-            if len(routes) > 1:
-                # Get edge distance
-                stop1_id, stop2_id = edge
-                if stop1_id in self.stop_index and stop2_id in self.stop_index:
-                    stop1 = self.stop_index[stop1_id]
-                    stop2 = self.stop_index[stop2_id]
-
-                    distance = self.haversine_distance(
-                        self._clean_coordinate(stop1['latitude']),
-                        self._clean_coordinate(stop1['longitude']),
-                        self._clean_coordinate(stop2['latitude']),
-                        self._clean_coordinate(stop2['longitude'])
-                    )
-
-                    # Wasted km = (n_routes - 1) * distance
-                    wasted_km += (len(routes) - 1) * distance
+        edge_lengths = self.get_edge_lengths()
+        edge_counts = self.get_edge_route_counts()
+
+        # Wasted km = (n_routes - 1) * distance, over edges with both stops in stops.json
+        excess_routes = np.where(edge_lengths['indexed'], np.maximum(edge_counts - 1, 0), 0)
+        wasted_km = float(excess_routes @ edge_lengths['length_km']) if len(edge_counts) else 0.0
 
         # Route efficiency: stops per km
         route_efficiency = []
@@ -347,34 +695,104 @@ class TransitNetworkAnalyzer:
 
     # ==================== COMPREHENSIVE ANALYSIS ====================
 
-    def run_full_analysis(self) -> Dict:
+    def warm_caches(self, centrality: bool = False, workers: Optional[int] = None):
+        """
+        Build the shared indexes every stage reads, so worker processes inherit them
+        With centrality, also compute it here on `workers` processes: it is by far the
+        slowest part of topology and would otherwise run on a single stage worker.
+        """
+        self.get_edge_index()
+        self.get_route_edge_incidence()
+        self.get_transit_graph()
+        self.get_edge_lengths()
+        if centrality:
+            self.get_centrality(workers=workers)
+
+    def run_stage(self, stage: str, workers: Optional[int] = None, centrality: bool = False) -> Dict:
+        """Run one independent analysis stage by name"""
+        if stage == 'topology':
+            return self.build_stop_graph(centrality=centrality, workers=workers)
+        if stage == 'overlap':
+            return self.analyze_route_overlap()
+        if stage == 'spacing':
+            return self.analyze_stop_spacing()
+        raise ValueError(f"Unknown analysis stage: {stage}")
+
+    def run_full_analysis(self, parallel: bool = False, workers: Optional[int] = None,
+                          stage_results: Optional[Dict] = None, profiler: Optional[StageProfiler] = None,
+                          centrality: bool = False) -> Dict:
         """
         Execute comprehensive network analysis
+
+        parallel: run topology, overlap and spacing concurrently on a process
+        pool (see run_independent_stages); the results are the same.
+        centrality: rank hubs by betweenness and closeness as well, computed
+        first on all `workers` (before the pool in parallel mode) and recorded
+        as its own 'centrality' stage (see build_stop_graph)
+        stage_results: already computed independent stages, by stage name
+        profiler: StageProfiler recording each stage (see instrumentation.py);
+        in parallel mode the pooled stages are recorded together as 'independent_stages'
         """
+        def track(stage):
+            return profiler.stage(stage) if profiler is not None else contextlib.nullcontext({})
+
+        if profiler is not None:
+            profiler.counts.update(routes=len(self.buses), stops=len(self.stops),
+                                   sequences=len(self.get_route_sequences()))
+
+        if centrality and 'topology' not in (stage_results or {}):
+            with track('centrality') as counts:
+                counts.update(sources=self.get_centrality(workers=workers)['samples'])
+
+        if parallel and stage_results is None:
+            with track('independent_stages'):
+                stage_results = run_independent_stages({'network': self}, workers, centrality)['network']
+        stage_results = stage_results or {}
+
         print("\n=== Running Comprehensive Transit Network Analysis ===\n")
 
         print("1. Analyzing network topology...")
-        topology = self.build_stop_graph()
+        topology = stage_results.get('topology')
+        if topology is None:
+            with track('topology') as counts:
+                topology = self.build_stop_graph(centrality=centrality)
+                counts.update(stops=len(topology['degrees']), edges=len(self.get_edge_index()['edges']),
+                              hubs=len(topology['hubs']))
         print(f"   ✓ Network density: {topology['network_density']:.4f}")
         print(f"   ✓ Identified {len(topology['hubs'])} hub stops")
+        if 'centrality' in topology:
+            print(f"   ✓ Ranked hubs by betweenness ({topology['centrality']['mode']}, "
+                  f"{topology['centrality']['samples']} sources)")
 
         print("\n2. Analyzing route overlap...")
-        overlap = self.analyze_route_overlap()
+        overlap = stage_results.get('overlap')
+        if overlap is None:
+            with track('overlap') as counts:
+                overlap = self.analyze_route_overlap()
+                counts.update(edges=overlap['total_edges'], overlapping_edges=overlap['overlapping_edges'])
         print(f"   ✓ Overlap percentage: {overlap['overlap_percentage']:.2f}%")
         print(f"   ✓ High duplication corridors: {len(overlap['high_duplication_corridors'])}")
 
         print("\n3. Analyzing stop spacing...")
-        spacing = self.analyze_stop_spacing()
+        spacing = stage_results.get('spacing')
+        if spacing is None:
+            with track('spacing') as counts:
+                spacing = self.analyze_stop_spacing()
+                counts.update(routes=len(spacing['route_spacings']), segments=len(spacing['spacing_distribution']))
         print(f"   ✓ Mean stop spacing: {spacing['network_mean_spacing']:.3f} km")
         print(f"   ✓ Overly dense segments: {spacing['overly_dense_segments']}")
 
         print("\n4. Computing resource waste metrics...")
-        waste = self.compute_resource_waste_metrics(overlap)
+        with track('waste') as counts:
+            waste = self.compute_resource_waste_metrics(overlap)
+            counts.update(routes=len(waste['route_efficiency']))
         print(f"   ✓ Total vehicle-km: {waste['total_vehicle_km']:.2f}")
         print(f"   ✓ Wasted vehicle-km: {waste['wasted_vehicle_km']:.2f} ({waste['waste_percentage']:.2f}%)")
 
         print("\n5. Estimating ecological impact...")
-        ecology = self.estimate_ecological_impact(waste, overlap)
+        with track('ecology') as counts:
+            ecology = self.estimate_ecological_impact(waste, overlap)
+            counts.update(high_inefficiency_routes=len(ecology['high_inefficiency_routes']))
         print(f"   ✓ CO2 reduction potential: {ecology['co2_reduction_potential_percent']:.2f}%")
         print(f"   ✓ Potential annual CO2 savings: {ecology['wasted_annual_co2_tons']:.2f} tons")
 
@@ -393,7 +811,8 @@ class TransitNetworkAnalyzer:
             }
         }
 
-    def _compute_efficiency_score(self, topology: Dict, overlap: Dict, spacing: Dict, waste: Dict) -> float:
+    @staticmethod
+    def _compute_efficiency_score(topology: Dict, overlap: Dict, spacing: Dict, waste: Dict) -> float:
         """
         Compute overall network efficiency score (0-100)
         Higher is better
@@ -418,38 +837,129 @@ class TransitNetworkAnalyzer:
         return max(0, min(100, efficiency_score))
 
 
-if __name__ == "__main__":
-    analyzer = TransitNetworkAnalyzer(
-        'data/busDetails.json',
-        'data/stops.json'
-    )
-
-    results = analyzer.run_full_analysis()
-
-    # Save results
-    with open('data/analysis_results.json', 'w', encoding='utf-8') as f:
-        # Convert sets to lists for JSON serialization
-        import copy
-
-        def convert_for_json(obj):
-            """Recursively convert objects for JSON serialization"""
-            if isinstance(obj, set):
-                return list(obj)
-            elif isinstance(obj, tuple):
-                return list(obj)
-            elif isinstance(obj, dict):
-                # Convert tuple keys to strings
-                return {
-                    str(key) if isinstance(key, tuple) else key: convert_for_json(value)
-                    for key, value in obj.items()
-                }
-            elif isinstance(obj, list):
-                return [convert_for_json(item) for item in obj]
-            else:
-                return obj
+# ==================== PARALLEL STAGE SCHEDULER ====================
+
+# Analyzers shared with stage worker processes (set by _init_stage_worker)
+_stage_analyzers = {}
 
-        results_copy = convert_for_json(results)
-        json.dump(results_copy, f, indent=2, ensure_ascii=False)
 
-    print(f"Analysis results saved to data/analysis_results.json")
+def _init_stage_worker(analyzers: Dict[str, TransitNetworkAnalyzer]):
+    global _stage_analyzers
+    _stage_analyzers = analyzers
+
+
+def _run_stage(key: str, stage: str, centrality: bool) -> Dict:
+    # Centrality was computed before the fork (warm_caches); workers=1 keeps pools from nesting
+    return _stage_analyzers[key].run_stage(stage, workers=1, centrality=centrality)
+
+
+def run_independent_stages(analyzers: Dict[str, TransitNetworkAnalyzer],
+                           workers: Optional[int] = None, centrality: bool = False) -> Dict[str, Dict]:
+    """
+    Run the independent stages of one or more networks on a process pool
+
+    Shared indexes, and centrality when requested, are built once in the
+    parent first; centrality spreads its source passes over all `workers`.
+    With the fork start method workers inherit the warmed analyzers as a
+    copy-on-write snapshot instead of receiving a pickled copy.
+    Returns {key: {stage: result}}.
+    """
+    for analyzer in analyzers.values():
+        analyzer.warm_caches(centrality, workers)
+
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context('fork' if 'fork' in methods else None)
+    n_tasks = len(analyzers) * len(INDEPENDENT_STAGES)
+
+    with ProcessPoolExecutor(max_workers=min(workers or multiprocessing.cpu_count(), n_tasks),
+                             mp_context=context, initializer=_init_stage_worker,
+                             initargs=(analyzers,)) as pool:
+        futures = {
+            (key, stage): pool.submit(_run_stage, key, stage, centrality)
+            for key in analyzers for stage in INDEPENDENT_STAGES
+        }
+        results = {key: {} for key in analyzers}
+        for (key, stage), future in futures.items():
+            results[key][stage] = future.result()
+
+    return results
+
+
+def run_regions(analyzers: Dict[str, TransitNetworkAnalyzer], workers: Optional[int] = None,
+                centrality: bool = False) -> Dict[str, Dict]:
+    """
+    Full analysis of several networks (e.g. regions) sharing one process pool
+    Returns {key: run_full_analysis() results}
+    """
+    stage_results = run_independent_stages(analyzers, workers, centrality)
+    return {key: analyzer.run_full_analysis(stage_results=stage_results[key])
+            for key, analyzer in analyzers.items()}
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run the transit network analysis")
+    parser.add_argument('--bus-details', default='data/busDetails.json',
+                        help="Bus details file (.json or .ndjson)")
+    parser.add_argument('--stops', default='data/stops.json', help="Stops file")
+    parser.add_argument('--store', default=None,
+                        help="Load from a columnar network store directory instead of JSON "
+                             "(rebuilt first if its source files changed)")
+    parser.add_argument('--parallel', action='store_true',
+                        help="Run independent analysis stages on a process pool")
+    parser.add_argument('--workers', type=int, default=None, help="Worker processes (default: all CPUs)")
+    parser.add_argument('--centrality', action='store_true',
+                        help="Also rank hubs by betweenness/closeness centrality (slow on large networks)")
+    parser.add_argument('--output', default=DEFAULT_RESULTS_DIR, help="Results directory")
+    parser.add_argument('--legacy-json', nargs='?', const='', default=None, metavar='PATH',
+                        help="Also write a single-file legacy JSON (default: <output>.json, "
+                             f"i.e. {LEGACY_RESULTS_PATH} for the default --output)")
+    parser.add_argument('--tracemalloc', action='store_true',
+                        help="Trace Python allocations per stage (slows pure-Python stages)")
+    parser.add_argument('--cprofile', action='store_true',
+                        help="Profile each stage with cProfile (stats in <output>/profiles/)")
+    parser.add_argument('--baseline-metrics', default=None,
+                        help=f"Metrics to compare stage times against (default: the previous <output>/{METRICS_FILENAME})")
+    args = parser.parse_args()
+
+    metrics_path = os.path.join(args.output, METRICS_FILENAME)
+    baseline_path = args.baseline_metrics or metrics_path
+    baseline = None
+    if os.path.exists(baseline_path):
+        with open(baseline_path, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+
+    profiler = StageProfiler(trace_memory=args.tracemalloc, cprofile=args.cprofile,
+                             profile_dir=os.path.join(args.output, 'profiles'), hooks=[print_stage])
+
+    with profiler.stage('load') as counts:
+        if args.store:
+            analyzer = TransitNetworkAnalyzer.from_store(args.store, rebuild_stale=True)
+        else:
+            analyzer = TransitNetworkAnalyzer(args.bus_details, args.stops)
+        counts.update(routes=len(analyzer.buses), stops=len(analyzer.stops))
+
+    results = analyzer.run_full_analysis(parallel=args.parallel, workers=args.workers, profiler=profiler,
+                                         centrality=args.centrality)
+
+    # Save results as split artifacts (see results_io.py)
+    with profiler.stage('save'):
+        save_results(results, args.output)
+    print(f"Analysis results saved to {args.output}/")
+    if args.legacy_json is not None:
+        legacy_path = args.legacy_json or f"{os.path.normpath(args.output)}.json"
+        write_legacy_json(results, legacy_path)
+        print(f"Legacy single-file results saved to {legacy_path}")
+
+    # Stage metrics next to the results, with regressions against the previous run
+    # (only comparable when both runs used the same instrumentation and stages)
+    comparable = baseline and baseline.get('instrumentation') == profiler.metrics()['instrumentation'] \
+        and baseline.get('centrality') == args.centrality
+    regressions = find_regressions(profiler.stages, baseline['stages']) if comparable else []
+    profiler.write(metrics_path, {'source': args.store or args.bus_details, 'parallel': args.parallel,
+                                  'centrality': args.centrality, 'regressions': regressions})
+    print(f"Stage metrics saved to {metrics_path} ({profiler.metrics()['total_wall_s']:.2f}s total)")
+    for r in regressions:
+        print(f"✗ Slower than baseline: {r['stage']} {r['wall_s']:.3f}s vs {r['baseline_s']:.3f}s ({r['ratio']:.2f}x)")
     print(f"Network Efficiency Score: {results['summary']['network_efficiency_score']:.2f}/100")
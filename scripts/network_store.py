@@ -0,0 +1,199 @@
+"""
+Columnar Network Store for Transit Network Analysis
+Converts bus details and stops into memory-mappable NumPy arrays
+"""
+
+import json
+import os
+import argparse
+from typing import Dict
+import numpy as np
+
+from network_analysis import iter_bus_details
+
+
+STORE_FORMAT_VERSION = 1
+DIRECTIONS = (1, 2)
+
+# Arrays written to the store directory as <name>.npy
+STORE_ARRAYS = (
+    # Stop table (stops.json plus any stop only referenced by a route)
+    'stop_ids',            # int64, sorted
+    'stop_lat',            # float64
+    'stop_lon',            # float64
+    'stop_in_index',       # bool, stop is present in stops.json
+    'stop_is_hub',         # bool, isTransportHub
+    # Interned route numbers and per-bus attributes
+    'route_numbers',       # unicode, unique route numbers
+    'bus_ids',             # int64
+    'bus_route',           # int32, index into route_numbers
+    'bus_length',          # float64, routLength (km)
+    'bus_duration',        # float64, durationMinuts (NaN if missing)
+    # Stop sequences, one slice per (bus, direction): bus i direction d is
+    # seq_offsets[2*i + d - 1] : seq_offsets[2*i + d]
+    'seq_offsets',         # int64, len = 2 * n_buses + 1
+    'seq_stops',           # int32, index into the stop table
+    'seq_lat',             # float64, coordinates embedded in the route's stop object
+    'seq_lon',             # float64
+    'seq_intermediate_distance',  # float64
+    'seq_total_distance',         # float64
+)
+
+
+def _clean_coordinate(coord) -> float:
+    """Same cleaning as TransitNetworkAnalyzer._clean_coordinate"""
+    if isinstance(coord, (int, float)):
+        return float(coord)
+    return float(str(coord).replace(',', ''))
+
+
+def _source_info(path: str) -> Dict:
+    stat = os.stat(path)
+    return {'path': os.path.abspath(path), 'size': stat.st_size, 'mtime': stat.st_mtime}
+
+
+def build_network_store(bus_details_path: str, stops_path: str,
+                        store_dir: str = 'data/network_store') -> Dict:
+    """
+    Convert bus details (JSON or NDJSON) and stops.json into a columnar store
+
+    Bus details are streamed route by route, so the raw document is never
+    held in memory as a whole. Returns the store metadata.
+    """
+    with open(stops_path, 'r', encoding='utf-8') as f:
+        stops = json.load(f)
+
+    stop_coords = {
+        stop['id']: (_clean_coordinate(stop['latitude']), _clean_coordinate(stop['longitude']),
+                     bool(stop.get('isTransportHub', False)))
+        for stop in stops
+    }
+    indexed_stop_ids = set(stop_coords)
+    del stops
+
+    route_number_index = {}
+    bus_ids, bus_route, bus_length, bus_duration = [], [], [], []
+    seq_lengths = []
+    seq_stop_ids, seq_lat, seq_lon, seq_inter, seq_total = [], [], [], [], []
+
+    for bus in iter_bus_details(bus_details_path):
+        number = bus['number']
+        if number not in route_number_index:
+            route_number_index[number] = len(route_number_index)
+
+        bus_ids.append(bus['id'])
+        bus_route.append(route_number_index[number])
+        bus_length.append(bus.get('routLength') or 0)
+        duration = bus.get('durationMinuts')
+        bus_duration.append(duration if duration is not None else np.nan)
+
+        for direction in DIRECTIONS:
+            stops_in_direction = sorted(
+                [s for s in bus['stops'] if s['directionTypeId'] == direction],
+                key=lambda x: x['id']
+            )
+            seq_lengths.append(len(stops_in_direction))
+
+            for entry in stops_in_direction:
+                stop = entry['stop']
+                lat = _clean_coordinate(stop['latitude'])
+                lon = _clean_coordinate(stop['longitude'])
+
+                seq_stop_ids.append(entry['stopId'])
+                seq_lat.append(lat)
+                seq_lon.append(lon)
+                seq_inter.append(entry.get('intermediateDistance') or 0)
+                seq_total.append(entry.get('totalDistance') or 0)
+
+                # Stops missing from stops.json take the route's embedded coordinates
+                stop_coords.setdefault(entry['stopId'], (lat, lon, bool(stop.get('isTransportHub', False))))
+
+    stop_ids = np.array(sorted(stop_coords), dtype=np.int64)
+    arrays = {
+        'stop_ids': stop_ids,
+        'stop_lat': np.array([stop_coords[s][0] for s in stop_ids.tolist()], dtype=np.float64),
+        'stop_lon': np.array([stop_coords[s][1] for s in stop_ids.tolist()], dtype=np.float64),
+        'stop_in_index': np.isin(stop_ids, np.array(sorted(indexed_stop_ids), dtype=np.int64)),
+        'stop_is_hub': np.array([stop_coords[s][2] for s in stop_ids.tolist()], dtype=bool),
+        'route_numbers': np.array(list(route_number_index), dtype=str),
+        'bus_ids': np.array(bus_ids, dtype=np.int64),
+        'bus_route': np.array(bus_route, dtype=np.int32),
+        'bus_length': np.array(bus_length, dtype=np.float64),
+        'bus_duration': np.array(bus_duration, dtype=np.float64),
+        'seq_offsets': np.concatenate([[0], np.cumsum(seq_lengths, dtype=np.int64)]).astype(np.int64),
+        'seq_stops': np.searchsorted(stop_ids, np.array(seq_stop_ids, dtype=np.int64)).astype(np.int32),
+        'seq_lat': np.array(seq_lat, dtype=np.float64),
+        'seq_lon': np.array(seq_lon, dtype=np.float64),
+        'seq_intermediate_distance': np.array(seq_inter, dtype=np.float64),
+        'seq_total_distance': np.array(seq_total, dtype=np.float64),
+    }
+
+    os.makedirs(store_dir, exist_ok=True)
+    for name in STORE_ARRAYS:
+        np.save(os.path.join(store_dir, f'{name}.npy'), arrays[name])
+
+    meta = {
+        'format_version': STORE_FORMAT_VERSION,
+        'n_stops': int(len(stop_ids)),
+        'n_indexed_stops': len(indexed_stop_ids),
+        'n_buses': len(bus_ids),
+        'n_routes': len(route_number_index),
+        'n_sequence_entries': len(seq_stop_ids),
+        'sources': {
+            'bus_details': _source_info(bus_details_path),
+            'stops': _source_info(stops_path),
+        }
+    }
+    with open(os.path.join(store_dir, 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, indent=2)
+
+    print(f"Network store written to {store_dir}/ "
+          f"({meta['n_buses']} buses, {meta['n_stops']} stops, {meta['n_sequence_entries']} sequence entries)")
+    return meta
+
+
+class NetworkStore:
+    """
+    Read-only, memory-mapped view of a columnar network store
+    """
+
+    def __init__(self, store_dir: str = 'data/network_store'):
+        """Open store arrays memory-mapped (nothing is read until accessed)"""
+        with open(os.path.join(store_dir, 'meta.json'), 'r', encoding='utf-8') as f:
+            self.meta = json.load(f)
+
+        if self.meta['format_version'] != STORE_FORMAT_VERSION:
+            raise ValueError(
+                f"Unsupported network store version {self.meta['format_version']} in {store_dir} "
+                f"(expected {STORE_FORMAT_VERSION}); rebuild it with scripts/network_store.py"
+            )
+
+        self.store_dir = store_dir
+        for name in STORE_ARRAYS:
+            setattr(self, name, np.load(os.path.join(store_dir, f'{name}.npy'), mmap_mode='r'))
+
+    @property
+    def n_buses(self) -> int:
+        return self.meta['n_buses']
+
+    def is_current(self, bus_details_path: str, stops_path: str) -> bool:
+        """Whether the store was built from the current versions of the source files"""
+        for key, path in (('bus_details', bus_details_path), ('stops', stops_path)):
+            source = self.meta['sources'][key]
+            if not os.path.exists(path):
+                return False
+            current = _source_info(path)
+            if current['size'] != source['size'] or current['mtime'] != source['mtime']:
+                return False
+        return True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the columnar network store")
+    parser.add_argument('--bus-details', default='data/busDetails.json',
+                        help="Bus details file (.json or .ndjson)")
+    parser.add_argument('--stops', default='data/stops.json', help="Stops file")
+    parser.add_argument('--output', default='data/network_store', help="Store directory")
+    args = parser.parse_args()
+
+    build_network_store(args.bus_details, args.stops, args.output)
@@ -0,0 +1,124 @@
+"""
+Compact Route Geometry Encoding for Bus Details
+Google encoded polylines for routes[].flowCoordinates, with exact decoding on demand
+"""
+
+import argparse
+from typing import Dict
+import numpy as np
+
+
+# Decimal places kept; the API returns coordinates with at most 6 decimals
+DEFAULT_PRECISION = 6
+
+
+def encode_polyline(coords, precision: int = DEFAULT_PRECISION) -> str:
+    """Encode an (n, 2) lat/lon array as a Google encoded polyline string"""
+    coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+    if not len(coords):
+        return ''
+
+    fixed = np.round(coords * 10 ** precision).astype(np.int64)
+    deltas = np.diff(fixed, axis=0, prepend=np.zeros((1, 2), dtype=np.int64)).ravel()
+    values = (deltas << 1) ^ (deltas >> 63)  # zigzag: sign moved to the lowest bit
+
+    # Five bits per character, low bits first; all but the last chunk of a value carry 0x20
+    counts = np.ones(len(values), dtype=np.int64)
+    rest = values >> 5
+    while rest.any():
+        counts += rest > 0
+        rest >>= 5
+    owner = np.repeat(np.arange(len(values)), counts)
+    position = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    chunks = (values[owner] >> (5 * position)) & 0x1f
+    chunks |= np.where(position < counts[owner] - 1, 0x20, 0)
+
+    return (chunks + 63).astype(np.uint8).tobytes().decode('ascii')
+
+
+def decode_polyline(encoded: str, precision: int = DEFAULT_PRECISION) -> np.ndarray:
+    """Decode a Google encoded polyline string to an (n, 2) lat/lon array"""
+    data = np.frombuffer(encoded.encode('ascii'), dtype=np.uint8).astype(np.int64) - 63
+    if not len(data):
+        return np.empty((0, 2))
+
+    ends = (data & 0x20) == 0
+    if not ends[-1] or ends.sum() % 2:
+        raise ValueError("Truncated encoded polyline")
+
+    starts = np.flatnonzero(np.r_[True, ends[:-1]])
+    owner = np.cumsum(np.r_[0, ends[:-1]])
+    position = np.arange(len(data)) - starts[owner]
+    values = np.add.reduceat((data & 0x1f) << (5 * position), starts)
+    deltas = (values >> 1) ^ -(values & 1)
+
+    return np.cumsum(deltas.reshape(-1, 2), axis=0) / 10 ** precision
+
+
+def _points_array(points) -> np.ndarray:
+    return np.array([(float(p['lat']), float(p['lng'])) for p in points], dtype=np.float64).reshape(-1, 2)
+
+
+def route_coordinates(route: Dict) -> np.ndarray:
+    """
+    (n, 2) lat/lon array of one routes[] entry, decoded on demand
+    Reads the encoded `flowPolyline` when present and raw `flowCoordinates` otherwise
+    """
+    if 'flowPolyline' in route:
+        return decode_polyline(route['flowPolyline'], route.get('flowPolylinePrecision', DEFAULT_PRECISION))
+    return _points_array(route.get('flowCoordinates') or [])
+
+
+def encode_route_geometry(details: Dict, precision: int = DEFAULT_PRECISION) -> Dict:
+    """
+    Replace each route's flowCoordinates with an encoded flowPolyline, in place
+    Routes whose coordinates do not survive the roundtrip exactly keep their raw coordinates.
+    """
+    for route in details.get('routes') or []:
+        points = route.get('flowCoordinates')
+        if not points:
+            continue
+        try:
+            coords = _points_array(points)
+        except (KeyError, TypeError, ValueError):
+            continue
+
+        encoded = encode_polyline(coords, precision)
+        if np.array_equal(decode_polyline(encoded, precision), coords):
+            del route['flowCoordinates']
+            route['flowPolyline'] = encoded
+            route['flowPolylinePrecision'] = precision
+
+    return details
+
+
+def decode_route_geometry(details: Dict) -> Dict:
+    """Restore raw flowCoordinates ({lat, lng} objects) from encoded routes, in place"""
+    for route in details.get('routes') or []:
+        if 'flowPolyline' in route:
+            coords = route_coordinates(route)
+            del route['flowPolyline']
+            route.pop('flowPolylinePrecision', None)
+            route['flowCoordinates'] = [{'lat': lat, 'lng': lng} for lat, lng in coords.tolist()]
+
+    return details
+
+
+if __name__ == "__main__":
+    import os
+    from busDetails import save_bus_details
+    from network_analysis import iter_bus_details
+
+    parser = argparse.ArgumentParser(description="Encode or decode route geometry in a bus details file")
+    parser.add_argument('--input', default='data/busDetails.json', help="Bus details file (.json or .ndjson)")
+    parser.add_argument('--output', required=True, help="Converted file (.json or .ndjson)")
+    parser.add_argument('--precision', type=int, default=DEFAULT_PRECISION)
+    parser.add_argument('--decode', action='store_true', help="Restore raw flowCoordinates instead")
+    args = parser.parse_args()
+
+    convert = decode_route_geometry if args.decode else \
+        (lambda details: encode_route_geometry(details, args.precision))
+    save_bus_details((convert(details) for details in iter_bus_details(args.input, drop_fields=())), args.output)
+
+    before, after = os.path.getsize(args.input), os.path.getsize(args.output)
+    print(f"{args.input}: {before / 1e6:.1f} MB -> {args.output}: {after / 1e6:.1f} MB")
@@ -0,0 +1,353 @@
+"""
+Analysis Results Storage for Transit Network Analysis
+Writes results as a small summary JSON plus per-section JSON and columnar NumPy artifacts
+"""
+
+import json
+import os
+import hashlib
+import argparse
+from collections.abc import Mapping
+from typing import Dict
+import numpy as np
+
+
+RESULTS_FORMAT_VERSION = 1
+DEFAULT_RESULTS_DIR = 'data/analysis_results'
+LEGACY_RESULTS_PATH = 'data/analysis_results.json'
+
+# Bulky result fields stored as NumPy arrays, and how each is laid out:
+#   mapping         {key: number}              -> keys, values
+#   sets            {key: [items]}             -> keys, offsets, items
+#   edge_sets       {(a, b): [items]}          -> edges (n, 2), offsets, items
+#   array           [numbers]                  -> values
+#   route_spacings  {route: {stats, spacings}} -> routes, stat columns, offsets, spacings
+ARRAY_FIELDS = {
+    'topology': {'adjacency': 'sets', 'degrees': 'mapping', 'stop_routes': 'sets', 'edge_routes': 'edge_sets'},
+    'overlap': {'edge_routes': 'edge_sets', 'route_duplication_index': 'mapping'},
+    'spacing': {'route_spacings': 'route_spacings', 'spacing_distribution': 'array'}
+}
+
+ROUTE_SPACING_STATS = ('mean_spacing', 'min_spacing', 'max_spacing', 'std_spacing')
+
+
+def _ordered(items):
+    """Sets in sorted order, so identical results give identical artifacts regardless of hash seed"""
+    if isinstance(items, (set, frozenset)):
+        try:
+            return sorted(items)
+        except TypeError:
+            return list(items)
+    return items
+
+
+def _json_default(obj):
+    """JSON fallback for sets and NumPy values, so results are written without a converted copy"""
+    if isinstance(obj, (set, frozenset)):
+        return _ordered(obj)
+    if isinstance(obj, np.integer):
+        return int(obj)
+    if isinstance(obj, np.floating):
+        return float(obj)
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def _write_atomic(path: str, write, binary: bool = False):
+    """Write a file through a temporary path and move it into place"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') if binary else open(tmp_path, 'w', encoding='utf-8') as f:
+        write(f)
+    os.replace(tmp_path, path)
+
+
+def _write_json(path: str, data, **dump_kwargs):
+    _write_atomic(path, lambda f: json.dump(data, f, ensure_ascii=False, default=_json_default, **dump_kwargs))
+
+
+def _edge_key(key) -> tuple:
+    """(a, b) edge from a tuple key or its "(a, b)" string form in legacy JSON"""
+    if isinstance(key, str):
+        return tuple(int(part) for part in key.strip('()').split(','))
+    return key
+
+
+# ==================== COLUMNAR FIELDS ====================
+
+def _flatten(lists) -> tuple:
+    lengths = np.fromiter((len(items) for items in lists), dtype=np.int64, count=len(lists))
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+    items = [item for items in lists for item in _ordered(items)]
+    return offsets, np.asarray(items) if items else np.empty(0, dtype=np.int64)
+
+
+def _encode_field(kind: str, value) -> Dict[str, np.ndarray]:
+    if kind == 'array':
+        return {'values': np.asarray(value, dtype=np.float64)}
+    if kind == 'mapping':
+        return {'keys': np.asarray(list(value.keys())), 'values': np.asarray(list(value.values()))}
+    if kind == 'sets':
+        offsets, items = _flatten(list(value.values()))
+        return {'keys': np.asarray(list(value.keys())), 'offsets': offsets, 'items': items}
+    if kind == 'edge_sets':
+        offsets, items = _flatten(list(value.values()))
+        edges = np.array([_edge_key(key) for key in value.keys()], dtype=np.int64).reshape(-1, 2)
+        return {'edges': edges, 'offsets': offsets, 'items': items}
+    if kind == 'route_spacings':
+        stats = list(value.values())
+        offsets, spacings = _flatten([s['spacings'] for s in stats])
+        arrays = {'routes': np.asarray(list(value.keys())), 'offsets': offsets,
+                  'spacings': spacings.astype(np.float64)}
+        for stat in ROUTE_SPACING_STATS:
+            arrays[stat] = np.array([s[stat] for s in stats], dtype=np.float64)
+        return arrays
+    raise ValueError(f"Unknown array field kind: {kind}")
+
+
+def _decode_field(kind: str, arrays) -> object:
+    """Rebuild a result field from its arrays (arrays: mapping of part name to array)"""
+    if kind == 'array':
+        return arrays['values'].tolist()
+    if kind == 'mapping':
+        return dict(zip(arrays['keys'].tolist(), arrays['values'].tolist()))
+
+    offsets = arrays['offsets'].tolist()
+    if kind == 'route_spacings':
+        spacings = arrays['spacings'].tolist()
+        stats = [arrays[stat].tolist() for stat in ROUTE_SPACING_STATS]
+        return {
+            route: {**{stat: column[i] for stat, column in zip(ROUTE_SPACING_STATS, stats)},
+                    'spacings': spacings[offsets[i]:offsets[i + 1]]}
+            for i, route in enumerate(arrays['routes'].tolist())
+        }
+
+    items = arrays['items'].tolist()
+    keys = arrays['keys'].tolist() if kind == 'sets' else [tuple(edge) for edge in arrays['edges'].tolist()]
+    return {key: items[offsets[i]:offsets[i + 1]] for i, key in enumerate(keys)}
+
+
+def _field_arrays(npz, field: str) -> Dict[str, np.ndarray]:
+    prefix = f"{field}."
+    return {name[len(prefix):]: npz[name] for name in npz.files if name.startswith(prefix)}
+
+
+# ==================== SAVE / LOAD ====================
+
+def save_results(results: Dict, out_dir: str = DEFAULT_RESULTS_DIR) -> Dict:
+    """
+    Write analysis results as split artifacts
+
+    Each section goes to `<section>.json` without its bulky fields, which
+    are stored column-wise in `<section>.npz` (see ARRAY_FIELDS). JSON is
+    streamed from the live result objects and arrays are built one field
+    at a time, so no converted copy of the whole result is made.
+    `summary.json` (the summary section plus a manifest of the other
+    files) is written last. Returns the manifest.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    manifest = {'format_version': RESULTS_FORMAT_VERSION, 'sections': {}}
+
+    for section, value in results.items():
+        if section == 'summary':
+            continue
+        entry = {'json': f"{section}.json"}
+        array_fields = {field: kind for field, kind in ARRAY_FIELDS.get(section, {}).items()
+                        if isinstance(value, dict) and field in value}
+
+        if array_fields:
+            arrays = {}
+            for field, kind in array_fields.items():
+                for part, array in _encode_field(kind, value[field]).items():
+                    arrays[f"{field}.{part}"] = array
+            _write_atomic(os.path.join(out_dir, f"{section}.npz"), lambda f: np.savez(f, **arrays), binary=True)
+            del arrays
+            entry['arrays'] = f"{section}.npz"
+            entry['array_fields'] = array_fields
+            # Shallow view without the bulky fields; values are the live objects
+            value = {key: item for key, item in value.items() if key not in array_fields}
+
+        _write_json(os.path.join(out_dir, entry['json']), value, indent=2)
+        manifest['sections'][section] = entry
+
+    manifest['summary'] = results.get('summary', {})
+    _write_json(os.path.join(out_dir, 'summary.json'), manifest, indent=2)
+    return manifest
+
+
+def resolve_results_path(path: str = DEFAULT_RESULTS_DIR) -> str:
+    """
+    Results location to read from
+    The default artifact directory falls back to the legacy single JSON file when only that exists.
+    """
+    if path == DEFAULT_RESULTS_DIR and not os.path.exists(path) and os.path.exists(LEGACY_RESULTS_PATH):
+        return LEGACY_RESULTS_PATH
+    return path
+
+
+def load_results(path: str = DEFAULT_RESULTS_DIR) -> Dict:
+    """
+    Load analysis results from an artifact directory (or a legacy single JSON file)
+    Edge-keyed fields come back with (a, b) tuple keys; the legacy file has "(a, b)" strings.
+    """
+    path = resolve_results_path(path)
+    if not os.path.isdir(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    with open(os.path.join(path, 'summary.json'), 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+
+    results = {}
+    for section, entry in manifest['sections'].items():
+        with open(os.path.join(path, entry['json']), 'r', encoding='utf-8') as f:
+            results[section] = json.load(f)
+        if entry.get('arrays'):
+            with np.load(os.path.join(path, entry['arrays'])) as npz:
+                for field, kind in entry['array_fields'].items():
+                    results[section][field] = _decode_field(kind, _field_arrays(npz, field))
+
+    results['summary'] = manifest['summary']
+    return results
+
+
+# ==================== LAZY LOADING ====================
+
+class LazySection(Mapping):
+    """
+    One result section, read from disk on first use
+
+    The section JSON is parsed when a non-array field is first read, and
+    each bulky field is decoded from the section's .npz only when it is
+    itself read. Loaded values are cached.
+    """
+
+    def __init__(self, results_dir: str, entry: Dict):
+        self._dir = results_dir
+        self._entry = entry
+        self._array_fields = entry.get('array_fields', {})
+        self._json = None
+        self._decoded = {}
+
+    def _load_json(self) -> Dict:
+        if self._json is None:
+            with open(os.path.join(self._dir, self._entry['json']), 'r', encoding='utf-8') as f:
+                self._json = json.load(f)
+        return self._json
+
+    def arrays(self, field: str) -> Dict[str, np.ndarray]:
+        """Raw NumPy arrays of a bulky field (see ARRAY_FIELDS), without building Python objects"""
+        if field not in self._array_fields:
+            raise KeyError(field)
+        with np.load(os.path.join(self._dir, self._entry['arrays'])) as npz:
+            return _field_arrays(npz, field)
+
+    def __getitem__(self, key):
+        if key in self._array_fields:
+            if key not in self._decoded:
+                self._decoded[key] = _decode_field(self._array_fields[key], self.arrays(key))
+            return self._decoded[key]
+        return self._load_json()[key]
+
+    def __iter__(self):
+        yield from self._load_json()
+        yield from self._array_fields
+
+    def __len__(self):
+        return len(self._load_json()) + len(self._array_fields)
+
+
+class LazyResults(Mapping):
+    """
+    Analysis results opened from an artifact directory without reading the sections
+    Only summary.json is parsed up front; sections are LazySection mappings.
+    """
+
+    def __init__(self, results_dir: str = DEFAULT_RESULTS_DIR):
+        self.results_dir = results_dir
+        with open(os.path.join(results_dir, 'summary.json'), 'r', encoding='utf-8') as f:
+            self.manifest = json.load(f)
+        self._sections = {
+            section: LazySection(results_dir, entry) for section, entry in self.manifest['sections'].items()
+        }
+
+    def __getitem__(self, key):
+        if key == 'summary':
+            return self.manifest['summary']
+        return self._sections[key]
+
+    def __iter__(self):
+        yield from self._sections
+        yield 'summary'
+
+    def __len__(self):
+        return len(self._sections) + 1
+
+
+def open_results(path: str = DEFAULT_RESULTS_DIR) -> Mapping:
+    """
+    Results mapping that loads sections on demand
+    Artifact directories open lazily; a legacy single JSON file is read whole.
+    """
+    path = resolve_results_path(path)
+    if os.path.isdir(path):
+        return LazyResults(path)
+    return load_results(path)
+
+
+def section_fingerprint(results: Mapping, section: str) -> str:
+    """
+    Content hash of one result section, without decoding it
+    Artifact sections hash their JSON file and the array data in their .npz
+    (not the zip container, which records write times); other sections hash their JSON form.
+    """
+    digest = hashlib.sha256()
+    entry = results.manifest['sections'].get(section) if isinstance(results, LazyResults) else None
+
+    if entry is None:
+        digest.update(json.dumps(results[section], default=_json_default).encode('utf-8'))
+        return digest.hexdigest()
+
+    with open(os.path.join(results.results_dir, entry['json']), 'rb') as f:
+        digest.update(f.read())
+    if entry.get('arrays'):
+        with np.load(os.path.join(results.results_dir, entry['arrays'])) as npz:
+            for name in sorted(npz.files):
+                array = npz[name]
+                digest.update(f"{name}:{array.dtype.str}:{array.shape}".encode('utf-8'))
+                digest.update(np.ascontiguousarray(array).tobytes())
+    return digest.hexdigest()
+
+
+def write_legacy_json(results: Dict, path: str = LEGACY_RESULTS_PATH):
+    """
+    Write the single-file analysis_results.json of earlier versions
+    Streamed from the live results; only tuple-keyed mappings get a re-keyed shallow copy.
+    """
+    def rekeyed(section):
+        if not isinstance(section, dict):
+            return section
+        return {
+            key: ({str(k) if isinstance(k, tuple) else k: v for k, v in value.items()}
+                  if isinstance(value, dict) and any(isinstance(k, tuple) for k in value) else value)
+            for key, value in section.items()
+        }
+
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    _write_json(path, {section: rekeyed(value) for section, value in results.items()}, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert analysis results between storage layouts")
+    parser.add_argument('--input', default=LEGACY_RESULTS_PATH, help="Results directory or legacy JSON file")
+    parser.add_argument('--output', default=DEFAULT_RESULTS_DIR, help="Results directory to write")
+    parser.add_argument('--legacy-json', action='store_true',
+                        help="Write a single legacy JSON file to --output instead")
+    args = parser.parse_args()
+
+    results = load_results(args.input)
+    if args.legacy_json:
+        write_legacy_json(results, args.output)
+    else:
+        save_results(results, args.output)
+    print(f"Analysis results saved to {args.output}")
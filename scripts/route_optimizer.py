@@ -0,0 +1,494 @@
+"""
+Route Rationalization Optimizer for Transit Network Analysis
+Searches route removals, truncations and merges for a higher efficiency score
+"""
+
+import json
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional
+import numpy as np
+from scipy import sparse
+
+from network_analysis import TransitNetworkAnalyzer
+from route_similarity import RouteSimilarityEngine
+
+
+# Same threshold as TransitNetworkAnalyzer.analyze_stop_spacing
+DENSE_THRESHOLD_KM = 0.2
+
+# Candidate actions
+TRUNCATE_FRACTION = 0.25    # share of a route's stops cut from one end
+MERGE_MIN_JACCARD = 0.5     # route pairs at least this similar can be merged
+
+# Scenarios evaluated per sparse product
+BATCH_SIZE = 4096
+
+
+class RouteOptimizer:
+    """
+    Route rationalization search over removals, truncations and merges
+
+    Every action drops a set of route-edge and route-stop memberships:
+    removing a route drops all of them, truncating drops the memberships
+    of the cut-off end, and merging route b into a drops b's memberships
+    that a already covers. A scenario is a set of actions on disjoint
+    routes, so its new edge counts are the baseline counts minus a sparse
+    product, and whole batches of scenarios are scored at once. Scenarios
+    that leave a served stop without any route are infeasible.
+    """
+
+    def __init__(self, analyzer: TransitNetworkAnalyzer, truncate_fraction: float = TRUNCATE_FRACTION,
+                 merge_min_jaccard: float = MERGE_MIN_JACCARD):
+        edge_index = analyzer.get_edge_index()
+        incidence = analyzer.get_route_edge_incidence()
+        edge_lengths = analyzer.get_edge_lengths()
+
+        self.routes = incidence['routes']
+        self.matrix = incidence['matrix']
+        self.edge_counts = np.asarray(analyzer.get_edge_route_counts(), dtype=np.int64)
+        self.edge_length = edge_lengths['length_km']
+        self.edge_indexed = edge_lengths['indexed']
+        self.edge_waste_weight = np.where(self.edge_indexed, self.edge_length, 0.0)
+
+        # Route x stop coverage matrix
+        route_rows = {route: row for row, route in enumerate(self.routes)}
+        sequences = analyzer.get_route_sequences()
+        self.stop_ids = np.unique(np.concatenate(edge_index['sequence_stops'])) \
+            if sequences else np.empty(0, dtype=np.int64)
+        self.route_sequences = {route: [] for route in self.routes}
+        self.route_km = np.zeros(len(self.routes))
+        rows, cols = [], []
+        for k, (bus_number, _, _) in enumerate(sequences):
+            row = route_rows.get(bus_number)
+            if row is None:
+                continue
+            self.route_sequences[bus_number].append(k)
+            stops = np.searchsorted(self.stop_ids, edge_index['sequence_stops'][k])
+            rows.append(np.full(len(stops), row))
+            cols.append(stops)
+        for bus in analyzer.buses:
+            if bus['number'] in route_rows:
+                self.route_km[route_rows[bus['number']]] += bus.get('routLength', 0) or 0
+
+        coverage = sparse.csr_matrix(
+            (np.ones(sum(len(c) for c in cols), dtype=np.int32),
+             (np.concatenate(rows) if rows else [], np.concatenate(cols) if cols else [])),
+            shape=(len(self.routes), len(self.stop_ids))
+        )
+        coverage.sum_duplicates()
+        coverage.data[:] = 1
+        self.coverage = coverage
+        self.stop_counts = np.asarray(coverage.sum(axis=0)).ravel()
+
+        self.sequence_stops = edge_index['sequence_stops']
+        self.sequence_edges = edge_index['sequence_edges']
+        self.sequence_directions = [direction for _, direction, _ in sequences]
+
+        # Baseline totals, matching run_full_analysis()
+        all_segments = np.concatenate([self.edge_length[e] for e in self.sequence_edges]) \
+            if self.sequence_edges else np.empty(0)
+        self.baseline = {
+            'total_edges': int(np.count_nonzero(self.edge_counts)),
+            'overlapping_edges': int(np.count_nonzero(self.edge_counts > 1)),
+            'wasted_km': float(np.maximum(self.edge_counts - 1, 0) @ self.edge_waste_weight),
+            'vehicle_km': float(sum(bus.get('routLength', 0) for bus in analyzer.buses)),
+            'segments': len(all_segments),
+            'dense_segments': int(np.count_nonzero(all_segments < DENSE_THRESHOLD_KM))
+        }
+        self.baseline['score'] = float(self._score(
+            np.array([self.baseline['overlapping_edges']]), np.array([self.baseline['total_edges']]),
+            np.array([self.baseline['wasted_km']]), np.array([self.baseline['vehicle_km']]),
+            np.array([self.baseline['dense_segments']]), np.array([self.baseline['segments']])
+        )[0])
+
+        self.actions = []
+        self._build_actions(analyzer, truncate_fraction, merge_min_jaccard)
+
+    # ==================== ACTIONS ====================
+
+    def _route_segments(self, route: str):
+        """Segment edge ids and segment end stops of all sequences of a route"""
+        edges = [self.sequence_edges[k] for k in self.route_sequences[route]]
+        starts = [self.sequence_stops[k][:-1] for k in self.route_sequences[route]]
+        ends = [self.sequence_stops[k][1:] for k in self.route_sequences[route]]
+        if not edges:
+            empty = np.empty(0, dtype=np.int64)
+            return empty, empty, empty
+        return np.concatenate(edges), np.concatenate(starts), np.concatenate(ends)
+
+    def _add_action(self, kind: str, routes: List[str], edges, stops, segment_edges, vehicle_km: float, **details):
+        segment_lengths = self.edge_length[segment_edges]
+        self.actions.append({
+            'type': kind,
+            'routes': routes,
+            'edges': np.unique(np.asarray(edges, dtype=np.int64)),
+            'stops': np.unique(np.asarray(stops, dtype=np.int64)),
+            'vehicle_km': vehicle_km,
+            'segments': len(segment_lengths),
+            'dense_segments': int(np.count_nonzero(segment_lengths < DENSE_THRESHOLD_KM)),
+            **details
+        })
+
+    def _build_actions(self, analyzer: TransitNetworkAnalyzer, truncate_fraction: float, merge_min_jaccard: float):
+        """Removal and truncation of every route, and merges of near-duplicate route pairs"""
+        route_rows = {route: row for row, route in enumerate(self.routes)}
+
+        for row, route in enumerate(self.routes):
+            route_edges = self.matrix.indices[self.matrix.indptr[row]:self.matrix.indptr[row + 1]]
+            route_stops = self.coverage.indices[self.coverage.indptr[row]:self.coverage.indptr[row + 1]]
+            segment_edges, seg_from, seg_to = self._route_segments(route)
+            self._add_action('remove', [route], route_edges, route_stops, segment_edges, self.route_km[row])
+
+            # Truncations: cut a share of the stops at one end of the line (the start of
+            # direction 1 is the end of direction 2), keeping stops still served elsewhere
+            if not len(segment_edges):
+                continue
+            total_length = self.edge_length[segment_edges].sum()
+            for end in ('start', 'end'):
+                cut_parts, kept_parts = [], []
+                for k in self.route_sequences[route]:
+                    stops = self.sequence_stops[k]
+                    cut = int(len(stops) * truncate_fraction)
+                    if cut < 1 or len(stops) - cut < 2:
+                        kept_parts.append(stops)
+                        continue
+                    if (end == 'end') == (self.sequence_directions[k] == 1):
+                        cut_parts.append(stops[-cut:])
+                        kept_parts.append(stops[:-cut])
+                    else:
+                        cut_parts.append(stops[:cut])
+                        kept_parts.append(stops[cut:])
+                if not cut_parts:
+                    continue
+                cut_stops = np.setdiff1d(np.concatenate(cut_parts), np.concatenate(kept_parts))
+                dropped = np.isin(seg_from, cut_stops) | np.isin(seg_to, cut_stops)
+                if not dropped.any():
+                    continue
+                lost_edges = np.setdiff1d(segment_edges[dropped], segment_edges[~dropped])
+                share = self.edge_length[segment_edges[dropped]].sum() / total_length if total_length > 0 else 0
+                self._add_action('truncate', [route], lost_edges, np.searchsorted(self.stop_ids, cut_stops),
+                                 segment_edges[dropped], self.route_km[row] * share, end=end,
+                                 stops_cut=int(len(cut_stops)))
+
+        # Merges of near-duplicate routes: b is absorbed by a on their shared part
+        engine = RouteSimilarityEngine.from_analyzer(analyzer)
+        for pair in engine.merge_candidates(merge_min_jaccard):
+            for a, b in (pair['routes'], pair['routes'][::-1]):
+                row_a, row_b = route_rows[a], route_rows[b]
+                edges_a = self.matrix.indices[self.matrix.indptr[row_a]:self.matrix.indptr[row_a + 1]]
+                edges_b = self.matrix.indices[self.matrix.indptr[row_b]:self.matrix.indptr[row_b + 1]]
+                stops_a = self.coverage.indices[self.coverage.indptr[row_a]:self.coverage.indptr[row_a + 1]]
+                stops_b = self.coverage.indices[self.coverage.indptr[row_b]:self.coverage.indptr[row_b + 1]]
+                shared = np.intersect1d(edges_a, edges_b)
+                segment_edges, _, _ = self._route_segments(b)
+                shared_segments = segment_edges[np.isin(segment_edges, shared)]
+                total_length = self.edge_length[segment_edges].sum()
+                share = self.edge_length[shared_segments].sum() / total_length if total_length > 0 else 0
+                self._add_action('merge', [a, b], shared, np.intersect1d(stops_a, stops_b), shared_segments,
+                                 self.route_km[row_b] * share, into=a, jaccard=pair['jaccard'])
+
+        n_actions = len(self.actions)
+        self.action_edges = self._membership_matrix([a['edges'] for a in self.actions], len(self.edge_counts))
+        self.action_stops = self._membership_matrix([a['stops'] for a in self.actions], len(self.stop_ids))
+        self.action_km = np.array([a['vehicle_km'] for a in self.actions], dtype=np.float64)
+        self.action_segments = np.array([a['segments'] for a in self.actions], dtype=np.float64)
+        self.action_dense = np.array([a['dense_segments'] for a in self.actions], dtype=np.float64)
+
+        # Actions conflict when they touch the same route
+        self.action_routes = [set(a['routes']) for a in self.actions]
+        route_actions = {}
+        for k, routes in enumerate(self.action_routes):
+            for route in routes:
+                route_actions.setdefault(route, []).append(k)
+        self.conflicts = [
+            sorted({j for route in routes for j in route_actions[route]} - {k})
+            for k, routes in enumerate(self.action_routes)
+        ]
+        print(f"Built {n_actions} candidate actions "
+              f"({sum(a['type'] == 'remove' for a in self.actions)} removals, "
+              f"{sum(a['type'] == 'truncate' for a in self.actions)} truncations, "
+              f"{sum(a['type'] == 'merge' for a in self.actions)} merges)")
+
+    @staticmethod
+    def _membership_matrix(sets: List[np.ndarray], n_columns: int) -> sparse.csr_matrix:
+        lengths = [len(s) for s in sets]
+        return sparse.csr_matrix(
+            (np.ones(sum(lengths), dtype=np.int64),
+             (np.repeat(np.arange(len(sets)), lengths), np.concatenate(sets) if sets else [])),
+            shape=(len(sets), n_columns)
+        )
+
+    # ==================== BATCHED EVALUATION ====================
+
+    @staticmethod
+    def _score(overlapping, total_edges, wasted_km, vehicle_km, dense, segments) -> np.ndarray:
+        """Vectorized _compute_efficiency_score"""
+        with np.errstate(divide='ignore', invalid='ignore'):
+            overlap_pct = np.where(total_edges > 0, overlapping / total_edges * 100, 0)
+            waste_pct = np.where(vehicle_km > 0, wasted_km / vehicle_km * 100, 0)
+            dense_pct = np.where(segments > 0, dense / segments * 100, 0)
+        score = 0.4 * (100 - overlap_pct) + 0.4 * (100 - waste_pct) + 0.2 * (100 - dense_pct)
+        return np.clip(score, 0, 100)
+
+    def evaluate(self, scenarios: sparse.csr_matrix) -> Dict[str, np.ndarray]:
+        """
+        Score a batch of scenarios (binary scenario x action matrix)
+        Returns per-scenario score, score delta, component percentages and
+        coverage violations (served stops left without a route).
+        """
+        scenarios = sparse.csr_matrix(scenarios, dtype=np.int64)
+        n = scenarios.shape[0]
+
+        removed = (scenarios @ self.action_edges).tocsr()
+        rows = np.repeat(np.arange(n), np.diff(removed.indptr))
+        old = self.edge_counts[removed.indices]
+        new = old - removed.data
+        total_edges = self.baseline['total_edges'] + np.bincount(
+            rows, weights=(new > 0).astype(np.int64) - (old > 0), minlength=n)
+        overlapping = self.baseline['overlapping_edges'] + np.bincount(
+            rows, weights=(new > 1).astype(np.int64) - (old > 1), minlength=n)
+        wasted_km = self.baseline['wasted_km'] + np.bincount(
+            rows, weights=(np.maximum(new - 1, 0) - np.maximum(old - 1, 0)) * self.edge_waste_weight[removed.indices],
+            minlength=n)
+
+        lost = (scenarios @ self.action_stops).tocsr()
+        lost_rows = np.repeat(np.arange(n), np.diff(lost.indptr))
+        violations = np.bincount(lost_rows, weights=self.stop_counts[lost.indices] - lost.data < 1, minlength=n)
+
+        vehicle_km = self.baseline['vehicle_km'] - scenarios @ self.action_km
+        segments = self.baseline['segments'] - scenarios @ self.action_segments
+        dense = self.baseline['dense_segments'] - scenarios @ self.action_dense
+
+        score = self._score(overlapping, total_edges, wasted_km, vehicle_km, dense, segments)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return {
+                'score': score,
+                'score_delta': score - self.baseline['score'],
+                'overlap_percentage': np.where(total_edges > 0, overlapping / total_edges * 100, 0),
+                'waste_percentage': np.where(vehicle_km > 0, wasted_km / vehicle_km * 100, 0),
+                'dense_percentage': np.where(segments > 0, dense / segments * 100, 0),
+                'vehicle_km': vehicle_km,
+                'violations': violations.astype(np.int64)
+            }
+
+    def evaluate_sets(self, action_sets: List[List[int]], workers: Optional[int] = None) -> Dict[str, np.ndarray]:
+        """Score scenarios given as lists of action indices, in batches across a process pool"""
+        batches = [action_sets[i:i + BATCH_SIZE] for i in range(0, len(action_sets), BATCH_SIZE)]
+        if workers and workers > 1 and len(batches) > 1:
+            with _optimizer_pool(self, workers) as pool:
+                parts = list(pool.map(_evaluate_batch, batches))
+        else:
+            parts = [self.evaluate(self._scenario_matrix(batch)) for batch in batches]
+        if not parts:
+            return self.evaluate(self._scenario_matrix([]))
+        return {key: np.concatenate([p[key] for p in parts]) for key in parts[0]}
+
+    def _scenario_matrix(self, action_sets: List[List[int]]) -> sparse.csr_matrix:
+        lengths = [len(s) for s in action_sets]
+        return sparse.csr_matrix(
+            (np.ones(sum(lengths), dtype=np.int64),
+             (np.repeat(np.arange(len(action_sets)), lengths),
+              np.concatenate([np.asarray(s, dtype=np.int64) for s in action_sets]) if action_sets else [])),
+            shape=(len(action_sets), len(self.actions))
+        )
+
+    def _compatible(self, chosen: List[int]) -> np.ndarray:
+        """Actions that touch none of the routes already in a scenario"""
+        blocked = np.zeros(len(self.actions), dtype=bool)
+        for k in chosen:
+            blocked[k] = True
+            blocked[self.conflicts[k]] = True
+        return np.flatnonzero(~blocked)
+
+    # ==================== SEARCH ====================
+
+    def greedy(self, max_actions: int = 10, workers: Optional[int] = None) -> List[List[int]]:
+        """
+        Add the best feasible, improving action one at a time
+        Returns the plan after each step (each a list of action indices).
+        """
+        chosen, plans = [], []
+        current = self.baseline['score']
+        for _ in range(max_actions):
+            candidates = self._compatible(chosen)
+            if not len(candidates):
+                break
+            results = self.evaluate_sets([chosen + [k] for k in candidates.tolist()], workers)
+            gain = np.where(results['violations'] == 0, results['score'], -np.inf)
+            best = int(np.argmax(gain))
+            if gain[best] <= current:
+                break
+            chosen = chosen + [int(candidates[best])]
+            current = gain[best]
+            plans.append(list(chosen))
+        return plans
+
+    def anneal(self, chains: int = 64, steps: int = 500, max_actions: int = 10,
+               start_temperature: float = 0.5, end_temperature: float = 0.005, seed: int = 42,
+               workers: Optional[int] = None) -> List[List[int]]:
+        """
+        Simulated annealing with many chains; proposals of all chains are scored as one batch per step
+        Chains are split across worker processes. Returns the best plan of each chain.
+        """
+        workers = workers or multiprocessing.cpu_count()
+        seeds = np.random.SeedSequence(seed).spawn(max(1, min(workers, chains)))
+        shares = np.array_split(np.arange(chains), len(seeds))
+        jobs = [(len(share), steps, max_actions, start_temperature, end_temperature, s)
+                for share, s in zip(shares, seeds) if len(share)]
+
+        if len(jobs) > 1:
+            with _optimizer_pool(self, len(jobs)) as pool:
+                results = list(pool.map(_anneal_job, jobs))
+        else:
+            results = [self._anneal_chains(*jobs[0])]
+        return [plan for part in results for plan in part]
+
+    def _anneal_chains(self, chains: int, steps: int, max_actions: int,
+                       start_temperature: float, end_temperature: float, seed) -> List[List[int]]:
+        rng = np.random.default_rng(seed)
+        states = [[] for _ in range(chains)]
+        scores = np.full(chains, self.baseline['score'])
+        best_states = [[] for _ in range(chains)]
+        best_scores = scores.copy()
+
+        for step in range(steps):
+            temperature = start_temperature * (end_temperature / start_temperature) ** (step / max(steps - 1, 1))
+            proposals = []
+            for state in states:
+                candidates = self._compatible(state)
+                if state and (len(state) >= max_actions or not len(candidates) or rng.random() < 0.3):
+                    # Drop or swap out an action
+                    proposal = list(state)
+                    proposal.pop(rng.integers(len(proposal)))
+                    if rng.random() < 0.5:
+                        candidates = self._compatible(proposal)
+                        if len(candidates):
+                            proposal.append(int(rng.choice(candidates)))
+                elif len(candidates):
+                    proposal = state + [int(rng.choice(candidates))]
+                else:
+                    proposal = list(state)
+                proposals.append(proposal)
+
+            results = self.evaluate(self._scenario_matrix(proposals))
+            feasible = results['violations'] == 0
+            delta = results['score'] - scores
+            accept = feasible & ((delta >= 0) | (rng.random(chains) < np.exp(np.minimum(delta, 0) / temperature)))
+            for c in np.flatnonzero(accept).tolist():
+                states[c] = proposals[c]
+                scores[c] = results['score'][c]
+                if scores[c] > best_scores[c]:
+                    best_scores[c] = scores[c]
+                    best_states[c] = list(states[c])
+
+        return best_states
+
+    # ==================== PLANS ====================
+
+    def describe(self, action_set: List[int]) -> List[Dict]:
+        """Readable description of a plan's actions"""
+        described = []
+        for k in action_set:
+            action = self.actions[k]
+            entry = {'type': action['type'], 'routes': action['routes'],
+                     'vehicle_km_saved': float(action['vehicle_km'])}
+            for key in ('end', 'stops_cut', 'into', 'jaccard'):
+                if key in action:
+                    entry[key] = action[key]
+            described.append(entry)
+        return described
+
+    def rank_plans(self, plans: List[List[int]], top: int = 20) -> List[Dict]:
+        """Feasible, distinct plans ranked by score delta"""
+        unique = list({tuple(sorted(p)): p for p in plans if p}.values())
+        if not unique:
+            return []
+        results = self.evaluate(self._scenario_matrix(unique))
+        order = np.argsort(-results['score_delta'], kind='stable')
+        ranked = []
+        for i in order.tolist():
+            if results['violations'][i]:
+                continue
+            ranked.append({
+                'actions': self.describe(unique[i]),
+                'score': float(results['score'][i]),
+                'score_delta': float(results['score_delta'][i]),
+                'overlap_percentage': float(results['overlap_percentage'][i]),
+                'waste_percentage': float(results['waste_percentage'][i]),
+                'dense_percentage': float(results['dense_percentage'][i]),
+                'vehicle_km_saved': float(self.baseline['vehicle_km'] - results['vehicle_km'][i])
+            })
+        return ranked[:top]
+
+    def optimize(self, max_actions: int = 10, chains: int = 64, steps: int = 500,
+                 workers: Optional[int] = None, top: int = 20) -> List[Dict]:
+        """Greedy plans plus annealed plans, ranked"""
+        plans = self.greedy(max_actions, workers)
+        plans += self.anneal(chains, steps, max_actions, workers=workers)
+        return self.rank_plans(plans, top)
+
+
+# ==================== WORKER PROCESSES ====================
+
+# Optimizer shared with worker processes (set by _init_optimizer_worker)
+_worker_optimizer = None
+
+
+def _init_optimizer_worker(optimizer: RouteOptimizer):
+    global _worker_optimizer
+    _worker_optimizer = optimizer
+
+
+def _evaluate_batch(action_sets: List[List[int]]) -> Dict[str, np.ndarray]:
+    return _worker_optimizer.evaluate(_worker_optimizer._scenario_matrix(action_sets))
+
+
+def _anneal_job(job) -> List[List[int]]:
+    return _worker_optimizer._anneal_chains(*job)
+
+
+def _optimizer_pool(optimizer: RouteOptimizer, workers: int) -> ProcessPoolExecutor:
+    """Process pool whose workers share the optimizer (inherited on fork)"""
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context('fork' if 'fork' in methods else None)
+    return ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                               initializer=_init_optimizer_worker, initargs=(optimizer,))
+
+
+if __name__ == "__main__":
+    import time
+
+    parser = argparse.ArgumentParser(description="Search route removals, truncations and merges")
+    parser.add_argument('--bus-details', default='data/busDetails.json',
+                        help="Bus details file (.json or .ndjson)")
+    parser.add_argument('--stops', default='data/stops.json', help="Stops file")
+    parser.add_argument('--max-actions', type=int, default=10, help="Actions per plan")
+    parser.add_argument('--chains', type=int, default=64, help="Simulated annealing chains")
+    parser.add_argument('--steps', type=int, default=500, help="Annealing steps per chain")
+    parser.add_argument('--workers', type=int, default=None, help="Worker processes (default: all CPUs)")
+    parser.add_argument('--top', type=int, default=20)
+    parser.add_argument('--output', default='data/rationalization_plans.json')
+    args = parser.parse_args()
+
+    analyzer = TransitNetworkAnalyzer(args.bus_details, args.stops)
+    optimizer = RouteOptimizer(analyzer)
+
+    started = time.perf_counter()
+    plans = optimizer.optimize(args.max_actions, args.chains, args.steps, args.workers, args.top)
+    elapsed = time.perf_counter() - started
+    evaluated = args.chains * args.steps + len(optimizer.actions) * args.max_actions
+    print(f"\nSearched ~{evaluated} scenarios in {elapsed:.1f} s "
+          f"(baseline score {optimizer.baseline['score']:.2f})")
+
+    for rank, plan in enumerate(plans[:10], 1):
+        summary = ', '.join(
+            f"{a['type']} {'→'.join(a['routes'][::-1]) if a['type'] == 'merge' else a['routes'][0]}"
+            for a in plan['actions']
+        )
+        print(f"  {rank}. {plan['score']:.2f} ({plan['score_delta']:+.2f}): {summary}")
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump({'baseline_score': optimizer.baseline['score'], 'plans': plans}, f, indent=2, ensure_ascii=False)
+    print(f"\nRationalization plans saved to {args.output}")
@@ -0,0 +1,248 @@
+"""
+Route Similarity Engine for Transit Network Analysis
+Finds near-duplicate routes by Jaccard overlap of their edge sets
+"""
+
+import json
+import argparse
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from scipy import sparse
+
+from network_analysis import TransitNetworkAnalyzer
+
+
+# Networks up to this many routes use the exact sparse product by default
+EXACT_MAX_ROUTES = 2000
+
+# Mersenne prime for the MinHash universal hash family
+MINHASH_PRIME = (1 << 31) - 1
+
+
+class RouteSimilarityEngine:
+    """
+    Jaccard similarity between route edge sets
+
+    Exact mode multiplies the route x edge incidence matrix by its transpose,
+    which only touches route pairs that share at least one edge. Approximate
+    mode builds MinHash signatures and uses LSH banding to find candidate
+    pairs without comparing all pairs of routes.
+    """
+
+    def __init__(self, routes: List[str], incidence: sparse.csr_matrix):
+        """
+        routes: route number of each incidence row
+        incidence: binary route x edge CSR matrix
+        """
+        self.routes = list(routes)
+        self.route_rows = {route: row for row, route in enumerate(self.routes)}
+        self.incidence = sparse.csr_matrix(incidence, dtype=np.int32)
+        self.edge_counts = np.diff(self.incidence.indptr)
+
+    @classmethod
+    def from_analyzer(cls, analyzer: TransitNetworkAnalyzer) -> 'RouteSimilarityEngine':
+        """Build the engine from an analyzer's cached incidence matrix"""
+        incidence = analyzer.get_route_edge_incidence()
+        return cls(incidence['routes'], incidence['matrix'])
+
+    # ==================== EXACT ====================
+
+    def exact_pairs(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        All route pairs (i < j) sharing at least one edge
+        Returns row indices, shared edge counts and Jaccard similarity
+        """
+        shared = sparse.triu(self.incidence @ self.incidence.T, k=1).tocoo()
+        i, j, intersection = shared.row, shared.col, shared.data.astype(np.int64)
+        union = self.edge_counts[i] + self.edge_counts[j] - intersection
+        return i, j, intersection, intersection / union
+
+    # ==================== APPROXIMATE (MinHash + LSH) ====================
+
+    def minhash_signatures(self, num_perm: int = 128, seed: int = 42) -> np.ndarray:
+        """
+        MinHash signature matrix (routes x num_perm)
+        Every route row must have at least one edge.
+        """
+        rng = np.random.default_rng(seed)
+        a = rng.integers(1, MINHASH_PRIME, size=num_perm, dtype=np.int64)
+        b = rng.integers(0, MINHASH_PRIME, size=num_perm, dtype=np.int64)
+
+        edges = self.incidence.indices.astype(np.int64)
+        row_starts = self.incidence.indptr[:-1]
+        signatures = np.empty((len(self.routes), num_perm), dtype=np.int64)
+
+        # Hash in blocks of permutations to bound the (nnz x block) temporary
+        block = max(1, min(num_perm, 4_000_000 // max(len(edges), 1)))
+        for start in range(0, num_perm, block):
+            stop = min(start + block, num_perm)
+            hashes = (np.outer(edges, a[start:stop]) + b[start:stop]) % MINHASH_PRIME
+            signatures[:, start:stop] = np.minimum.reduceat(hashes, row_starts, axis=0)
+
+        return signatures
+
+    @staticmethod
+    def lsh_candidate_pairs(signatures: np.ndarray, bands: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Candidate pairs (i < j) whose signatures agree on every row of at least one band
+        """
+        n_routes, num_perm = signatures.shape
+        rows_per_band = num_perm // bands
+        pairs = set()
+
+        for band in range(bands):
+            band_sig = np.ascontiguousarray(signatures[:, band * rows_per_band:(band + 1) * rows_per_band])
+            _, bucket, bucket_sizes = np.unique(
+                band_sig.view(np.dtype((np.void, band_sig.dtype.itemsize * rows_per_band))).ravel(),
+                return_inverse=True, return_counts=True
+            )
+            order = np.argsort(bucket, kind='stable')
+            boundaries = np.concatenate([[0], np.cumsum(bucket_sizes)])
+
+            for b in np.flatnonzero(bucket_sizes > 1).tolist():
+                members = order[boundaries[b]:boundaries[b + 1]].tolist()
+                for x in range(len(members)):
+                    for y in range(x + 1, len(members)):
+                        pairs.add((members[x], members[y]))
+
+        if not pairs:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+        candidates = np.array(sorted(pairs), dtype=np.int64)
+        return candidates[:, 0], candidates[:, 1]
+
+    def approximate_pairs(self, num_perm: int = 128, bands: int = 32, seed: int = 42,
+                          verify: bool = True) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Route pairs found by MinHash + LSH banding
+
+        With `bands` bands of num_perm/bands rows, pairs with Jaccard above
+        roughly (1/bands)^(bands/num_perm) are found with high probability.
+        If verify is True, candidates are scored with their exact Jaccard;
+        otherwise with the MinHash estimate.
+        """
+        signatures = self.minhash_signatures(num_perm, seed)
+        i, j = self.lsh_candidate_pairs(signatures, bands)
+
+        if verify and len(i):
+            intersection = np.asarray(self.incidence[i].multiply(self.incidence[j]).sum(axis=1)).ravel()
+            union = self.edge_counts[i] + self.edge_counts[j] - intersection
+            similarity = intersection / union
+        else:
+            similarity = (signatures[i] == signatures[j]).mean(axis=1)
+            union = self.edge_counts[i] + self.edge_counts[j]
+            intersection = np.rint(similarity * union / (1 + similarity)).astype(np.int64)
+
+        keep = similarity > 0
+        return i[keep], j[keep], intersection[keep], similarity[keep]
+
+    # ==================== TOP-K ====================
+
+    def top_k(self, k: int = 5, method: str = 'auto', **approximate_kwargs) -> Dict[str, List[Dict]]:
+        """
+        Top-k most similar routes for every route
+
+        method: 'exact', 'approximate' (MinHash + LSH) or 'auto' (exact up to
+        EXACT_MAX_ROUTES routes)
+        Returns {route: [{'route', 'jaccard', 'shared_edges'}, ...]} sorted by similarity
+        """
+        if method == 'auto':
+            method = 'exact' if len(self.routes) <= EXACT_MAX_ROUTES else 'approximate'
+
+        if method == 'exact':
+            i, j, intersection, similarity = self.exact_pairs()
+        elif method == 'approximate':
+            i, j, intersection, similarity = self.approximate_pairs(**approximate_kwargs)
+        else:
+            raise ValueError(f"Unknown similarity method: {method}")
+
+        # Each pair is a neighbour of both of its routes
+        source = np.concatenate([i, j])
+        target = np.concatenate([j, i])
+        shared = np.concatenate([intersection, intersection])
+        score = np.concatenate([similarity, similarity])
+
+        order = np.lexsort((target, -score, source))
+        source, target, shared, score = source[order], target[order], shared[order], score[order]
+
+        # Rank within each source route and keep the first k
+        group_start = np.searchsorted(source, source, side='left')
+        keep = (np.arange(len(source)) - group_start) < k
+
+        neighbours = {route: [] for route in self.routes}
+        for s, t, n, sim in zip(source[keep].tolist(), target[keep].tolist(),
+                                shared[keep].tolist(), score[keep].tolist()):
+            neighbours[self.routes[s]].append({'route': self.routes[t], 'jaccard': sim, 'shared_edges': n})
+
+        return neighbours
+
+    def similar_to(self, route: str, k: int = 5) -> List[Dict]:
+        """Top-k routes most similar to one route (exact)"""
+        row = self.route_rows[route]
+        shared = (self.incidence @ self.incidence[row].T).toarray().ravel()
+        shared[row] = 0
+
+        candidates = np.flatnonzero(shared)
+        similarity = shared[candidates] / (self.edge_counts[candidates] + self.edge_counts[row] - shared[candidates])
+        order = np.lexsort((candidates, -similarity))[:k]
+
+        return [
+            {'route': self.routes[c], 'jaccard': float(similarity[o]), 'shared_edges': int(shared[c])}
+            for o, c in zip(order.tolist(), candidates[order].tolist())
+        ]
+
+    def merge_candidates(self, min_jaccard: float = 0.5, method: str = 'auto',
+                         limit: Optional[int] = None, **approximate_kwargs) -> List[Dict]:
+        """Route pairs with Jaccard >= min_jaccard, most similar first"""
+        if method == 'auto':
+            method = 'exact' if len(self.routes) <= EXACT_MAX_ROUTES else 'approximate'
+
+        if method == 'exact':
+            i, j, intersection, similarity = self.exact_pairs()
+        else:
+            i, j, intersection, similarity = self.approximate_pairs(**approximate_kwargs)
+
+        keep = np.flatnonzero(similarity >= min_jaccard)
+        keep = keep[np.argsort(-similarity[keep], kind='stable')][:limit]
+
+        return [
+            {
+                'routes': [self.routes[i[p]], self.routes[j[p]]],
+                'jaccard': float(similarity[p]),
+                'shared_edges': int(intersection[p])
+            }
+            for p in keep.tolist()
+        ]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Find near-duplicate routes by edge-set similarity")
+    parser.add_argument('--bus-details', default='data/busDetails.json',
+                        help="Bus details file (.json or .ndjson)")
+    parser.add_argument('--stops', default='data/stops.json', help="Stops file")
+    parser.add_argument('--route', default=None, help="Show the routes most similar to this route number")
+    parser.add_argument('-k', type=int, default=5, help="Number of similar routes per route")
+    parser.add_argument('--method', choices=['auto', 'exact', 'approximate'], default='auto')
+    parser.add_argument('--min-jaccard', type=float, default=0.5, help="Merge candidate threshold")
+    parser.add_argument('--output', default='data/route_similarity.json')
+    args = parser.parse_args()
+
+    analyzer = TransitNetworkAnalyzer(args.bus_details, args.stops)
+    engine = RouteSimilarityEngine.from_analyzer(analyzer)
+
+    if args.route:
+        print(f"\nRoutes most similar to {args.route}:")
+        for match in engine.similar_to(args.route, args.k):
+            print(f"  {match['route']}: Jaccard {match['jaccard']:.2f} ({match['shared_edges']} shared edges)")
+    else:
+        top_k = engine.top_k(args.k, method=args.method)
+        candidates = engine.merge_candidates(args.min_jaccard, method=args.method)
+
+        print(f"\n{len(candidates)} route pairs with Jaccard >= {args.min_jaccard}")
+        for pair in candidates[:10]:
+            print(f"  {' / '.join(pair['routes'])}: Jaccard {pair['jaccard']:.2f} "
+                  f"({pair['shared_edges']} shared edges)")
+
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'top_k': top_k, 'merge_candidates': candidates}, f, indent=2, ensure_ascii=False)
+        print(f"\nRoute similarity saved to {args.output}")
@@ -0,0 +1,201 @@
+"""
+Spatial Index over Stops for Transit Network Analysis
+Nearest-neighbour, radius and stop-cluster queries on projected stop coordinates
+"""
+
+import json
+import argparse
+from typing import Dict, List, Set, Tuple
+import numpy as np
+from scipy import sparse
+from scipy.sparse.csgraph import connected_components
+from scipy.spatial import cKDTree, ConvexHull, QhullError
+from scipy.spatial.distance import pdist
+
+from network_analysis import TransitNetworkAnalyzer, EARTH_RADIUS_KM
+
+
+EARTH_RADIUS_M = EARTH_RADIUS_KM * 1000
+
+# Stops closer than this and served by different routes are consolidation candidates
+DEFAULT_CLUSTER_RADIUS_M = 200
+
+
+def point_set_diameter(xy: np.ndarray) -> float:
+    """
+    Largest distance between two points
+    The farthest pair lies on the convex hull, so only hull vertices are
+    compared; collinear points are measured between their extremes.
+    """
+    if len(xy) < 2:
+        return 0.0
+    if len(xy) > 3:
+        try:
+            xy = xy[ConvexHull(xy).vertices]
+        except QhullError:  # all points on one line
+            ends = [xy.argmin(axis=0), xy.argmax(axis=0)]
+            return float(max(np.linalg.norm(xy[hi] - xy[lo]) for lo, hi in zip(*ends)))
+    return float(pdist(xy).max())
+
+
+class StopSpatialIndex:
+    """
+    KD-tree over stop coordinates projected to metres
+
+    Coordinates are projected with a local equirectangular projection
+    centred on the network, which is accurate to well under 1% over a
+    city. Stops with invalid coordinates are left out of the tree.
+    """
+
+    def __init__(self, stop_ids: np.ndarray, lat: np.ndarray, lon: np.ndarray):
+        stop_ids = np.asarray(stop_ids, dtype=np.int64)
+        lat = np.asarray(lat, dtype=np.float64)
+        lon = np.asarray(lon, dtype=np.float64)
+
+        valid = np.isfinite(lat) & np.isfinite(lon) & (np.abs(lat) <= 90) & (np.abs(lon) <= 180)
+        self.stop_ids = stop_ids[valid]
+        self.lat = lat[valid]
+        self.lon = lon[valid]
+        self.n_invalid = int((~valid).sum())
+
+        self.lat0 = float(np.median(self.lat)) if len(self.lat) else 0.0
+        self.lon0 = float(np.median(self.lon)) if len(self.lon) else 0.0
+        self.xy = self.project(self.lat, self.lon)
+        self.tree = cKDTree(self.xy)
+
+    @classmethod
+    def from_analyzer(cls, analyzer: TransitNetworkAnalyzer) -> 'StopSpatialIndex':
+        """Index every stop in the analyzer's coordinate table"""
+        table = analyzer.get_stop_coordinates()
+        return cls(table['stop_ids'], table['lat'], table['lon'])
+
+    def project(self, lat, lon) -> np.ndarray:
+        """(n, 2) metre coordinates of lat/lon arrays"""
+        lat = np.radians(np.asarray(lat, dtype=np.float64))
+        lon = np.radians(np.asarray(lon, dtype=np.float64))
+        x = EARTH_RADIUS_M * (lon - np.radians(self.lon0)) * np.cos(np.radians(self.lat0))
+        y = EARTH_RADIUS_M * (lat - np.radians(self.lat0))
+        return np.column_stack([x, y])
+
+    def _positions(self, stop_ids) -> np.ndarray:
+        stop_ids = np.asarray(stop_ids, dtype=np.int64)
+        positions = np.searchsorted(self.stop_ids, stop_ids)
+        positions = np.minimum(positions, max(len(self.stop_ids) - 1, 0))
+        missing = self.stop_ids[positions] != stop_ids if len(self.stop_ids) else np.ones(len(stop_ids), bool)
+        if missing.any():
+            raise KeyError(f"Stops not in the spatial index: {stop_ids[missing][:10].tolist()}")
+        return positions
+
+    # ==================== POINT QUERIES ====================
+
+    def nearest(self, lat, lon, k: int = 1) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        k nearest stops to each point
+        Returns (n, k) arrays of stop ids and distances in metres
+        """
+        distances, positions = self.tree.query(self.project(lat, lon), k=k)
+        distances = distances.reshape(len(distances), -1)
+        positions = positions.reshape(len(positions), -1)
+        return self.stop_ids[np.minimum(positions, len(self.stop_ids) - 1)], distances
+
+    def within_radius(self, lat, lon, radius_m: float) -> List[np.ndarray]:
+        """Stop ids within radius_m of each point"""
+        matches = self.tree.query_ball_point(self.project(lat, lon), r=radius_m)
+        return [self.stop_ids[np.sort(np.asarray(m, dtype=np.int64))] for m in matches]
+
+    # ==================== STOP QUERIES ====================
+
+    def nearest_stops(self, stop_ids, k: int = 1) -> Tuple[np.ndarray, np.ndarray]:
+        """k nearest other stops to each stop: (n, k) stop ids and distances in metres"""
+        positions = self._positions(stop_ids)
+        distances, neighbours = self.tree.query(self.xy[positions], k=k + 1)
+        # The first match is the stop itself (or a co-located stop; either way one is dropped)
+        keep = neighbours != positions[:, None]
+        keep[keep.sum(axis=1) > k, -1] = False
+        neighbours = neighbours[keep].reshape(len(positions), k)
+        distances = distances[keep].reshape(len(positions), k)
+        return self.stop_ids[np.minimum(neighbours, len(self.stop_ids) - 1)], distances
+
+    def stops_within(self, stop_ids, radius_m: float) -> List[np.ndarray]:
+        """Other stops within radius_m of each stop"""
+        positions = self._positions(stop_ids)
+        matches = self.tree.query_ball_point(self.xy[positions], r=radius_m)
+        return [
+            self.stop_ids[np.sort(np.asarray([m for m in match if m != p], dtype=np.int64))]
+            for p, match in zip(positions.tolist(), matches)
+        ]
+
+    def close_pairs(self, radius_m: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """All stop pairs closer than radius_m: stop ids a < b and distances in metres"""
+        pairs = self.tree.query_pairs(r=radius_m, output_type='ndarray')
+        if not len(pairs):
+            empty = np.empty(0, dtype=np.int64)
+            return empty, empty, np.empty(0)
+        i, j = np.sort(pairs, axis=1).T
+        distances = np.linalg.norm(self.xy[i] - self.xy[j], axis=1)
+        order = np.lexsort((j, i))
+        return self.stop_ids[i[order]], self.stop_ids[j[order]], distances[order]
+
+    # ==================== CONSOLIDATION ====================
+
+    def consolidation_clusters(self, stop_routes: Dict[int, Set[str]],
+                               radius_m: float = DEFAULT_CLUSTER_RADIUS_M) -> List[Dict]:
+        """
+        Clusters of stops closer than radius_m that are served by different route sets
+
+        Pairs of served stops within radius_m whose route sets differ are
+        linked, and linked stops are grouped (single linkage). Stops served by
+        exactly the same routes, such as opposite-direction pairs, are not
+        linked. Returns clusters largest first.
+        """
+        a, b, _ = self.close_pairs(radius_m)
+        empty = frozenset()
+        routes_a = [frozenset(stop_routes.get(s, empty)) for s in a.tolist()]
+        routes_b = [frozenset(stop_routes.get(s, empty)) for s in b.tolist()]
+        linked = np.array([ra and rb and ra != rb for ra, rb in zip(routes_a, routes_b)], dtype=bool)
+        a, b = a[linked], b[linked]
+        if not len(a):
+            return []
+
+        members = np.unique(np.concatenate([a, b]))
+        ia, ib = np.searchsorted(members, a), np.searchsorted(members, b)
+        link_graph = sparse.coo_matrix((np.ones(len(a)), (ia, ib)), shape=(len(members),) * 2)
+        _, labels = connected_components(link_graph, directed=False)
+
+        clusters = []
+        for label in np.unique(labels).tolist():
+            cluster_stops = members[labels == label]
+            positions = self._positions(cluster_stops)
+            span = point_set_diameter(self.xy[positions])
+            routes = set().union(*(stop_routes.get(s, empty) for s in cluster_stops.tolist()))
+            clusters.append({
+                'stops': cluster_stops.tolist(),
+                'routes': sorted(routes),
+                'routes_count': len(routes),
+                'span_m': float(span),
+                'centroid': [float(self.lat[positions].mean()), float(self.lon[positions].mean())]
+            })
+
+        return sorted(clusters, key=lambda c: (-len(c['stops']), -c['routes_count'], c['stops'][0]))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Find stop consolidation clusters")
+    parser.add_argument('--bus-details', default='data/busDetails.json',
+                        help="Bus details file (.json or .ndjson)")
+    parser.add_argument('--stops', default='data/stops.json', help="Stops file")
+    parser.add_argument('--radius', type=float, default=DEFAULT_CLUSTER_RADIUS_M,
+                        help="Cluster radius in metres")
+    parser.add_argument('--output', default='data/stop_clusters.json')
+    args = parser.parse_args()
+
+    analyzer = TransitNetworkAnalyzer(args.bus_details, args.stops)
+    clusters = analyzer.find_consolidation_clusters(args.radius)
+
+    print(f"\n{len(clusters)} stop clusters within {args.radius:.0f} m served by different routes")
+    for cluster in clusters[:10]:
+        print(f"  Stops {cluster['stops']}: {cluster['routes_count']} routes, span {cluster['span_m']:.0f} m")
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(clusters, f, indent=2, ensure_ascii=False)
+    print(f"\nStop clusters saved to {args.output}")
@@ -1,12 +1,16 @@
 import requests
 import json
 import os
+import argparse
 
-def fetch_stops():
+# Base URL of the Ayna API (override to point the fetcher at a local stand-in server)
+API_BASE_URL = os.environ.get('AYNA_API_BASE_URL', 'https://map-api.ayna.gov.az/api')
+
+def fetch_stops(base_url=API_BASE_URL, output_path='data/stops.json'):
     """
     Fetch all bus stops from the Ayna API and save to JSON file.
     """
-    url = "https://map-api.ayna.gov.az/api/stop/getAll"
+    url = f"{base_url}/stop/getAll"
 
     try:
         print("Fetching stops data from API...")
@@ -17,10 +21,9 @@ def fetch_stops():
         print(f"Successfully fetched {len(stops_data) if isinstance(stops_data, list) else 'unknown number of'} stops")
 
         # Ensure data directory exists
-        os.makedirs('data', exist_ok=True)
+        os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
 
         # Save to JSON file
-        output_path = 'data/stops.json'
         with open(output_path, 'w', encoding='utf-8') as f:
             json.dump(stops_data, f, ensure_ascii=False, indent=2)
 
@@ -38,4 +41,9 @@ def fetch_stops():
         return None
 
 if __name__ == "__main__":
-    fetch_stops()
+    parser = argparse.ArgumentParser(description="Fetch all bus stops from the Ayna API")
+    parser.add_argument('--base-url', default=API_BASE_URL, help="API base URL")
+    parser.add_argument('--output', default='data/stops.json', help="Output file path")
+    args = parser.parse_args()
+
+    fetch_stops(base_url=args.base_url, output_path=args.output)
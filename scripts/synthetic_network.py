@@ -0,0 +1,289 @@
+"""
+Synthetic Transit Network Generator
+Seeded bus details and stops files in the Ayna API schema, at configurable sizes
+"""
+
+import json
+import math
+import os
+import argparse
+from typing import Dict, Iterator, List
+import numpy as np
+from scipy.spatial import cKDTree
+
+from busDetails import save_bus_details, prepare_details, GEOMETRY_FORMATS, DEFAULT_GEOMETRY
+
+
+DEFAULT_SEED = 42
+
+# Named sizes: (routes, stops)
+SIZES = {
+    'small': (200, 2000),
+    'medium': (1000, 10000),
+    'large': (5000, 50000),
+    'xlarge': (10000, 100000)
+}
+
+# City centre the network is laid out around (Baku)
+CENTER_LAT = 40.4093
+CENTER_LON = 49.8671
+
+# Stops per km² on average; sets the city radius so spacing stays realistic at every size
+STOP_DENSITY_PER_KM2 = 4.0
+
+# Fraction of routes that start by running along part of an existing route
+DEFAULT_OVERLAP = 0.5
+SHARED_FRACTION_RANGE = (0.3, 0.7)  # share of the copied route's stops
+
+ROUTE_STOPS_RANGE = (15, 45)  # stops per direction, before any shared part
+NEIGHBOURS = 12  # candidate next stops considered by the route walk
+MIN_STOPS = NEIGHBOURS + 1  # every stop needs NEIGHBOURS other stops
+HEADING_JITTER = 0.35  # radians, standard deviation of the per-step turn
+HUB_FRACTION = 0.005  # stops flagged isTransportHub
+GEOMETRY_POINTS_PER_SEGMENT = 2  # flowCoordinates points between consecutive stops
+MINUTES_PER_KM = 3.0
+
+KM_PER_DEG_LAT = 110.574
+KM_PER_DEG_LON = 111.320 * math.cos(math.radians(CENTER_LAT))
+
+
+def parse_size(size: str) -> tuple:
+    """(routes, stops) for a named size or a `ROUTESxSTOPS` string such as 2000x20000"""
+    if size in SIZES:
+        return SIZES[size]
+    try:
+        routes, stops = size.lower().split('x')
+        routes, stops = int(routes), int(stops)
+    except ValueError:
+        raise ValueError(f"Unknown size {size!r}: use one of {', '.join(SIZES)} or ROUTESxSTOPS") from None
+    if stops < MIN_STOPS:
+        raise ValueError(f"Size {size!r} has {stops} stops; at least {MIN_STOPS} are needed")
+    return routes, stops
+
+
+class SyntheticNetworkGenerator:
+    """
+    Seeded synthetic bus network in the real busDetails / stops schema
+
+    Stops are scattered around the city centre (denser towards the middle)
+    at a fixed average density. Each route is a heading-biased walk over
+    nearby stops; with probability `overlap` it first runs along a
+    contiguous part of an earlier route, which produces the shared
+    corridors the overlap analysis measures. Direction 2 is the reverse of
+    direction 1. The same parameters and seed always give the same files.
+    """
+
+    def __init__(self, routes: int, stops: int, overlap: float = DEFAULT_OVERLAP, seed: int = DEFAULT_SEED,
+                 route_stops: tuple = ROUTE_STOPS_RANGE, geometry_points: int = GEOMETRY_POINTS_PER_SEGMENT):
+        if not 0 <= overlap <= 1:
+            raise ValueError("overlap must be between 0 and 1")
+        if stops < MIN_STOPS:
+            raise ValueError(f"stops must be at least {MIN_STOPS}")
+        self.num_routes = routes
+        self.num_stops = stops
+        self.overlap = overlap
+        self.seed = seed
+        self.route_stops = route_stops
+        self.geometry_points = geometry_points
+
+        stop_seed, route_seed = np.random.SeedSequence(seed).spawn(2)
+        self._route_seed = route_seed
+        rng = np.random.default_rng(stop_seed)
+
+        # Stop positions in km around the centre
+        radius_km = math.sqrt(stops / (math.pi * STOP_DENSITY_PER_KM2))
+        r = radius_km * rng.random(stops) ** 0.75
+        theta = rng.random(stops) * 2 * math.pi
+        self.xy = np.column_stack([r * np.cos(theta), r * np.sin(theta)])
+        self.lat = CENTER_LAT + self.xy[:, 1] / KM_PER_DEG_LAT
+        self.lon = CENTER_LON + self.xy[:, 0] / KM_PER_DEG_LON
+        self.is_hub = rng.random(stops) < HUB_FRACTION
+        self.stop_ids = np.arange(1, stops + 1)
+
+        self.neighbours = cKDTree(self.xy).query(self.xy, k=NEIGHBOURS + 1)[1][:, 1:]
+
+    # ==================== STOPS ====================
+
+    def stops(self) -> List[Dict]:
+        """stops.json records (coordinates as strings, like the API)"""
+        return [
+            {'id': stop_id, 'longitude': f"{lon:.6f}", 'latitude': f"{lat:.6f}", 'isTransportHub': hub}
+            for stop_id, lon, lat, hub in zip(self.stop_ids.tolist(), self.lon.tolist(),
+                                              self.lat.tolist(), self.is_hub.tolist())
+        ]
+
+    # ==================== ROUTES ====================
+
+    def _walk(self, rng, start: int, heading: float, steps: int, visited: set) -> List[int]:
+        """Heading-biased walk to nearby unvisited stops"""
+        path = []
+        current = start
+        for _ in range(steps):
+            candidates = [c for c in self.neighbours[current].tolist() if c not in visited]
+            if not candidates:
+                break
+            vectors = self.xy[candidates] - self.xy[current]
+            alignment = (vectors @ np.array([math.cos(heading), math.sin(heading)])
+                         / np.maximum(np.hypot(vectors[:, 0], vectors[:, 1]), 1e-9))
+            # Boxed in ahead, the best candidate lies behind and the new heading turns around
+            best = int(np.argmax(alignment))
+            nxt = candidates[best]
+            dx, dy = self.xy[nxt] - self.xy[current]
+            heading = math.atan2(dy, dx) + rng.normal(0, HEADING_JITTER)
+            visited.add(nxt)
+            path.append(nxt)
+            current = nxt
+        return path
+
+    def route_sequences(self) -> Iterator[List[int]]:
+        """Direction-1 stop index sequence of each route"""
+        rng = np.random.default_rng(self._route_seed)
+        sequences = []
+        for _ in range(self.num_routes):
+            steps = int(rng.integers(self.route_stops[0], self.route_stops[1] + 1))
+            shared = []
+            if sequences and rng.random() < self.overlap:
+                source = sequences[int(rng.integers(len(sequences)))]
+                length = max(2, int(len(source) * rng.uniform(*SHARED_FRACTION_RANGE)))
+                offset = int(rng.integers(len(source) - length + 1))
+                shared = source[offset:offset + length]
+
+            if shared:
+                start = shared[-1]
+                dx, dy = self.xy[shared[-1]] - self.xy[shared[-2]]
+                heading = math.atan2(dy, dx)
+            else:
+                start = int(rng.integers(self.num_stops))
+                heading = rng.random() * 2 * math.pi
+                shared = [start]
+
+            sequence = shared + self._walk(rng, start, heading, steps, set(shared))
+            sequences.append(sequence)
+            yield sequence
+
+    def _flow_coordinates(self, rng, sequence: List[int]) -> List[Dict]:
+        """Route geometry: the stops plus slightly offset points between them"""
+        lat, lon = self.lat[sequence], self.lon[sequence]
+        t = np.arange(1, self.geometry_points + 1) / (self.geometry_points + 1)
+        mid_lat = lat[:-1, None] + (lat[1:] - lat[:-1])[:, None] * t
+        mid_lon = lon[:-1, None] + (lon[1:] - lon[:-1])[:, None] * t
+        mid_lat += rng.normal(0, 2e-5, mid_lat.shape)
+        mid_lon += rng.normal(0, 2e-5, mid_lon.shape)
+
+        points_lat = np.concatenate([np.column_stack([lat[:-1], mid_lat]).ravel(), lat[-1:]])
+        points_lon = np.concatenate([np.column_stack([lon[:-1], mid_lon]).ravel(), lon[-1:]])
+        return [{'lat': round(a, 6), 'lng': round(b, 6)} for a, b in zip(points_lat.tolist(), points_lon.tolist())]
+
+    def bus_details(self) -> Iterator[Dict]:
+        """busDetails records, generated one route at a time"""
+        rng = np.random.default_rng(self._route_seed.spawn(1)[0])
+        sequence_id = 1
+        route_id = 1
+
+        for index, forward in enumerate(self.route_sequences()):
+            bus_id = index + 1
+            number = str(bus_id)
+            lengths = np.hypot(*(self.xy[forward[1:]] - self.xy[forward[:-1]]).T)
+            length_km = float(lengths.sum())
+
+            stops = []
+            routes = []
+            for direction, sequence, segment_km in ((1, forward, lengths), (2, forward[::-1], lengths[::-1])):
+                intermediate = [0.0] + np.round(segment_km, 3).tolist()
+                total = np.round(np.cumsum(intermediate), 3).tolist()
+                for position, stop in enumerate(sequence):
+                    stop_id = int(self.stop_ids[stop])
+                    name = f"Stop {stop_id}"
+                    code = str(1000000 + stop_id)
+                    stops.append({
+                        'id': sequence_id,
+                        'stopCode': code,
+                        'stopName': name,
+                        'totalDistance': total[position],
+                        'intermediateDistance': intermediate[position],
+                        'directionTypeId': direction,
+                        'busId': bus_id,
+                        'stopId': stop_id,
+                        'stop': {
+                            'id': stop_id,
+                            'code': code,
+                            'name': name,
+                            'longitude': f"{self.lon[stop]:.6f}",
+                            'latitude': f"{self.lat[stop]:.6f}",
+                            'isTransportHub': bool(self.is_hub[stop])
+                        }
+                    })
+                    sequence_id += 1
+
+                routes.append({
+                    'id': route_id,
+                    'code': number,
+                    'destination': f"Stop {self.stop_ids[sequence[0]]} - Stop {self.stop_ids[sequence[-1]]}",
+                    'directionTypeId': direction,
+                    'busId': bus_id,
+                    'flowCoordinates': self._flow_coordinates(rng, sequence)
+                })
+                route_id += 1
+
+            yield {
+                'id': bus_id,
+                'carrier': f"Carrier {bus_id % 25 + 1}",
+                'number': number,
+                'firstPoint': f"Stop {self.stop_ids[forward[0]]}",
+                'lastPoint': f"Stop {self.stop_ids[forward[-1]]}",
+                'routLength': round(length_km),
+                'paymentTypeId': 2,
+                'cardPaymentDate': None,
+                'tariff': 50,
+                'regionId': 1,
+                'workingZoneTypeId': 5,
+                'paymentType': {'id': 2, 'name': 'Nəğd', 'description': None, 'isActive': True,
+                                'deactivedDate': None, 'priority': 2},
+                'region': {'id': 1, 'name': 'Bakı'},
+                'workingZoneType': {'id': 5, 'name': 'Şəhərdaxili'},
+                'stops': stops,
+                'routes': routes,
+                'tariffStr': '0.50 AZN',
+                'durationMinuts': max(10, round(length_km * MINUTES_PER_KM))
+            }
+
+    # ==================== OUTPUT ====================
+
+    def write(self, bus_details_path: str, stops_path: str, geometry: str = DEFAULT_GEOMETRY) -> Dict:
+        """Write both files (bus details as .json or streamed .ndjson); returns their sizes"""
+        os.makedirs(os.path.dirname(stops_path) or '.', exist_ok=True)
+        with open(stops_path, 'w', encoding='utf-8') as f:
+            json.dump(self.stops(), f, ensure_ascii=False, indent=2)
+
+        save_bus_details((prepare_details(details, geometry) for details in self.bus_details()), bus_details_path)
+
+        return {
+            'routes': self.num_routes,
+            'stops': self.num_stops,
+            'bus_details_mb': os.path.getsize(bus_details_path) / 1e6,
+            'stops_mb': os.path.getsize(stops_path) / 1e6
+        }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic bus network in the Ayna API schema")
+    parser.add_argument('--size', default='small',
+                        help=f"One of {', '.join(SIZES)} or ROUTESxSTOPS (e.g. 2000x20000)")
+    parser.add_argument('--overlap', type=float, default=DEFAULT_OVERLAP,
+                        help="Fraction of routes that share a corridor with an earlier route")
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED)
+    parser.add_argument('--geometry', choices=GEOMETRY_FORMATS, default=DEFAULT_GEOMETRY,
+                        help="Store route geometry as encoded polylines or raw coordinates")
+    parser.add_argument('--output-dir', default='data/synthetic')
+    parser.add_argument('--format', choices=('json', 'ndjson'), default='ndjson', help="Bus details file format")
+    args = parser.parse_args()
+
+    routes, stops = parse_size(args.size)
+    generator = SyntheticNetworkGenerator(routes, stops, overlap=args.overlap, seed=args.seed)
+    bus_details_path = os.path.join(args.output_dir, f"busDetails.{args.format}")
+    stops_path = os.path.join(args.output_dir, 'stops.json')
+    info = generator.write(bus_details_path, stops_path, geometry=args.geometry)
+
+    print(f"Generated {info['routes']} routes over {info['stops']} stops (overlap {args.overlap}, seed {args.seed})")
+    print(f"  {bus_details_path}: {info['bus_details_mb']:.1f} MB")
+    print(f"  {stops_path}: {info['stops_mb']:.1f} MB")
@@ -0,0 +1,213 @@
+"""
+Integer-Indexed Transit Graph
+Stop graph stored as CSR arrays for fast neighbour, degree and path queries
+"""
+
+from typing import Dict, List, Optional, Set
+import numpy as np
+from scipy import sparse
+
+
+class TransitGraph:
+    """
+    Stop graph with dense integer node ids and CSR adjacency
+
+    Stop ids are mapped to node ids 0..n-1 (in sorted stop id order).
+    Directed adjacency follows the order stops are driven; undirected
+    adjacency stores each undirected edge in both directions together with
+    its edge id, and per-edge route lists are kept as an edge x route CSR
+    matrix.
+    """
+
+    def __init__(self, stop_ids: np.ndarray,
+                 out_indptr: np.ndarray, out_indices: np.ndarray, out_order: np.ndarray,
+                 indptr: np.ndarray, indices: np.ndarray, edge_ids: np.ndarray,
+                 edges: np.ndarray, edge_routes: Optional[sparse.csr_matrix] = None,
+                 routes: Optional[List[str]] = None):
+        self.stop_ids = stop_ids          # node id -> stop id
+        self.out_indptr = out_indptr      # directed CSR
+        self.out_indices = out_indices
+        self.out_order = out_order        # nodes with successors, in order first driven from
+        self.indptr = indptr              # undirected CSR
+        self.indices = indices
+        self.edge_ids = edge_ids          # undirected edge id of each undirected CSR entry
+        self.edges = edges                # (E, 2) node ids of each undirected edge
+        self.edge_routes = edge_routes    # E x R CSR, routes using each edge
+        self.routes = routes              # route number of each edge_routes column
+
+    @classmethod
+    def from_segments(cls, from_stops, to_stops, edges=None,
+                      edge_routes: Optional[sparse.spmatrix] = None,
+                      routes: Optional[List[str]] = None) -> 'TransitGraph':
+        """
+        Build the graph from directed consecutive stop pairs (repeats allowed)
+
+        edges: optional (E, 2) array of undirected stop id pairs that fixes the
+        edge ids (e.g. the analyzer's edge index); derived from the segments
+        and sorted otherwise. edge_routes: optional E x R matrix of the routes
+        using each edge, with route numbers `routes`.
+        """
+        from_stops = np.asarray(from_stops, dtype=np.int64)
+        to_stops = np.asarray(to_stops, dtype=np.int64)
+        if edges is None:
+            edges = np.unique(
+                np.column_stack([np.minimum(from_stops, to_stops), np.maximum(from_stops, to_stops)]), axis=0
+            ).reshape(-1, 2)
+        edges = np.asarray(edges, dtype=np.int64).reshape(-1, 2)
+
+        stop_ids = np.unique(np.concatenate([from_stops, to_stops, edges.ravel()]))
+        n_nodes = len(stop_ids)
+
+        # Directed adjacency: unique (u, v) pairs sorted by u then v
+        u = np.searchsorted(stop_ids, from_stops)
+        v = np.searchsorted(stop_ids, to_stops)
+        keys, first_seen = np.unique(u * n_nodes + v, return_index=True)
+        out_u, out_v = keys // n_nodes, keys % n_nodes
+        out_indptr = np.concatenate([[0], np.cumsum(np.bincount(out_u, minlength=n_nodes))])
+
+        # Nodes with successors, ordered by the first segment driven from them
+        node_first_seen = np.full(n_nodes, len(from_stops), dtype=np.int64)
+        np.minimum.at(node_first_seen, out_u, first_seen)
+        has_out = np.diff(out_indptr) > 0
+        out_order = np.flatnonzero(has_out)
+        out_order = out_order[np.argsort(node_first_seen[out_order], kind='stable')]
+
+        # Undirected adjacency: each edge stored from both ends, self-loops once
+        a = np.searchsorted(stop_ids, edges[:, 0])
+        b = np.searchsorted(stop_ids, edges[:, 1])
+        eid = np.arange(len(edges), dtype=np.int64)
+        loop = a == b
+        src = np.concatenate([a, b[~loop]])
+        dst = np.concatenate([b, a[~loop]])
+        ids = np.concatenate([eid, eid[~loop]])
+        order = np.lexsort((dst, src))
+        indptr = np.concatenate([[0], np.cumsum(np.bincount(src, minlength=n_nodes))])
+
+        return cls(
+            stop_ids=stop_ids,
+            out_indptr=out_indptr.astype(np.int64), out_indices=out_v.astype(np.int32), out_order=out_order,
+            indptr=indptr.astype(np.int64), indices=dst[order].astype(np.int32), edge_ids=ids[order],
+            edges=np.column_stack([a, b]).astype(np.int32),
+            edge_routes=sparse.csr_matrix(edge_routes) if edge_routes is not None else None,
+            routes=routes
+        )
+
+    # ==================== SIZE ====================
+
+    @property
+    def n_nodes(self) -> int:
+        return len(self.stop_ids)
+
+    @property
+    def n_directed_edges(self) -> int:
+        return len(self.out_indices)
+
+    @property
+    def n_edges(self) -> int:
+        return len(self.edges)
+
+    @property
+    def nbytes(self) -> int:
+        """Memory held by the graph arrays"""
+        total = sum(arr.nbytes for arr in (
+            self.stop_ids, self.out_indptr, self.out_indices, self.out_order,
+            self.indptr, self.indices, self.edge_ids, self.edges
+        ))
+        if self.edge_routes is not None:
+            total += self.edge_routes.data.nbytes + self.edge_routes.indices.nbytes + self.edge_routes.indptr.nbytes
+        return total
+
+    # ==================== NODE LOOKUP ====================
+
+    def node(self, stop_id: int) -> int:
+        """Dense node id of a stop id"""
+        idx = int(np.searchsorted(self.stop_ids, stop_id))
+        if idx >= len(self.stop_ids) or self.stop_ids[idx] != stop_id:
+            raise KeyError(f"Stop {stop_id} is not in the graph")
+        return idx
+
+    def nodes(self, stop_ids) -> np.ndarray:
+        """Dense node ids of an array of stop ids (all must be in the graph)"""
+        return np.searchsorted(self.stop_ids, np.asarray(stop_ids, dtype=np.int64))
+
+    # ==================== NEIGHBOURS & DEGREES ====================
+
+    def out_neighbors(self, stop_id: int) -> np.ndarray:
+        """Stop ids that follow this stop on some route"""
+        u = self.node(stop_id)
+        return self.stop_ids[self.out_indices[self.out_indptr[u]:self.out_indptr[u + 1]]]
+
+    def neighbors(self, stop_id: int) -> np.ndarray:
+        """Stop ids connected to this stop in either direction"""
+        u = self.node(stop_id)
+        return self.stop_ids[self.indices[self.indptr[u]:self.indptr[u + 1]]]
+
+    def out_degree(self, stop_id: int) -> int:
+        u = self.node(stop_id)
+        return int(self.out_indptr[u + 1] - self.out_indptr[u])
+
+    def degree(self, stop_id: int) -> int:
+        u = self.node(stop_id)
+        return int(self.indptr[u + 1] - self.indptr[u])
+
+    @property
+    def out_degrees(self) -> np.ndarray:
+        """Out-degree of every node"""
+        return np.diff(self.out_indptr)
+
+    @property
+    def degrees(self) -> np.ndarray:
+        """Undirected degree of every node"""
+        return np.diff(self.indptr)
+
+    def edge_id(self, stop_a: int, stop_b: int) -> int:
+        """Undirected edge id between two stops"""
+        u, v = self.node(stop_a), self.node(stop_b)
+        start, end = self.indptr[u], self.indptr[u + 1]
+        pos = start + int(np.searchsorted(self.indices[start:end], v))
+        if pos >= end or self.indices[pos] != v:
+            raise KeyError(f"No edge between stops {stop_a} and {stop_b}")
+        return int(self.edge_ids[pos])
+
+    def routes_on_edge(self, stop_a: int, stop_b: int) -> List[str]:
+        """Route numbers using the edge between two stops"""
+        e = self.edge_id(stop_a, stop_b)
+        row = self.edge_routes.indices[self.edge_routes.indptr[e]:self.edge_routes.indptr[e + 1]]
+        return [self.routes[r] for r in row.tolist()]
+
+    # ==================== TOPOLOGY METRICS ====================
+
+    def out_degree_dict(self) -> Dict[int, int]:
+        """{stop_id: out-degree} for stops with successors, in the order first driven from"""
+        return dict(zip(self.stop_ids[self.out_order].tolist(), self.out_degrees[self.out_order].tolist()))
+
+    def adjacency_dict(self) -> Dict[int, Set[int]]:
+        """{stop_id: set of successor stop ids}, the dict-of-sets view of the directed adjacency"""
+        stop_ids = self.stop_ids.tolist()
+        out_indptr = self.out_indptr.tolist()
+        out_indices = self.out_indices.tolist()
+        return {
+            stop_ids[u]: {stop_ids[v] for v in out_indices[out_indptr[u]:out_indptr[u + 1]]}
+            for u in self.out_order.tolist()
+        }
+
+    def density(self) -> float:
+        """
+        Network density (actual edges / possible edges) over stops with successors,
+        counting each directed successor link as half an undirected edge
+        """
+        n_nodes = len(self.out_order)
+        if n_nodes <= 1:
+            return 0.0
+
+        actual_edges = self.n_directed_edges / 2
+        possible_edges = n_nodes * (n_nodes - 1) / 2
+        return actual_edges / possible_edges
+
+    def to_scipy(self, directed: bool = True) -> sparse.csr_matrix:
+        """Adjacency as a SciPy CSR matrix (for scipy.sparse.csgraph path algorithms)"""
+        if directed:
+            data = np.ones(self.n_directed_edges, dtype=np.int8)
+            return sparse.csr_matrix((data, self.out_indices, self.out_indptr), shape=(self.n_nodes, self.n_nodes))
+        data = np.ones(len(self.indices), dtype=np.int8)
+        return sparse.csr_matrix((data, self.indices, self.indptr), shape=(self.n_nodes, self.n_nodes))